@@ -0,0 +1,272 @@
+"""
+Benchmarks the stages of the pipeline on synthetic corpora of several sizes, entirely in memory and offline.
+For each corpus size, the articles are preprocessed, a vocabulary and feature vectors are created from them,
+the feature vectors are converted to a feature matrix and target values, and a multinomial Naive Bayes classifier
+is cross-validated on those. Each stage is timed and its peak memory use is measured with tracemalloc,
+in a separate run so that tracing doesn't distort the timing.
+
+The results are written as JSON, and can be compared against a stored baseline to detect regressions:
+a stage is reported as regressed if it is slower than its baseline by more than the given tolerance.
+"""
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy
+import scipy
+import sklearn
+
+from argparse import ArgumentParser
+from argparse import RawTextHelpFormatter
+from collections import namedtuple
+from contextlib import redirect_stdout
+from datetime import datetime
+from sklearn.naive_bayes import MultinomialNB
+
+from benchmarks.synthetic_corpus import create_target_classes, generate_articles, stop_words
+from learning.create_vocabulary_and_vectors import create_feature_vectors, create_vocabulary
+from learning.prepare_data import get_feature_vectors_and_target_values
+from learning.train_evaluate_classifiers import evaluate_classifier_using_repeated_cross_validation
+from preprocessing.process_articles import preprocess_text
+
+benchmark_format_version = 1
+default_scales = (1000, 10000, 100000)
+default_baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+BenchmarkResult = namedtuple('BenchmarkResult', ['stage', 'num_articles', 'seconds', 'peak_memory'])
+Comparison = namedtuple('Comparison', ['stage', 'num_articles', 'seconds', 'baseline_seconds', 'ratio', 'regressed'])
+
+
+def measure(function, args, repeat=1, trace_memory=True):
+    """
+    :param function: function to measure
+    :param args: tuple of arguments to call function with
+    :param repeat: number of timed calls, of which the fastest is reported
+    :param trace_memory: whether to call function once more while tracing memory allocations
+    :return:
+        - return value of function
+        - number of seconds taken by the fastest call
+        - peak size in bytes of the memory allocated during the traced call, or None if memory wasn't traced
+    """
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    peak_memory = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            function(*args)
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak_memory
+
+
+def preprocess_articles(articles):
+    """
+    :param articles: list of raw article dicts as returned by 'generate_articles'
+    :return: list of preprocessed article dicts, as stored in the 'articles_processed' collection
+    """
+    stop_word_set = frozenset(stop_words)
+    return [
+        {
+            '_id': article['_id'],
+            'title': preprocess_text(article['title'], stop_word_set),
+            'text': preprocess_text(article['text'], stop_word_set),
+            'num_comments': article['num_comments']
+        }
+        for article in articles
+    ]
+
+
+def benchmark_scale(num_articles, repeat=1, trace_memory=True, n_folds=5, iterations=1, seed=0):
+    """
+    Runs all stages of the pipeline on a synthetic corpus of num_articles articles, each on the output of the previous.
+    :param num_articles: number of articles in the corpus
+    :param repeat: number of timed runs of each stage, of which the fastest is reported
+    :param trace_memory: whether to measure the peak memory use of each stage
+    :param n_folds: number of folds to cross-validate the classifier with
+    :param iterations: number of repetitions of the cross-validation
+    :param seed: seed for generating the corpus and shuffling the folds
+    :return: list of BenchmarkResult, one for each stage
+    """
+    articles = generate_articles(num_articles, seed=seed)
+    target_classes = create_target_classes([article['num_comments'] for article in articles])
+    classifier = MultinomialNB()
+    results = []
+
+    def run_stage(stage, function, *args):
+        result, seconds, peak_memory = measure(function, args, repeat, trace_memory)
+        results.append(BenchmarkResult(stage, num_articles, seconds, peak_memory))
+        print('%s on %d articles: %.3f seconds%s' %
+              (stage, num_articles, seconds, ', peak memory %.1f MB' % (peak_memory / 2 ** 20) if trace_memory else ''),
+              file=sys.stderr)
+        return result
+
+    # The stages print their progress, which would end up in the JSON output
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        processed_articles = run_stage('preprocess_text', preprocess_articles, articles)
+        vocabulary = run_stage('create_vocabulary', create_vocabulary, processed_articles)
+        feature_vector_dicts = run_stage('create_feature_vectors', create_feature_vectors, vocabulary,
+                                         processed_articles)
+        feature_vectors, target_values = run_stage('get_feature_vectors_and_target_values',
+                                                   get_feature_vectors_and_target_values, feature_vector_dicts,
+                                                   target_classes, len(vocabulary))
+        run_stage('evaluate_classifier_using_repeated_cross_validation',
+                  evaluate_classifier_using_repeated_cross_validation, classifier, feature_vectors, target_values,
+                  n_folds, iterations, 1, seed)
+    return results
+
+
+def get_environment():
+    """
+    :return: dict describing the machine and library versions the benchmarks ran with
+    """
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': numpy.__version__,
+        'scipy': scipy.__version__,
+        'scikit-learn': sklearn.__version__
+    }
+
+
+def compare_to_baseline(results, baseline_results, tolerance=0.25):
+    """
+    :param results: list of BenchmarkResult
+    :param baseline_results: list of BenchmarkResult to compare against
+    :param tolerance: fraction by which a stage may be slower than its baseline before it is considered regressed
+    :return: list of Comparison, for each result that has a baseline result of the same stage and number of articles
+    """
+    baseline_seconds = {(result.stage, result.num_articles): result.seconds for result in baseline_results}
+    comparisons = []
+    for result in results:
+        key = (result.stage, result.num_articles)
+        if key not in baseline_seconds:
+            continue
+        ratio = result.seconds / baseline_seconds[key] if baseline_seconds[key] > 0 else float('inf')
+        comparisons.append(Comparison(result.stage, result.num_articles, result.seconds, baseline_seconds[key], ratio,
+                                      ratio > 1 + tolerance))
+    return comparisons
+
+
+def create_report(results, environment, comparisons=None):
+    """
+    :param results: list of BenchmarkResult
+    :param environment: dict as returned by 'get_environment'
+    :param comparisons: list of Comparison, or None if results weren't compared against a baseline
+    :return: JSON-serializable dict containing results, environment and comparisons
+    """
+    report = {
+        'version': benchmark_format_version,
+        'created': datetime.now().isoformat(),
+        'environment': environment,
+        'results': [result._asdict() for result in results]
+    }
+    if comparisons is not None:
+        report['comparisons'] = [comparison._asdict() for comparison in comparisons]
+    return report
+
+
+def load_results(path):
+    """
+    :param path: path of a JSON report written by this script
+    :return: list of BenchmarkResult contained in the report
+    """
+    with open(path) as report_file:
+        report = json.load(report_file)
+    if report.get('version') != benchmark_format_version:
+        raise ValueError('%s does not contain supported benchmark results.' % path)
+    return [BenchmarkResult(**result) for result in report['results']]
+
+
+def parse_scales(value):
+    """
+    :param value: comma-separated string of numbers of articles
+    :return: list of the numbers of articles as integers
+    """
+    return [int(scale) for scale in value.split(',')]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description="Benchmarks the preprocessing, vectorization and evaluation stages on synthetic corpora,\n"
+                    "and compares the timings against a stored baseline.\n",
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--scales', type=parse_scales, default=list(default_scales),
+        help='Comma-separated numbers of articles of the corpora to benchmark (default: %s)' %
+             ','.join(str(scale) for scale in default_scales)
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help='Number of timed runs of each stage, of which the fastest is reported (default: 1)'
+    )
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help='Skip measuring the peak memory use of each stage'
+    )
+    parser.add_argument(
+        '--folds', type=int, default=5,
+        help='Number of cross-validation folds (default: 5)'
+    )
+    parser.add_argument(
+        '--iterations', type=int, default=1,
+        help='Number of repetitions of the cross-validation (default: 1)'
+    )
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='Seed for generating the corpora and shuffling the folds (default: 0)'
+    )
+    parser.add_argument(
+        '--output',
+        help='File to write the JSON results to (default: standard output)'
+    )
+    parser.add_argument(
+        '--baseline', default=default_baseline_path,
+        help='JSON results to compare against (default: benchmarks/baseline.json)'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25,
+        help='Fraction by which a stage may be slower than its baseline before failing (default: 0.25)'
+    )
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='Write the results to the baseline file instead of comparing against it'
+    )
+    args = parser.parse_args()
+
+    benchmark_results = []
+    for scale in args.scales:
+        benchmark_results.extend(benchmark_scale(scale, args.repeat, not args.no_memory, args.folds, args.iterations,
+                                                 args.seed))
+
+    baseline_comparisons = None
+    if not args.save_baseline and os.path.exists(args.baseline):
+        baseline_comparisons = compare_to_baseline(benchmark_results, load_results(args.baseline), args.tolerance)
+        for comparison in baseline_comparisons:
+            print('%s%s on %d articles: %.3f seconds, baseline %.3f seconds (%.2fx)' %
+                  ('REGRESSED ' if comparison.regressed else '', comparison.stage, comparison.num_articles,
+                   comparison.seconds, comparison.baseline_seconds, comparison.ratio), file=sys.stderr)
+
+    benchmark_report = create_report(benchmark_results, get_environment(), baseline_comparisons)
+    output_path = args.baseline if args.save_baseline else args.output
+    if output_path:
+        with open(output_path, 'w') as output_file:
+            json.dump(benchmark_report, output_file, indent=2)
+    else:
+        json.dump(benchmark_report, sys.stdout, indent=2)
+        print()
+
+    if baseline_comparisons and any(comparison.regressed for comparison in baseline_comparisons):
+        exit(1)
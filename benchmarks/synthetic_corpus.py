@@ -0,0 +1,96 @@
+"""
+Generates synthetic corpora of Dutch-like news articles for benchmarking the pipeline without network or database.
+Words are built from Dutch syllables and drawn from a Zipf distribution, interspersed with common Dutch stopwords
+and punctuation, so that preprocessing, vocabulary size and sparsity behave roughly like those of real articles.
+"""
+import numpy
+
+from bson import ObjectId
+
+stop_words = [
+    'de', 'en', 'van', 'ik', 'te', 'dat', 'die', 'in', 'een', 'hij', 'het', 'niet', 'zijn', 'is', 'was', 'op', 'aan',
+    'met', 'als', 'voor', 'had', 'er', 'maar', 'om', 'hem', 'dan', 'zou', 'of', 'wat', 'mijn', 'men', 'dit', 'zo',
+    'door', 'over', 'ze', 'zich', 'bij', 'ook', 'tot', 'je', 'mij', 'uit', 'der', 'daar', 'haar', 'naar', 'heb', 'hoe',
+    'heeft', 'hebben', 'deze', 'u', 'want', 'nog', 'zal', 'me', 'zij', 'nu', 'ge', 'geen', 'omdat', 'iets', 'worden'
+]
+syllables = [
+    'aan', 'be', 'ge', 'ver', 'ont', 'sch', 'ra', 'lo', 'me', 'ni', 'ker', 'ten', 'heid', 'lijk', 'ing', 'pol', 'tie',
+    'rec', 'ht', 'ban', 'ken', 'we', 'reld', 'stad', 'mi', 'nis', 'ter', 'raad', 'ei', 'land', 'oor', 'log', 'wet',
+    'ge', 'ving', 'voet', 'bal', 'club', 'be', 'richt', 'on', 'der', 'zoek', 'ma', 'ken', 'zorg', 'kos', 'ten'
+]
+punctuation = ['.', ',', '!', '?', ':', ';']
+
+default_vocabulary_size = 50000
+default_title_length = 8
+default_text_length = 250
+
+
+def create_word_list(num_words, random_state):
+    """
+    :param num_words: number of distinct words to create
+    :param random_state: NumPy RandomState to draw syllables from
+    :return: list of 'num_words' distinct Dutch-like words
+    """
+    words = []
+    seen = set(stop_words)
+    while len(words) < num_words:
+        # Draw syllables for many words at once, since most of them will be distinct
+        lengths = random_state.randint(1, 5, num_words)
+        syllable_indices = random_state.randint(0, len(syllables), (num_words, 4))
+        for length, indices in zip(lengths, syllable_indices):
+            word = ''.join(syllables[index] for index in indices[:length])
+            if word not in seen and len(words) < num_words:
+                seen.add(word)
+                words.append(word)
+    return words
+
+
+def generate_articles(num_articles, vocabulary_size=default_vocabulary_size, title_length=default_title_length,
+                      text_length=default_text_length, seed=0):
+    """
+    :param num_articles: number of articles to generate
+    :param vocabulary_size: number of distinct non-stopwords to draw from
+    :param title_length: mean number of words per title
+    :param text_length: mean number of words per text
+    :param seed: seed making the corpus reproducible
+    :return: list of article dicts of the form stored in the 'articles' collection, containing an '_id',
+        'title', 'text' and 'num_comments'
+    """
+    random_state = numpy.random.RandomState(seed)
+    words = numpy.array(create_word_list(vocabulary_size, random_state) + stop_words)
+    # Zipf-distributed ranks make a few words very common and most words rare, as in natural language
+    ranks = numpy.arange(1, vocabulary_size + 1)
+    word_probabilities = 1.0 / ranks
+    word_probabilities = 0.6 * word_probabilities / word_probabilities.sum()
+    all_probabilities = numpy.concatenate([word_probabilities, numpy.full(len(stop_words), 0.4 / len(stop_words))])
+    # Sampling by searching uniform draws in the cumulative distribution avoids recomputing it for every text
+    cumulative_probabilities = numpy.cumsum(all_probabilities)
+    cumulative_probabilities /= cumulative_probabilities[-1]
+
+    def generate_text(mean_length):
+        length = max(1, random_state.poisson(mean_length))
+        tokens = words[numpy.searchsorted(cumulative_probabilities, random_state.random_sample(length))].tolist()
+        for position in random_state.randint(0, length, length // 12):
+            tokens[position] += random_state.choice(punctuation)
+        tokens[0] = tokens[0].capitalize()
+        return ' '.join(tokens)
+
+    return [
+        {
+            '_id': ObjectId(),
+            'title': generate_text(title_length),
+            'text': generate_text(text_length),
+            'num_comments': int(random_state.geometric(0.02)) - 1
+        }
+        for _ in range(num_articles)
+    ]
+
+
+def create_target_classes(num_comments, class_names=('very_low', 'low', 'medium', 'high', 'very_high')):
+    """
+    :param num_comments: NumPy ndarray of numbers of comments of the generated articles
+    :param class_names: class labels, from the lowest to the highest number of comments
+    :return: dictionary containing a 'target class label -> comment interval' mapping covering num_comments
+    """
+    from learning.prepare_data import get_quantile_classes
+    return get_quantile_classes(numpy.asarray(num_comments), list(class_names))
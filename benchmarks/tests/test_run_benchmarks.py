@@ -0,0 +1,30 @@
+from unittest import TestCase
+
+from benchmarks.run_benchmarks import BenchmarkResult, benchmark_scale, compare_to_baseline
+from benchmarks.synthetic_corpus import generate_articles
+
+
+class TestRunBenchmarks(TestCase):
+    def test_generate_articles_is_reproducible(self):
+        articles = generate_articles(5, vocabulary_size=100, seed=1)
+        other_articles = generate_articles(5, vocabulary_size=100, seed=1)
+        self.assertListEqual([article['text'] for article in articles],
+                             [article['text'] for article in other_articles])
+        self.assertTrue(all(article['num_comments'] >= 0 for article in articles))
+
+    def test_benchmark_scale_measures_all_stages(self):
+        results = benchmark_scale(50, n_folds=2)
+        self.assertListEqual(
+            ['preprocess_text', 'create_vocabulary', 'create_feature_vectors', 'get_feature_vectors_and_target_values',
+             'evaluate_classifier_using_repeated_cross_validation'],
+            [result.stage for result in results]
+        )
+        self.assertTrue(all(result.num_articles == 50 and result.peak_memory > 0 for result in results))
+
+    def test_compare_to_baseline_flags_stages_slower_than_tolerance(self):
+        baseline = [BenchmarkResult('a', 10, 1.0, None), BenchmarkResult('b', 10, 1.0, None)]
+        results = [BenchmarkResult('a', 10, 1.2, None), BenchmarkResult('b', 10, 1.5, None),
+                   BenchmarkResult('a', 100, 5.0, None)]
+        comparisons = compare_to_baseline(results, baseline, tolerance=0.25)
+        self.assertListEqual([('a', False), ('b', True)],
+                             [(comparison.stage, comparison.regressed) for comparison in comparisons])
@@ -0,0 +1,61 @@
+"""
+Bloom filter, a compact set of strings that can only answer whether a string was probably added or certainly wasn't.
+It is used by the crawler daemon to remember the URLs of all articles it has seen, in a fraction of the memory
+a set of the URLs would take. A string that was added is always reported as added; a string that wasn't is
+reported as added with a probability close to the false positive rate the filter was sized for,
+as long as no more strings than its capacity are added.
+"""
+import hashlib
+import math
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, false_positive_rate=1e-6):
+        """
+        :param capacity: number of strings the filter is sized for
+        :param false_positive_rate: probability that a string that wasn't added is reported as added,
+            once 'capacity' strings have been added
+        """
+        if capacity < 1:
+            raise ValueError("'capacity' must be at least 1.")
+        if not 0 < false_positive_rate < 1:
+            raise ValueError("'false_positive_rate' must be between 0 and 1.")
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        # Optimal number of bits and hash functions for the capacity and false positive rate
+        self.num_bits = int(math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._count = 0
+
+    def add(self, item):
+        """
+        :param item: string to add
+        """
+        for position in self._get_positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._get_positions(item))
+
+    def __len__(self):
+        """
+        :return: number of strings added, including strings added more than once
+        """
+        return self._count
+
+    def get_size(self):
+        """
+        :return: size in bytes of the bits of the filter
+        """
+        return len(self._bits)
+
+    def _get_positions(self, item):
+        """
+        :return: positions of the bits of item, derived from two 64-bit hashes by double hashing
+        """
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], 'little')
+        second_hash = int.from_bytes(digest[8:], 'little') | 1
+        return ((first_hash + index * second_hash) % self.num_bits for index in range(self.num_hashes))
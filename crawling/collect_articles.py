@@ -1,67 +1,114 @@
 """
 Script to retrieve news articles from NU.nl, insert them into a MongoDB database,
 and update them with the number of comments they have received.
+Downloaded pages can be kept in an on-disk response cache, from which they are revalidated instead of downloaded
+again, or replayed without making any requests.
+The fields of articles are extracted as described by a site schema, see 'site_schema.py'.
 """
 import errno
+import io
 import logging
 import lxml.html as html_parser
 import os
+import time
 import urllib.request
 import re
 
+from argparse import ArgumentParser
+from argparse import RawTextHelpFormatter
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from pymongo import MongoClient
-from pymongo.collection import Collection
-from pymongo.database import Database
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from urllib.error import URLError
 
-db_name = 'nu'
+from crawling.extraction import extract_fields, parse_page
+from crawling.http_client import HttpClient
+from crawling.response_cache import ResponseCache, default_max_size
+from crawling.site_schema import compile_site_schema, load_site_schema, nu_nl_schema
+from instrumentation import metrics
+from storage import connection
+
 collection_name = 'articles'
-db = Database(MongoClient(), db_name)
-collection = Collection(db, collection_name)
+db = connection.get_database()
+collection = connection.get_collection(collection_name)
 
 base_url = 'http://www.nu.nl'
+duplicate_key_error_code = 11000
+request_timeout = 10
+site_schema = compile_site_schema(nu_nl_schema)
+article_fields = ['published', 'title', 'text']
 
 
-def collect_articles():
+def collect_articles(client=None, max_workers=1):
     """ Retrieves articles that aren't yet in the database and saves them to the database.
+    :param client: optional HttpClient to download pages with
+    :param max_workers: maximum number of articles to download concurrently
     """
-    retrieved_urls = get_retrieved_urls()
-    front_page = get_front_page()
-    articles = get_articles(front_page, retrieved_urls)
+    ensure_indexes()
+    front_page = get_front_page(client)
+    article_urls = get_article_urls(front_page)
+    retrieved_urls = get_retrieved_urls(article_urls)
+    articles = get_articles(article_urls, retrieved_urls, client, max_workers)
     save_articles(articles)
 
 
-def get_retrieved_urls():
+def ensure_indexes():
+    """
+    Creates a unique index on the 'url' field of the articles collection, if it doesn't exist yet.
+    """
+    collection.create_index('url', unique=True)
+
+
+def get_retrieved_urls(urls):
     """
-    :return: list of URLs of all articles in the database
+    :param urls: candidate URLs to look up
+    :return: set of the URLs in 'urls' that belong to an article already in the database
     """
-    retrieved_articles = collection.find({}, {'url': 1})
-    retrieved_urls = [article['url'] for article in retrieved_articles]
+    with metrics.timer('mongo_read_seconds', collection=collection_name):
+        retrieved_articles = collection.find({'url': {'$in': list(urls)}}, {'url': 1, '_id': 0})
+        retrieved_urls = set(article['url'] for article in retrieved_articles)
     logging.info('Found %d URLs already retrieved...\n' % len(retrieved_urls))
     return retrieved_urls
 
 
-def get_front_page():
+def get_front_page(client=None):
     """
+    :param client: optional HttpClient to download the page with
     :return: page at URL 'base_url'
     """
     logging.info("Checking for articles on %s..." % base_url)
     try:
-        return download_page(base_url)
+        return download_page(base_url, client)
     except urllib.error.URLError:
         logging.error('Could not access %s.' % base_url)
         exit()
 
 
-def get_articles(page, retrieved_urls):
+def get_articles(article_urls, retrieved_urls, client=None, max_workers=1):
+    """
+    :param article_urls: URLs of news articles found on the front page
+    :param retrieved_urls: set of URLs of articles already in the database
+    :param client: optional HttpClient to download articles with
+    :param max_workers: maximum number of articles to download concurrently
+    :return: Retrieves all articles in 'article_urls' that are not in 'retrieved_urls'.
+    """
+    # Skip if already processed
+    new_article_urls = [article_url for article_url in article_urls if article_url not in retrieved_urls]
+    articles = fetch_articles(new_article_urls, client, max_workers)
+
+    logging.info("Retrieved %d new articles, skipped %d existing ones.\n" %
+                 (len(articles), len(article_urls) - len(articles)))
+    return articles
+
+
+def get_article_urls(page):
     """
     :param page: page containing URLs of news articles
-    :param retrieved_urls: URLs of articles already in the database
-    :return: Retrieves all articles on 'page' the URLs of which are not in 'retrieved_urls'.
+    :return: list of unique absolute URLs of the news articles on 'page', in order of appearance
     """
-    num_links_processed = 0
-    articles = []
+    article_urls = []
     # Article URLs are contained in <a> elements inside <div class="column-content">
     url_elements = page.xpath('//div[@class="column-content"]//a')
 
@@ -71,37 +118,52 @@ def get_articles(page, retrieved_urls):
             url = values[0]
             # Check whether URL belongs to a news item
             if 'advertorial' not in url and 'video' not in url and re.match('/.+/\\d+/.+', url):
-                num_links_processed += 1
                 article_url = '%s%s' % (base_url, url)
-                # Skip if already processed
-                if article_url not in retrieved_urls:
-                    article = process_article('%s%s' % (base_url, url))
-                    if article is not None:
-                        articles.append(article)
+                if article_url not in article_urls:
+                    article_urls.append(article_url)
+    return article_urls
 
-    logging.info("Retrieved %d new articles, skipped %d existing ones.\n" %
-                 (len(articles), num_links_processed - len(articles)))
-    return articles
+
+def fetch_articles(urls, client=None, max_workers=1):
+    """
+    Downloads and processes the articles at 'urls', using up to 'max_workers' threads.
+    :param urls: URLs of articles to retrieve
+    :param client: optional HttpClient to download articles with
+    :param max_workers: maximum number of articles to download concurrently
+    :return: list of dicts containing article contents, in the order of 'urls'; articles that could not be
+        retrieved or processed are left out
+    """
+    if max_workers <= 1 or len(urls) <= 1:
+        articles = [process_article(url, client) for url in urls]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            articles = list(executor.map(lambda url: process_article(url, client), urls))
+    return [article for article in articles if article is not None]
 
 
-def process_article(url):
+def process_article(url, client=None):
     """
     :param url: URL of article to process
+    :param client: optional HttpClient to download the article with
     :return: dict containing article contents
     """
     print('Retrieving article from %s...' % url)
     # Retrieve article
     try:
-        article = download_page(url)
+        page_bytes = download(url, client)
     except URLError:
         logging.warning('Could not retrieve article from %s.' % url)
+        metrics.increment('articles_failed_total', reason='download')
         return None
     # Extract contents
     article_contents = None
     try:
+        with metrics.timer('html_parse_seconds'):
+            article = parse_page(page_bytes, site_schema, article_fields)
         article_contents = extract_article_contents(article)
-    except AttributeError:
+    except ValueError:
         logging.warning('Could not process article on %s.' % url)
+        metrics.increment('articles_failed_total', reason='extraction')
     if article_contents is not None:
         article_contents['url'] = url
     return article_contents
@@ -111,97 +173,295 @@ def extract_article_contents(article):
     """
     :param article: article to extract contents of
     :return: dict containing article contents
+    :raises ValueError: if the title or publication date can't be found or parsed
     """
-    # Extract publication date
-    published = article.find('//span[@class="pubdate small"]').text.strip()
-    published_date = datetime.strptime(published, '%d-%m-%y %H:%M')
-    # Extract title
-    title = article.find('//h1[@class="title fluid"]').text.strip()
-    # Extract article text
-    text = extract_article_text(article)
-
+    fields = extract_fields(article, site_schema, article_fields)
     return dict(
-        published=published_date,
-        title=title,
-        text=text,
+        published=fields['published'],
+        title=fields['title'],
+        text=fields['text'],
         num_comments=None
     )
 
 
-def extract_article_text(article):
+def update_number_of_comments(client=None, max_workers=1, batch_size=100):
     """
-    :param article: article to extract text of
-    :return: string containing all text of article
+    Retrieves the number of comments for each article published at least 24 hours ago.
+    Updates the corresponding article document with the retrieved number of comments.
+    Pages are retrieved and parsed by up to 'max_workers' threads; the resulting updates and deletes
+    are written in bulk writes of at most 'batch_size' operations.
+    :param client: optional HttpClient to download article pages with
+    :param max_workers: maximum number of article pages to retrieve concurrently
+    :param batch_size: maximum number of operations per bulk write
+    :return: Counter containing the number of articles 'retrieved', 'updated', 'deleted' and 'failed'
     """
-    text = ''
-    text_elements = article.xpath('//div[@class="block-wrapper"]//div[@class="block-content"]//p')
-    for text_element in text_elements:
-        element_text = text_element.text
-        if element_text:
-            text += element_text.strip()
-    return text
+    start_time = time.time()
+    statistics = Counter()
+    for _ in refresh_number_of_comments(client, max_workers, batch_size, statistics):
+        pass
+
+    elapsed_time = time.time() - start_time
+    if statistics['retrieved'] > 0:
+        logging.info('Updated number of comments for %d articles, deleted %d and failed %d '
+                     'in %.1f seconds (%.2f articles per second).' %
+                     (statistics['updated'], statistics['deleted'], statistics['failed'], elapsed_time,
+                      statistics['retrieved'] / max(elapsed_time, 1e-6)))
+    return statistics
 
 
-def update_number_of_comments():
+def refresh_number_of_comments(client=None, max_workers=1, batch_size=100, statistics=None, fields=('url',)):
     """
-    Retrieves the number of comments for each article published at least 24 hours ago.
-    Updates the corresponding article document with the retrieved number of comments.
+    Updates the number of comments of articles published at least 24 hours ago, one batch at a time,
+    yielding the articles of each batch that have been updated, so they can be processed further right away.
+    :param client: optional HttpClient to download article pages with
+    :param max_workers: maximum number of article pages to retrieve concurrently
+    :param batch_size: maximum number of operations per bulk write
+    :param statistics: optional Counter to add the number of articles 'retrieved', 'updated', 'deleted'
+        and 'failed' to
+    :param fields: fields of the articles to retrieve from the database, in addition to '_id' and 'url'
+    :return: generator of lists of article documents containing '_id', 'num_comments' and fields
     """
+    statistics = statistics if statistics is not None else Counter()
     date = datetime.now() - timedelta(days=1)
     # Get articles older than 24 hours which haven't yet had their number of comments updated
-    articles = collection.find({'published': {'$lt': date}, 'num_comments': None})
+    articles = collection.find({'published': {'$lt': date}, 'num_comments': None},
+                               {field: 1 for field in set(fields) | {'url'}})
     logging.info('Updating number of comments for %d articles...' % articles.count())
 
-    num_comments_updated = 0
-    for article in articles:
-        article_url = article['url']
-        logging.info('Retrieving comments from %s...' % article_url)
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        for batch in iterate_in_batches(articles, batch_size):
+            batch_operations = update_comments(batch, executor, client, statistics)
+            yield [article for article, operation in zip(batch, batch_operations) if isinstance(operation, UpdateOne)]
+
+
+def update_comments(articles, executor, client=None, statistics=None):
+    """
+    Retrieves the number of comments of articles, and writes the resulting updates and deletes
+    in a single unordered bulk write, so an operation that fails doesn't keep the others from being written.
+    :param articles: list of article documents containing an '_id' and a 'url'
+    :param executor: ThreadPoolExecutor to retrieve the article pages with
+    :param client: optional HttpClient to download article pages with
+    :param statistics: optional Counter to add the number of articles 'retrieved', 'updated', 'deleted'
+        and 'failed' to
+    :return: list containing for each article the UpdateOne or DeleteOne that was written,
+        or None if its page could not be retrieved or parsed, or writing the operation failed
+    """
+    batch_operations = list(executor.map(lambda article: get_comments_update(article, client), articles))
+    operation_indexes = [index for index, operation in enumerate(batch_operations) if operation is not None]
+    batch_statistics = Counter(retrieved=len(articles), failed=len(articles) - len(operation_indexes))
+    if operation_indexes:
         try:
-            article_page = download_page(article_url)
-        except URLError:
-            logging.warning('Could not retrieve article page from %s.' % article_url)
-            continue
-
-        # Extract the number of comments
-        comments_element = article_page.find('//span[@class="comments-count"]')
-        if comments_element is None:
-            logging.warning('Could not find comments, deleting article with id %s...' %
-                            article['_id'])
-            collection.delete_one({'_id': article['_id']})
-            continue
-
-        # Update article with the number of comments it has received
-        comments_text = comments_element.text.strip()
-        if 'K' in comments_text:
-            comments_text = comments_text[:-1]
-            num_comments = int(float(comments_text) * 1000)
-        else:
-            num_comments = int(comments_text)
-        article_id = article['_id']
-        collection.update_one({'_id': article_id}, {'$set': {'num_comments': num_comments}})
-        logging.info('Found %d comments for article with id %s...' % (num_comments, article_id))
-        num_comments_updated += 1
+            with metrics.timer('mongo_write_seconds', collection=collection_name):
+                result = collection.bulk_write([batch_operations[index] for index in operation_indexes],
+                                               ordered=False)
+            batch_statistics.update(updated=result.modified_count, deleted=result.deleted_count)
+        except BulkWriteError as e:
+            write_errors = e.details['writeErrors']
+            logging.error('Could not write %d comment updates: %s' % (len(write_errors), e))
+            batch_statistics.update(updated=e.details['nModified'], deleted=e.details['nRemoved'],
+                                    failed=len(write_errors))
+            for error in write_errors:
+                batch_operations[operation_indexes[error['index']]] = None
+    if statistics is not None:
+        statistics.update(batch_statistics)
+    for outcome in ('updated', 'deleted', 'failed'):
+        metrics.increment('comment_updates_total', batch_statistics[outcome], outcome=outcome)
+    return batch_operations
+
+
+def get_comments_update(article, client=None):
+    """
+    :param article: article document containing an '_id' and a 'url', whose 'num_comments' is set
+        if its page shows a number of comments
+    :param client: optional HttpClient to download the article page with
+    :return:
+        - UpdateOne setting 'num_comments' of the article if its page shows a number of comments
+        - DeleteOne removing the article if its page doesn't show a number of comments
+        - None if the article page could not be retrieved or parsed
+    """
+    article_id = article['_id']
+    article_url = article['url']
+    logging.info('Retrieving comments from %s...' % article_url)
+    try:
+        page_bytes = download(article_url, client)
+    except URLError:
+        logging.warning('Could not retrieve article page from %s.' % article_url)
+        return None
+
+    # Extract the number of comments, only parsing the page up to the comments counter
+    try:
+        with metrics.timer('html_parse_seconds'):
+            article_page = parse_page(page_bytes, site_schema, ['num_comments'])
+        if article_page is not None:
+            num_comments = extract_fields(article_page, site_schema, ['num_comments'])['num_comments']
+    except ValueError:
+        logging.warning('Could not parse number of comments on %s.' % article_url)
+        return None
+    # An empty page doesn't show that the comments were removed, so the article isn't deleted
+    if article_page is None:
+        logging.warning('Article page %s is empty.' % article_url)
+        return None
+    if num_comments is None:
+        logging.warning('Could not find comments, deleting article with id %s...' % article_id)
+        return DeleteOne({'_id': article_id})
 
-    if num_comments_updated > 0:
-        logging.info('Updated number of comments for %d articles.' % num_comments_updated)
+    # Update article with the number of comments it has received
+    logging.info('Found %d comments for article with id %s...' % (num_comments, article_id))
+    article['num_comments'] = num_comments
+    return UpdateOne({'_id': article_id}, {'$set': {'num_comments': num_comments}})
 
 
-def download_page(url):
+def iterate_in_batches(iterable, batch_size):
+    """
+    :param iterable: iterable to split into batches, such as a database cursor
+    :param batch_size: maximum number of items per batch
+    :return: generator of lists of at most 'batch_size' consecutive items of 'iterable'
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def download_page(url, client=None):
     """
     :param url: URL of page to retrieve
+    :param client: optional HttpClient to retrieve the page with, reusing its keep-alive connections
+        and its response cache, if any
     :return: web page at URL url
     """
-    return html_parser.parse(urllib.request.urlopen(url))
+    page_bytes = download(url, client)
+    with metrics.timer('html_parse_seconds'):
+        return html_parser.parse(io.BytesIO(page_bytes))
+
+
+def download(url, client=None):
+    """
+    :param url: URL of page to retrieve
+    :param client: optional HttpClient to retrieve the page with
+    :return: web page at URL url as bytes
+    """
+    with metrics.timer('download_seconds'):
+        if client is None:
+            with urllib.request.urlopen(url, timeout=request_timeout) as response:
+                page_bytes = response.read()
+        else:
+            page_bytes = client.get(url)
+    metrics.increment('downloaded_bytes_total', len(page_bytes))
+    return page_bytes
 
 
 def save_articles(articles):
     """
     Inserts articles into the database.
+    Articles whose URL is already in the database, for instance because another crawler inserted them
+    in the meantime, are skipped.
     :param articles: list of articles
+    :return: list of the inserted articles, each with its '_id'
+    """
+    if not isinstance(articles, list) or len(articles) == 0:
+        return []
+    try:
+        with metrics.timer('mongo_write_seconds', collection=collection_name):
+            collection.insert_many(articles, ordered=False)
+        inserted_articles = articles
+    except BulkWriteError as e:
+        # Ignore duplicate key errors, raise all others
+        if any(error['code'] != duplicate_key_error_code for error in e.details['writeErrors']):
+            raise
+        failed_indexes = set(error['index'] for error in e.details['writeErrors'])
+        inserted_articles = [article for index, article in enumerate(articles) if index not in failed_indexes]
+    metrics.increment('articles_inserted_total', len(inserted_articles))
+    logging.info("Inserted %d articles into '%s.%s'.\n" % (len(inserted_articles), db.name, collection_name))
+    return inserted_articles
+
+
+def use_site_schema(path):
+    """
+    Replaces the site schema used to extract the fields of articles.
+    :param path: path of a JSON file containing a site schema
+    """
+    global site_schema
+    site_schema = load_site_schema(path)
+
+
+def add_client_arguments(parser, cache_option_prefix=''):
+    """
+    Adds the command line arguments used by 'create_client' to parser, as well as '--site-schema'.
+    :param parser: ArgumentParser of a script
+    :param cache_option_prefix: prefix of the '--cache-dir' and '--cache-size' options of the page cache,
+        for scripts that already use these options for another cache
+    """
+    parser.add_argument(
+        '--max-per-host', type=int, default=4,
+        help='Maximum number of simultaneous requests to a single host (default: 4)'
+    )
+    parser.add_argument(
+        '--delay', type=float, default=0.0,
+        help='Minimum number of seconds between two requests to the same host (default: 0)'
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=request_timeout,
+        help='Number of seconds after which a request is abandoned (default: %d)' % request_timeout
+    )
+    parser.add_argument(
+        '--%scache-dir' % cache_option_prefix, dest='page_cache_dir', metavar='CACHE_DIR',
+        help='Directory of an on-disk cache of downloaded pages, which are revalidated with conditional requests'
+    )
+    parser.add_argument(
+        '--%scache-size' % cache_option_prefix, dest='page_cache_size', metavar='CACHE_SIZE', type=int,
+        default=default_max_size // 1024 ** 2,
+        help='Maximum size of the page cache in megabytes (default: %d)' % (default_max_size // 1024 ** 2)
+    )
+    parser.add_argument(
+        '--replay', action='store_true',
+        help='Serve pages only from the page cache given by --%scache-dir, without making any requests' %
+             cache_option_prefix
+    )
+    parser.add_argument(
+        '--site-schema',
+        help='JSON file describing where the fields of articles are found on their pages (default: built-in schema)'
+    )
+
+
+def configure_client_arguments(parser, args):
+    """
+    Checks the arguments added by 'add_client_arguments' and applies '--site-schema'.
+    :param parser: ArgumentParser 'add_client_arguments' was applied to, to report invalid arguments with
+    :param args: parsed arguments of parser
+    """
+    if args.replay and not args.page_cache_dir:
+        parser.error('--replay requires the directory of a page cache.')
+    if args.site_schema:
+        use_site_schema(args.site_schema)
+
+
+def create_client(args):
+    """
+    :param args: parsed arguments of a parser 'add_client_arguments' was applied to
+    :return: HttpClient configured by args
     """
-    if isinstance(articles, list) and len(articles) > 0:
-        collection.insert_many(articles)
-        logging.info("Inserted %d articles into '%s.%s'.\n" % (len(articles), db_name, collection_name))
+    response_cache = None
+    if args.page_cache_dir:
+        response_cache = ResponseCache(args.page_cache_dir, args.page_cache_size * 1024 ** 2, args.replay)
+    return HttpClient(timeout=args.timeout, max_requests_per_host=args.max_per_host,
+                      min_delay_per_host=args.delay, cache=response_cache)
+
+
+def configure_logging():
+    """
+    Logs to the file given by 'get_log_file_name'.
+    """
+    logging.basicConfig(
+        filename=get_log_file_name(),
+        format='%(asctime)s.%(msecs)03d %(levelname)s {%(module)s} [%(funcName)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        level=logging.INFO
+    )
 
 
 def get_log_file_name():
@@ -221,15 +481,32 @@ def get_log_file_name():
 
 
 if __name__ == '__main__':
-    # Initialize logging
-    log_file = get_log_file_name()
-    logging.basicConfig(
-        filename=log_file,
-        format='%(asctime)s.%(msecs)03d %(levelname)s {%(module)s} [%(funcName)s] %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        level=logging.INFO
+    parser = ArgumentParser(
+        description="Retrieves new articles from %s and updates the number of comments of older ones.\n" % base_url,
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='Maximum number of articles to download concurrently (default: 4)'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=100,
+        help='Maximum number of comment updates per bulk write (default: 100)'
     )
+    add_client_arguments(parser)
+    metrics.add_instrumentation_arguments(parser)
+    connection.add_connection_arguments(parser)
+    args = parser.parse_args()
+    configure_client_arguments(parser, args)
+    metrics.configure_instrumentation(args)
+    connection.configure_connection(args)
+
+    configure_logging()
     # Retrieve articles and insert them into the database
-    collect_articles()
-    # For articles that are old enough, update the number of comments they have received
-    update_number_of_comments()
+    with create_client(args) as http_client:
+        with metrics.stage('collect_articles'):
+            collect_articles(http_client, args.workers)
+        # For articles that are old enough, update the number of comments they have received
+        with metrics.stage('update_number_of_comments'):
+            update_number_of_comments(http_client, args.workers, args.batch_size)
+    metrics.finish_instrumentation(args, 'crawl')
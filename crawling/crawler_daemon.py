@@ -0,0 +1,335 @@
+"""
+Crawler that keeps running, as an alternative to starting 'collect_articles.py' periodically.
+On startup, it adds the URLs of all articles in the database to a Bloom filter, and schedules a refresh of the number
+of comments of each article that doesn't have one yet. From then on:
+- it polls the front page on an interval that adapts to how often new links appear on it, and only retrieves
+  the articles whose URLs the filter hasn't seen, without looking up the URLs in the database;
+- it refreshes the number of comments of each article once the article is 24 hours old, by running a job that was
+  scheduled when the article was inserted, instead of scanning the collection for articles that are old enough.
+Articles that can't be retrieved are retried a few times, after which they are left to the next start of the daemon.
+Database and parse errors are logged without stopping the daemon; refreshes that fail because of them stay scheduled.
+"""
+import heapq
+import itertools
+import logging
+import signal
+import threading
+import time
+
+from argparse import ArgumentParser
+from argparse import RawTextHelpFormatter
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from lxml import etree
+from pymongo.errors import PyMongoError
+from urllib.error import URLError
+
+from crawling.bloom_filter import BloomFilter
+from crawling.collect_articles import add_client_arguments, base_url, collection, configure_client_arguments, \
+    configure_logging, create_client, download_page, ensure_indexes, fetch_articles, get_article_urls, save_articles, \
+    update_comments
+from instrumentation import metrics
+from storage import connection
+
+comments_delay = timedelta(days=1)
+min_seen_urls_capacity = 100000
+# Errors that only affect a single poll or batch of refreshes, after which the daemon keeps running
+recoverable_errors = (PyMongoError, etree.LxmlError)
+
+
+class AdaptiveInterval(object):
+    def __init__(self, min_interval=60.0, max_interval=900.0, target_new_links=3.0, smoothing=0.3):
+        """
+        Determines how long to wait before polling the front page again, aiming to find about 'target_new_links'
+        new links per poll, based on a moving average of the rate at which new links appeared in earlier polls.
+        :param min_interval: minimum number of seconds between two polls
+        :param max_interval: maximum number of seconds between two polls
+        :param target_new_links: number of new links to find per poll
+        :param smoothing: weight of the latest poll in the moving average of the rate of new links, between 0 and 1
+        """
+        if not 0 < min_interval <= max_interval:
+            raise ValueError("'min_interval' must be positive and at most 'max_interval'.")
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new_links = target_new_links
+        self.smoothing = smoothing
+        self.rate = None
+        self.interval = min_interval
+
+    def update(self, num_new_links, elapsed):
+        """
+        :param num_new_links: number of new links found by the latest poll
+        :param elapsed: number of seconds between the latest poll and the one before it
+        :return: number of seconds to wait before the next poll
+        """
+        rate = num_new_links / max(elapsed, 1e-6)
+        self.rate = rate if self.rate is None else self.smoothing * rate + (1 - self.smoothing) * self.rate
+        if self.rate > 0:
+            self.interval = min(max(self.target_new_links / self.rate, self.min_interval), self.max_interval)
+        else:
+            self.interval = self.max_interval
+        return self.interval
+
+
+class RefreshSchedule(object):
+    def __init__(self):
+        """
+        Jobs refreshing the number of comments of articles, ordered by the time they are due.
+        """
+        self._jobs = []
+        # Breaks ties between jobs due at the same time, so articles are never compared
+        self._sequence = itertools.count()
+
+    def schedule(self, article, due, attempt=0):
+        """
+        :param article: dict containing the '_id' and 'url' of an article
+        :param due: datetime at which to refresh the number of comments of article
+        :param attempt: number of earlier attempts to refresh the number of comments of article
+        """
+        heapq.heappush(self._jobs, (due, next(self._sequence), attempt, article))
+
+    def pop_due(self, now, max_jobs=None):
+        """
+        :param now: current datetime
+        :param max_jobs: maximum number of jobs to return, all due jobs if None
+        :return: list of (article, attempt) tuples of the jobs due at now, removed from the schedule, earliest first
+        """
+        jobs = []
+        while self._jobs and self._jobs[0][0] <= now and (max_jobs is None or len(jobs) < max_jobs):
+            _, _, attempt, article = heapq.heappop(self._jobs)
+            jobs.append((article, attempt))
+        return jobs
+
+    def get_next_due(self):
+        """
+        :return: datetime at which the earliest job is due, or None if no jobs are scheduled
+        """
+        return self._jobs[0][0] if self._jobs else None
+
+    def __len__(self):
+        return len(self._jobs)
+
+
+class CrawlerDaemon(object):
+    def __init__(self, client=None, max_workers=1, batch_size=100, interval=None, false_positive_rate=1e-6,
+                 retry_delay=timedelta(hours=1), max_attempts=3):
+        """
+        :param client: optional HttpClient to download pages with
+        :param max_workers: maximum number of pages to download concurrently
+        :param batch_size: maximum number of comment refreshes per bulk write
+        :param interval: AdaptiveInterval determining when to poll the front page, defaults to its default settings
+        :param false_positive_rate: probability that the seen-URL filter reports a new URL as seen,
+            in which case its article is skipped
+        :param retry_delay: timedelta after which to retry an article that couldn't be retrieved
+        :param max_attempts: maximum number of attempts to retrieve an article or its number of comments
+        """
+        self.client = client
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.interval = interval or AdaptiveInterval()
+        self.false_positive_rate = false_positive_rate
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.seen_urls = None
+        self.schedule = RefreshSchedule()
+        self._failed_urls = Counter()
+
+    def warm(self):
+        """
+        Adds the URLs of all articles in the database to the seen-URL filter, and schedules a refresh
+        of the number of comments of each article that doesn't have one yet.
+        """
+        ensure_indexes()
+        self.warm_seen_urls()
+        with metrics.timer('mongo_read_seconds', collection=collection.name):
+            for article in collection.find({'num_comments': None}, {'url': 1, 'published': 1}):
+                self.schedule_refresh(article)
+        logging.info('Scheduled %d refreshes of the number of comments.' % len(self.schedule))
+
+    def warm_seen_urls(self):
+        """
+        Replaces the seen-URL filter by one sized for twice the number of articles in the database,
+        containing their URLs.
+        """
+        with metrics.timer('mongo_read_seconds', collection=collection.name):
+            urls = [article['url'] for article in collection.find({}, {'url': 1, '_id': 0})]
+        seen_urls = BloomFilter(max(2 * len(urls), min_seen_urls_capacity), self.false_positive_rate)
+        for url in urls:
+            seen_urls.add(url)
+        self.seen_urls = seen_urls
+        logging.info('Added %d URLs to a seen-URL filter of %d bytes.' % (len(seen_urls), seen_urls.get_size()))
+
+    def schedule_refresh(self, article):
+        """
+        :param article: article containing an '_id', 'url' and 'published' datetime
+        """
+        self.schedule.schedule({'_id': article['_id'], 'url': article['url']}, article['published'] + comments_delay)
+
+    def poll(self):
+        """
+        Retrieves the articles on the front page whose URLs haven't been seen yet and saves them to the database.
+        :return: number of links on the front page that appeared since the previous poll,
+            or None if the front page couldn't be retrieved or was empty
+        """
+        try:
+            front_page = download_page(base_url, self.client)
+        except URLError:
+            logging.error('Could not access %s.' % base_url)
+            metrics.increment('front_page_polls_total', outcome='failed')
+            return None
+        if front_page.getroot() is None:
+            logging.error('Front page %s is empty.' % base_url)
+            metrics.increment('front_page_polls_total', outcome='failed')
+            return None
+        new_urls = [url for url in get_article_urls(front_page) if url not in self.seen_urls]
+        num_new_links = sum(1 for url in new_urls if url not in self._failed_urls)
+        articles = fetch_articles(new_urls, self.client, self.max_workers)
+        # Articles another crawler inserted in the meantime are refreshed by that crawler, not by this one
+        for article in save_articles(articles):
+            self.schedule_refresh(article)
+
+        for article in articles:
+            self.seen_urls.add(article['url'])
+        # Links whose article can't be retrieved are retried by the next polls, until they have failed too often
+        retrieved_urls = set(article['url'] for article in articles)
+        for url in new_urls:
+            if url not in retrieved_urls:
+                self._failed_urls[url] += 1
+                if self._failed_urls[url] >= self.max_attempts:
+                    del self._failed_urls[url]
+                    self.seen_urls.add(url)
+        if len(self.seen_urls) > self.seen_urls.capacity:
+            self.warm_seen_urls()
+
+        metrics.increment('front_page_polls_total', outcome='succeeded')
+        metrics.increment('front_page_new_links_total', num_new_links)
+        logging.info('Found %d new links, retrieved %d articles.' % (num_new_links, len(articles)))
+        return num_new_links
+
+    def refresh_due_comments(self, executor, now=None):
+        """
+        Refreshes the number of comments of at most 'batch_size' articles whose refresh is due,
+        rescheduling those whose page couldn't be retrieved, or all of them if writing the updates raises an error.
+        :param executor: ThreadPoolExecutor to retrieve the article pages with
+        :param now: current datetime, defaults to the current time
+        :return: number of refreshed articles
+        """
+        now = now or datetime.now()
+        jobs = self.schedule.pop_due(now, self.batch_size)
+        if not jobs:
+            return 0
+        try:
+            operations = update_comments([article for article, _ in jobs], executor, self.client)
+        except Exception:
+            for article, attempt in jobs:
+                self.schedule.schedule(article, now + self.retry_delay, attempt)
+            raise
+        for (article, attempt), operation in zip(jobs, operations):
+            if operation is None and attempt + 1 < self.max_attempts:
+                self.schedule.schedule(article, now + self.retry_delay, attempt + 1)
+        return len(jobs)
+
+    def run(self, stop_event, on_cycle=None):
+        """
+        Polls the front page and refreshes the number of comments of articles as they become due,
+        until stop_event is set.
+        :param stop_event: threading.Event to stop the daemon with
+        :param on_cycle: optional function to call after each poll or batch of refreshes
+        """
+        self.warm()
+        next_poll = datetime.now()
+        last_poll = None
+        with ThreadPoolExecutor(max_workers=max(self.max_workers, 1)) as executor:
+            while not stop_event.is_set():
+                now = datetime.now()
+                if now >= next_poll:
+                    try:
+                        with metrics.timer('poll_seconds'):
+                            num_new_links = self.poll()
+                    except recoverable_errors:
+                        logging.exception('Could not poll %s.' % base_url)
+                        metrics.increment('front_page_polls_total', outcome='failed')
+                        num_new_links = None
+                    if num_new_links is not None:
+                        if last_poll is not None:
+                            self.interval.update(num_new_links, (now - last_poll).total_seconds())
+                        last_poll = now
+                    next_poll = now + timedelta(seconds=self.interval.interval)
+                try:
+                    with metrics.timer('comment_refresh_seconds'):
+                        self.refresh_due_comments(executor, now)
+                except recoverable_errors:
+                    logging.exception('Could not refresh the number of comments, retrying later.')
+
+                metrics.set_gauge('poll_interval_seconds', self.interval.interval)
+                metrics.set_gauge('scheduled_comment_refreshes', len(self.schedule))
+                metrics.set_gauge('seen_urls', len(self.seen_urls))
+                if on_cycle is not None:
+                    on_cycle()
+
+                next_due = self.schedule.get_next_due()
+                wake_time = next_poll if next_due is None else min(next_poll, next_due)
+                stop_event.wait(max((wake_time - datetime.now()).total_seconds(), 0))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description="Keeps polling %s for new articles, and updates the number of comments of each article\n"
+                    "once it is 24 hours old.\n" % base_url,
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='Maximum number of articles to download concurrently (default: 4)'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=100,
+        help='Maximum number of comment updates per bulk write (default: 100)'
+    )
+    parser.add_argument(
+        '--min-interval', type=float, default=60.0,
+        help='Minimum number of seconds between two polls of the front page (default: 60)'
+    )
+    parser.add_argument(
+        '--max-interval', type=float, default=900.0,
+        help='Maximum number of seconds between two polls of the front page (default: 900)'
+    )
+    parser.add_argument(
+        '--target-new-links', type=float, default=3.0,
+        help='Number of new links each poll should find, which determines the interval between polls (default: 3)'
+    )
+    parser.add_argument(
+        '--false-positive-rate', type=float, default=1e-6,
+        help='Probability that a new URL is mistaken for a seen one and its article skipped (default: 1e-6)'
+    )
+    parser.add_argument(
+        '--metrics-interval', type=float, default=60.0,
+        help='Minimum number of seconds between two writes of the metrics file (default: 60)'
+    )
+    add_client_arguments(parser)
+    metrics.add_instrumentation_arguments(parser)
+    connection.add_connection_arguments(parser)
+    args = parser.parse_args()
+    configure_client_arguments(parser, args)
+    metrics.configure_instrumentation(args)
+    connection.configure_connection(args)
+    configure_logging()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signal_number, frame: stop.set())
+
+    last_metrics_write = [time.monotonic()]
+
+    def write_metrics():
+        if time.monotonic() - last_metrics_write[0] >= args.metrics_interval:
+            metrics.finish_instrumentation(args, 'crawler_daemon')
+            last_metrics_write[0] = time.monotonic()
+
+    with create_client(args) as http_client:
+        daemon = CrawlerDaemon(http_client, args.workers, args.batch_size,
+                               AdaptiveInterval(args.min_interval, args.max_interval, args.target_new_links),
+                               args.false_positive_rate)
+        daemon.run(stop, write_metrics)
+    metrics.finish_instrumentation(args, 'crawler_daemon')
@@ -0,0 +1,127 @@
+"""
+Extracts the fields of an article from its page, as described by a site schema.
+The text of an element includes the text of all elements nested in it, such as links and emphasized words,
+and the texts of multiple elements are joined in a single pass.
+Pages can be parsed incrementally, stopping as soon as the parser closes the last element that completes
+a requested field.
+"""
+import io
+
+from datetime import datetime
+from lxml import etree
+
+html_parser = etree.HTMLParser()
+
+
+def parse_page(page_bytes, site_schema, field_names=None):
+    """
+    :param page_bytes: page as bytes
+    :param site_schema: SiteSchema describing the fields on the page
+    :param field_names: names of the fields needed from the page, defaults to all fields of site_schema;
+        in incremental mode, only the part of the page up to these fields is parsed
+    :return: root element of the (partially) parsed page, or None if the page doesn't contain any elements
+    """
+    fields = [site_schema.fields[name] for name in (field_names or site_schema.fields)]
+    # Fields without a way to tell whether they are complete require parsing the whole page
+    if not site_schema.incremental or any(field.end_marker is None for field in fields):
+        return etree.parse(io.BytesIO(page_bytes), html_parser).getroot()
+
+    # Markers that haven't been closed yet by tag, or None for markers matching any tag
+    pending_markers = {}
+    for field in fields:
+        pending_markers.setdefault(field.end_marker.tag, set()).add(field.end_marker)
+    # Unless a marker matches any tag, the parser only reports the closing of elements with the tags of the markers
+    parser = etree.HTMLPullParser(events=('end',), tag=None if None in pending_markers else sorted(pending_markers))
+    for start in range(0, len(page_bytes), site_schema.chunk_size):
+        parser.feed(page_bytes[start:start + site_schema.chunk_size])
+        for _, element in parser.read_events():
+            for tag in (element.tag, None):
+                markers = pending_markers.get(tag)
+                if markers:
+                    markers.difference_update([marker for marker in markers if is_end_marker(marker, element)])
+        if not any(pending_markers.values()):
+            break
+    # Closing the parser closes all elements that are still open, so the partial page is a valid tree
+    try:
+        return parser.close()
+    except etree.XMLSyntaxError:
+        # Raised instead of returning None if the parser was never fed any data
+        return None
+
+
+def is_end_marker(end_marker, element):
+    """
+    :param end_marker: EndMarker of a field
+    :param element: element that was just closed by the parser
+    :return: whether element is the first element selected by the path of end_marker
+    """
+    if not end_marker.step(element):
+        return False
+    # An enclosing element matching the same step would be selected first, and is still open
+    if any(end_marker.step(ancestor) for ancestor in element.iterancestors()):
+        return False
+    if end_marker.path is None:
+        return True
+    # Only elements matching the last step are checked against the whole path, so the tree is rarely searched
+    selected = end_marker.path(element)
+    return bool(selected) and selected[0] is element
+
+
+def extract_fields(page, site_schema, field_names=None):
+    """
+    :param page: root element of a parsed page
+    :param site_schema: SiteSchema describing the fields on the page
+    :param field_names: names of the fields to extract, defaults to all fields of site_schema
+    :return: dict mapping field names to their values, or to None for fields that aren't on the page
+    :raises ValueError: if a required field isn't on the page, or the text of a field can't be converted to its type
+    """
+    values = {}
+    for name in field_names or site_schema.fields:
+        field = site_schema.fields[name]
+        elements = field.xpath(page) if page is not None else []
+        if field.multiple:
+            text = '\n'.join(filter(None, (get_element_text(element) for element in elements)))
+        else:
+            text = get_element_text(elements[0]) if elements else None
+        if not text:
+            if field.required:
+                raise ValueError("Could not find required field '%s'." % name)
+            values[name] = text if field.multiple else None
+            continue
+        values[name] = convert_field_value(field, text)
+    return values
+
+
+def get_element_text(element):
+    """
+    :param element: element, or a string if an XPath expression selected text or an attribute
+    :return: text of element including that of all nested elements, with whitespace normalized to single spaces
+    """
+    text = element if isinstance(element, str) else ''.join(element.itertext())
+    return ' '.join(text.split())
+
+
+def convert_field_value(field, text):
+    """
+    :param field: SchemaField
+    :param text: text of the field on the page
+    :return: text converted to the type of field
+    :raises ValueError: if text can't be converted
+    """
+    if field.type == 'datetime':
+        return datetime.strptime(text, field.format)
+    if field.type == 'count':
+        return parse_number_of_comments(text)
+    return text
+
+
+def parse_number_of_comments(comments_text):
+    """
+    :param comments_text: text of a comments counter, such as '12' or '1.2K'
+    :return: number of comments as an integer
+    """
+    comments_text = comments_text.strip()
+    if 'K' in comments_text:
+        comments_text = comments_text[:-1]
+        return int(float(comments_text) * 1000)
+    return int(comments_text)
@@ -0,0 +1,179 @@
+"""
+HTTP client used to download pages from NU.nl.
+Keeps a keep-alive connection per host for every thread that uses it, limits the number of simultaneous
+requests to a single host and enforces a minimum delay between two requests to the same host.
+The client is thread-safe, so one instance can be shared by all workers of a thread pool.
+Optionally, responses are stored in a ResponseCache and revalidated with conditional requests,
+or, in replay mode, served from the cache without making any requests.
+"""
+import http.client
+import threading
+import time
+import urllib.parse
+
+from urllib.error import HTTPError, URLError
+
+from instrumentation import metrics
+
+redirect_statuses = (301, 302, 303, 307, 308)
+not_modified_status = 304
+
+
+class HttpClient(object):
+    def __init__(self, timeout=10.0, max_requests_per_host=4, min_delay_per_host=0.0, max_redirects=5,
+                 user_agent='NewsClassification/1.0', cache=None):
+        """
+        :param timeout: number of seconds to wait for a connection or a response before giving up
+        :param max_requests_per_host: maximum number of requests to a single host that can be in flight at once
+        :param min_delay_per_host: minimum number of seconds between the start of two requests to the same host
+        :param max_redirects: maximum number of redirects to follow for a single request
+        :param user_agent: value of the 'User-Agent' header sent with every request
+        :param cache: optional ResponseCache to store responses in and revalidate them from
+        """
+        if max_requests_per_host < 1:
+            raise ValueError("'max_requests_per_host' must be at least 1.")
+        self.timeout = timeout
+        self.max_requests_per_host = max_requests_per_host
+        self.min_delay_per_host = min_delay_per_host
+        self.max_redirects = max_redirects
+        self.user_agent = user_agent
+        self.cache = cache
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._host_semaphores = {}
+        self._host_next_request_times = {}
+        self._connections = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, url):
+        """
+        Retrieves the page at 'url', following redirects.
+        If the client has a cache containing the page, it is only downloaded again if it has been modified.
+        :param url: URL of page to retrieve
+        :return: body of the response as bytes
+        :raises URLError: if the page could not be retrieved, or isn't in the cache in replay mode
+        """
+        cached_response = self.cache.get(url) if self.cache is not None else None
+        if self.cache is not None and self.cache.replay:
+            if cached_response is None:
+                metrics.increment('http_cache_requests_total', result='replay_miss')
+                raise URLError('%s is not in the response cache.' % url)
+            metrics.increment('http_cache_requests_total', result='hit')
+            return cached_response.body
+
+        conditional_headers = {}
+        if cached_response is not None:
+            if cached_response.etag:
+                conditional_headers['If-None-Match'] = cached_response.etag
+            if cached_response.last_modified:
+                conditional_headers['If-Modified-Since'] = cached_response.last_modified
+        request_url = url
+        for _ in range(self.max_redirects + 1):
+            status, headers, body = self.request(request_url, conditional_headers)
+            if status in redirect_statuses and headers.get('Location'):
+                request_url = urllib.parse.urljoin(request_url, headers['Location'])
+                continue
+            if status == not_modified_status and conditional_headers:
+                metrics.increment('http_cache_requests_total', result='not_modified')
+                return cached_response.body
+            if status >= 400:
+                raise HTTPError(request_url, status, 'Request for %s failed with status %d.' % (request_url, status),
+                                headers, None)
+            if self.cache is not None:
+                metrics.increment('http_cache_requests_total', result='miss')
+                self.cache.put(url, body, headers)
+            return body
+        raise URLError('Too many redirects while retrieving %s.' % url)
+
+    def request(self, url, headers=None):
+        """
+        Performs a single GET request for 'url' without following redirects.
+        :param url: URL to request
+        :param headers: optional dict of additional request headers
+        :return: tuple of response status, response headers and response body
+        :raises URLError: if the request could not be completed
+        """
+        parsed_url = urllib.parse.urlsplit(url)
+        if parsed_url.scheme not in ('http', 'https'):
+            raise URLError('Unsupported URL scheme in %s.' % url)
+        host = (parsed_url.scheme, parsed_url.netloc)
+        path = urllib.parse.urlunsplit(('', '', parsed_url.path or '/', parsed_url.query, ''))
+        request_headers = {'User-Agent': self.user_agent, 'Connection': 'keep-alive'}
+        if headers:
+            request_headers.update(headers)
+
+        with self._get_host_semaphore(host):
+            self._wait_for_turn(host)
+            # A keep-alive connection may have been closed by the server in the meantime, so retry once
+            for attempt in range(2):
+                connection = self._get_connection(host)
+                try:
+                    connection.request('GET', path, headers=request_headers)
+                    response = connection.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, OSError) as e:
+                    self._discard_connection(host)
+                    if attempt == 1:
+                        raise URLError(e)
+                    continue
+                if response.will_close:
+                    self._discard_connection(host)
+                return response.status, response.headers, body
+
+    def close(self):
+        """
+        Closes all connections opened by this client.
+        """
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+    def _get_host_semaphore(self, host):
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(self.max_requests_per_host)
+            return self._host_semaphores[host]
+
+    def _wait_for_turn(self, host):
+        """
+        Blocks until at least 'min_delay_per_host' seconds have passed since the previous request to 'host' started.
+        """
+        if self.min_delay_per_host <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_time = max(now, self._host_next_request_times.get(host, now))
+            self._host_next_request_times[host] = start_time + self.min_delay_per_host
+        if start_time > now:
+            time.sleep(start_time - now)
+
+    def _get_connection(self, host):
+        """
+        :return: keep-alive connection to 'host' owned by the calling thread
+        """
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        if host not in connections:
+            scheme, netloc = host
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            connection = connection_class(netloc, timeout=self.timeout)
+            connections[host] = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connections[host]
+
+    def _discard_connection(self, host):
+        connection = self._local.connections.pop(host, None)
+        if connection is not None:
+            connection.close()
+            with self._lock:
+                if connection in self._connections:
+                    self._connections.remove(connection)
@@ -0,0 +1,134 @@
+"""
+On-disk cache of HTTP responses used by HttpClient, keyed by URL.
+Each response body is stored gzip-compressed, together with its URL and the 'ETag' and 'Last-Modified' headers
+it was served with, so the page can be revalidated with a conditional request instead of being downloaded again.
+When the cache grows beyond its maximum size, the least recently used responses are evicted.
+
+In replay mode, pages are served from the cache only and no requests are made at all, so extraction can be rerun
+over previously downloaded pages, and the crawler can be tested without network access.
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from collections import namedtuple
+
+CachedResponse = namedtuple('CachedResponse', ['url', 'body', 'etag', 'last_modified', 'stored'])
+
+default_max_size = 1024 ** 3
+cache_file_extension = '.gz'
+
+
+class ResponseCache(object):
+    def __init__(self, directory, max_size=default_max_size, replay=False):
+        """
+        :param directory: directory to store responses in, created if it doesn't exist
+        :param max_size: maximum total size in bytes of the compressed responses in the cache
+        :param replay: whether HttpClient should serve pages only from the cache, without making requests
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+        self.replay = replay
+        self._lock = threading.Lock()
+        self._size = sum(os.path.getsize(path) for path in self._get_cache_files())
+
+    def get(self, url):
+        """
+        :param url: URL of the response
+        :return: CachedResponse for url, or None if it isn't in the cache
+        """
+        path = self._get_path(url)
+        try:
+            with gzip.open(path, 'rb') as cache_file:
+                metadata = json.loads(cache_file.readline().decode('utf-8'))
+                body = cache_file.read()
+            # Mark the response as recently used, so it is evicted last
+            os.utime(path)
+        except (OSError, EOFError, ValueError):
+            return None
+        if metadata.get('url') != url:
+            return None
+        return CachedResponse(url, body, metadata.get('etag'), metadata.get('last_modified'), metadata.get('stored'))
+
+    def put(self, url, body, headers=None):
+        """
+        Stores a response, replacing any stored response for the same URL, then evicts responses if the cache
+        has grown beyond its maximum size.
+        :param url: URL of the response
+        :param body: body of the response as bytes
+        :param headers: headers of the response, whose 'ETag' and 'Last-Modified' are stored for revalidation
+        """
+        headers = headers or {}
+        metadata = {'url': url, 'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified'),
+                    'stored': time.time()}
+        path = self._get_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so concurrent readers never see a partially written response
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(file_descriptor, 'wb') as temporary_file:
+                with gzip.GzipFile(fileobj=temporary_file, mode='wb') as cache_file:
+                    cache_file.write(json.dumps(metadata).encode('utf-8') + b'\n')
+                    cache_file.write(body)
+            size = os.path.getsize(temporary_path)
+            with self._lock:
+                previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+                os.replace(temporary_path, path)
+                self._size += size - previous_size
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used responses until the cache is at most 90% of its maximum size,
+        leaving room for new responses before the next eviction.
+        """
+        with self._lock:
+            target_size = int(self.max_size * 0.9)
+            if self._size <= target_size:
+                return
+            cache_files = []
+            for path in self._get_cache_files():
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                cache_files.append((status.st_mtime, status.st_size, path))
+            cache_files.sort()
+            self._size = sum(size for _, size, _ in cache_files)
+            for _, size, path in cache_files:
+                if self._size <= target_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                self._size -= size
+
+    def get_size(self):
+        """
+        :return: total size in bytes of the compressed responses in the cache
+        """
+        return self._size
+
+    def _get_path(self, url):
+        """
+        :return: path of the file storing the response for url, in a subdirectory to keep directories small
+        """
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key + cache_file_extension)
+
+    def _get_cache_files(self):
+        for directory, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if file_name.endswith(cache_file_extension):
+                    yield os.path.join(directory, file_name)
@@ -0,0 +1,146 @@
+"""
+Declarative description of where the fields of an article are found on the pages of a news site.
+A schema is a JSON-compatible dict, so a change in the layout of the site only requires updating the schema,
+or passing a different schema file to the crawler, instead of changing code.
+
+Each field is described by:
+- 'xpath': XPath expression selecting the element(s) containing the field
+- 'type': 'text' for the whitespace-normalized text of the element, including the text of nested elements,
+  'datetime' for a date parsed from that text with 'format', or 'count' for a number of comments such as '1.2K'
+- 'multiple': whether the texts of all selected elements are joined into one value, one line per element,
+  instead of using the first selected element only (default: False)
+- 'required': whether an article without this field is invalid (default: False)
+- 'container': for fields with 'multiple', optional XPath expression selecting the element enclosing all selected
+  elements, so incremental parsing knows when the field is complete
+
+With 'incremental' enabled, pages are parsed in chunks of 'chunk_size' bytes, and parsing stops as soon as all
+requested fields are complete, so the remainder of the page, such as footers and scripts, is never parsed.
+"""
+import json
+import re
+
+from collections import namedtuple
+from lxml import etree
+
+SiteSchema = namedtuple('SiteSchema', ['fields', 'incremental', 'chunk_size'])
+SchemaField = namedtuple('SchemaField', ['name', 'xpath', 'type', 'format', 'multiple', 'required', 'end_marker'])
+# Element whose closing tag completes a field: 'tag' and 'step' match the last location step of its path against
+# a single element; 'path' selects the element in the whole page, or is None if matching the step is enough
+EndMarker = namedtuple('EndMarker', ['tag', 'step', 'path'])
+
+field_types = ('text', 'datetime', 'count')
+default_chunk_size = 16384
+element_step_pattern = re.compile(r'^(?:child::|descendant::|descendant-or-self::)?([A-Za-z_][\w.-]*|\*)(\[.*\])?$')
+
+nu_nl_schema = {
+    'incremental': True,
+    'chunk_size': default_chunk_size,
+    'fields': {
+        'title': {
+            'xpath': '//h1[@class="title fluid"]',
+            'type': 'text',
+            'required': True
+        },
+        'published': {
+            'xpath': '//span[@class="pubdate small"]',
+            'type': 'datetime',
+            'format': '%d-%m-%y %H:%M',
+            'required': True
+        },
+        'text': {
+            'xpath': '//div[@class="block-wrapper"]//div[@class="block-content"]//p',
+            'type': 'text',
+            'multiple': True,
+            'container': '//div[@class="block-wrapper"]'
+        },
+        'num_comments': {
+            'xpath': '//span[@class="comments-count"]',
+            'type': 'count'
+        }
+    }
+}
+
+
+def load_site_schema(path):
+    """
+    :param path: path of a JSON file containing a site schema
+    :return: compiled SiteSchema
+    """
+    with open(path) as schema_file:
+        return compile_site_schema(json.load(schema_file))
+
+
+def compile_site_schema(schema):
+    """
+    :param schema: dict describing a site schema, see the description of this module
+    :return: SiteSchema containing a dict mapping field names to SchemaField with precompiled XPath expressions
+    :raises ValueError: if the schema is invalid
+    """
+    fields = {}
+    for name, field in schema.get('fields', {}).items():
+        field_type = field.get('type', 'text')
+        if field_type not in field_types:
+            raise ValueError("Type of field '%s' must be one of %s." % (name, ', '.join(field_types)))
+        if field_type == 'datetime' and 'format' not in field:
+            raise ValueError("Field '%s' of type 'datetime' must have a 'format'." % name)
+        multiple = field.get('multiple', False)
+        try:
+            xpath = etree.XPath(field['xpath'])
+            # A field is complete once the parser has closed the element that contains it
+            end_marker = compile_end_marker(field.get('container') if multiple else field['xpath'])
+        except KeyError:
+            raise ValueError("Field '%s' must have an 'xpath'." % name)
+        except etree.XPathSyntaxError as e:
+            raise ValueError("Invalid XPath expression for field '%s': %s" % (name, e))
+        fields[name] = SchemaField(name, xpath, field_type, field.get('format'), multiple,
+                                   field.get('required', False), end_marker)
+    return SiteSchema(fields, schema.get('incremental', False), schema.get('chunk_size', default_chunk_size))
+
+
+def compile_end_marker(path):
+    """
+    :param path: XPath expression selecting the element whose closing tag completes a field, or None
+    :return: EndMarker, or None if path is None or doesn't end in a step selecting elements, such as text or attributes
+    :raises etree.XPathSyntaxError: if path is invalid
+    """
+    if path is None:
+        return None
+    steps = split_location_steps(path)
+    match = element_step_pattern.match(steps[-1]) if steps else None
+    if match is None:
+        etree.XPath(path)
+        return None
+    tag = match.group(1) if match.group(1) != '*' else None
+    step = etree.XPath('self::%s%s' % (match.group(1), match.group(2) or ''))
+    # A path consisting of a single '//' step selects every element matching the step, anywhere on the page
+    single_step = len(steps) == 1 and path.strip().startswith('//')
+    return EndMarker(tag, step, None if single_step else etree.XPath(path))
+
+
+def split_location_steps(path):
+    """
+    :param path: XPath location path
+    :return: list of the location steps of path, or an empty list if path isn't a single location path,
+        such as a union of paths
+    """
+    steps = []
+    step_start = 0
+    depth = 0
+    quote = None
+    for index, character in enumerate(path):
+        if quote is not None:
+            if character == quote:
+                quote = None
+        elif character in '\'"':
+            quote = character
+        elif character in '[(':
+            depth += 1
+        elif character in '])':
+            depth -= 1
+        elif depth == 0 and character == '|':
+            return []
+        elif depth == 0 and character == '/':
+            steps.append(path[step_start:index].strip())
+            step_start = index + 1
+    steps.append(path[step_start:].strip())
+    return [step for step in steps if step]
@@ -0,0 +1,25 @@
+from unittest import TestCase
+
+from crawling.bloom_filter import BloomFilter
+
+
+class TestBloomFilter(TestCase):
+    def test_added_items_are_always_contained(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        urls = ['http://www.nu.nl/politiek/%d/title.html' % index for index in range(1000)]
+        for url in urls:
+            bloom_filter.add(url)
+        self.assertTrue(all(url in bloom_filter for url in urls))
+        self.assertEqual(1000, len(bloom_filter))
+
+    def test_false_positive_rate_is_close_to_requested_rate(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for index in range(1000):
+            bloom_filter.add('http://www.nu.nl/politiek/%d/title.html' % index)
+        false_positives = sum('http://www.nu.nl/economie/%d/title.html' % index in bloom_filter
+                              for index in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_size_is_much_smaller_than_urls(self):
+        bloom_filter = BloomFilter(100000, 1e-6)
+        self.assertLess(bloom_filter.get_size(), 400000)
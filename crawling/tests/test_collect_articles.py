@@ -0,0 +1,95 @@
+import lxml.html as html_parser
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from crawling import collect_articles
+from crawling.collect_articles import duplicate_key_error_code, ensure_indexes, get_article_urls, \
+    get_comments_update, get_retrieved_urls, iterate_in_batches, process_article, save_articles, update_comments
+
+
+class TestCollectArticles(TestCase):
+    def test_iterate_in_batches_splits_into_batches_of_at_most_batch_size(self):
+        self.assertListEqual([[0, 1], [2, 3], [4]], list(iterate_in_batches(range(5), 2)))
+
+    def test_get_article_urls_returns_unique_news_urls(self):
+        page = html_parser.fromstring(
+            '<div class="column-content">'
+            '<a href="/politiek/123/title.html" class="link">a</a>'
+            '<a href="/politiek/123/title.html" class="link">b</a>'
+            '<a href="/video/456/title.html" class="link">c</a>'
+            '<a href="/advertorial/789/title.html" class="link">d</a>'
+            '</div>'
+        )
+        self.assertListEqual(['http://www.nu.nl/politiek/123/title.html'], get_article_urls(page))
+
+    def test_empty_page_is_skipped_without_deleting_article(self):
+        client = Mock(get=Mock(return_value=b''))
+        self.assertIsNone(process_article('http://www.nu.nl/politiek/123/title.html', client))
+        self.assertIsNone(get_comments_update({'_id': 1, 'url': 'http://www.nu.nl/politiek/123/title.html'}, client))
+
+
+class TestArticleStorage(TestCase):
+    def setUp(self):
+        self.collection = Mock()
+        patcher = patch.object(collect_articles, 'collection', self.collection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ensure_indexes_creates_unique_url_index(self):
+        ensure_indexes()
+        self.collection.create_index.assert_called_once_with('url', unique=True)
+
+    def test_get_retrieved_urls_looks_up_all_urls_in_one_query(self):
+        self.collection.find.return_value = iter([{'url': 'http://www.nu.nl/a'}, {'url': 'http://www.nu.nl/a'}])
+        retrieved_urls = get_retrieved_urls(url for url in ['http://www.nu.nl/a', 'http://www.nu.nl/b'])
+        self.assertSetEqual({'http://www.nu.nl/a'}, retrieved_urls)
+        self.collection.find.assert_called_once_with(
+            {'url': {'$in': ['http://www.nu.nl/a', 'http://www.nu.nl/b']}}, {'url': 1, '_id': 0}
+        )
+
+    def test_save_articles_ignores_duplicate_urls(self):
+        self.collection.insert_many.side_effect = BulkWriteError({
+            'writeErrors': [{'index': 1, 'code': duplicate_key_error_code, 'errmsg': 'duplicate key'}],
+            'nInserted': 1
+        })
+        inserted_articles = save_articles([{'url': 'http://www.nu.nl/a'}, {'url': 'http://www.nu.nl/b'}])
+        self.assertFalse(self.collection.insert_many.call_args[1]['ordered'])
+        self.assertListEqual([{'url': 'http://www.nu.nl/a'}], inserted_articles)
+
+    def test_save_articles_raises_other_write_errors(self):
+        self.collection.insert_many.side_effect = BulkWriteError({
+            'writeErrors': [{'index': 0, 'code': duplicate_key_error_code, 'errmsg': 'duplicate key'},
+                            {'index': 1, 'code': 121, 'errmsg': 'document failed validation'}],
+            'nInserted': 0
+        })
+        with self.assertRaises(BulkWriteError):
+            save_articles([{'url': 'http://www.nu.nl/a'}, {'url': 'http://www.nu.nl/b'}])
+
+    def test_save_articles_skips_empty_list(self):
+        self.assertListEqual([], save_articles([]))
+        self.collection.insert_many.assert_not_called()
+
+    def test_update_comments_writes_remaining_operations_if_one_fails(self):
+        pages = {
+            'http://www.nu.nl/a': b'<html><body><span class="comments-count">12</span></body></html>',
+            'http://www.nu.nl/b': b'<html><body><p>removed</p></body></html>',
+            'http://www.nu.nl/c': b'<html><body><span class="comments-count">3</span></body></html>'
+        }
+        client = Mock(get=Mock(side_effect=lambda url: pages[url]))
+        self.collection.bulk_write.side_effect = BulkWriteError({
+            'writeErrors': [{'index': 2, 'code': 121, 'errmsg': 'document failed validation'}],
+            'nModified': 1, 'nRemoved': 1
+        })
+        statistics = Counter()
+        articles = [{'_id': name, 'url': 'http://www.nu.nl/%s' % name} for name in 'abc']
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            operations = update_comments(articles, executor, client, statistics)
+        self.assertListEqual([UpdateOne({'_id': 'a'}, {'$set': {'num_comments': 12}}), DeleteOne({'_id': 'b'}), None],
+                             operations)
+        self.assertFalse(self.collection.bulk_write.call_args[1]['ordered'])
+        self.assertEqual(Counter(retrieved=3, updated=1, deleted=1, failed=1), statistics)
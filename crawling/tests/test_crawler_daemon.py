@@ -0,0 +1,198 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from urllib.error import URLError
+
+from crawling import collect_articles, crawler_daemon
+from crawling.bloom_filter import BloomFilter
+from crawling.collect_articles import base_url, duplicate_key_error_code
+from crawling.crawler_daemon import AdaptiveInterval, CrawlerDaemon, RefreshSchedule, min_seen_urls_capacity
+
+front_page = (
+    b'<html><body><div class="column-content">'
+    b'<a href="/politiek/1/kabinet.html" class="link">a</a>'
+    b'<a href="/sport/2/oranje.html" class="link">b</a>'
+    b'<a href="/economie/3/beurs.html" class="link">c</a>'
+    b'</div></body></html>'
+)
+
+
+def get_article_page(title, published, num_comments):
+    return ('<html><body><h1 class="title fluid">%s</h1><span class="pubdate small">%s</span>'
+            '<div class="block-wrapper"><div class="block-content"><p>tekst</p></div></div>'
+            '<span class="comments-count">%d</span></body></html>' % (title, published, num_comments)).encode('utf-8')
+
+
+class TestCrawlerDaemon(TestCase):
+    def test_adaptive_interval_shortens_when_new_links_appear_often(self):
+        interval = AdaptiveInterval(min_interval=60, max_interval=900, target_new_links=3)
+        self.assertEqual(150, interval.update(6, 300))
+        self.assertEqual(60, interval.update(60, 150))
+
+    def test_adaptive_interval_lengthens_gradually_without_new_links(self):
+        interval = AdaptiveInterval(min_interval=60, max_interval=900, target_new_links=3, smoothing=0.5)
+        first_interval = interval.update(6, 300)
+        second_interval = interval.update(0, first_interval)
+        self.assertLess(first_interval, second_interval)
+        self.assertLess(second_interval, 900)
+        self.assertEqual(900, AdaptiveInterval(60, 900).update(0, 300))
+
+    def test_refresh_schedule_pops_due_jobs_in_order(self):
+        schedule = RefreshSchedule()
+        now = datetime(2016, 5, 1, 12)
+        schedule.schedule({'_id': 2}, now - timedelta(minutes=1))
+        schedule.schedule({'_id': 3}, now + timedelta(hours=1))
+        schedule.schedule({'_id': 1}, now - timedelta(hours=1), attempt=1)
+        self.assertListEqual([({'_id': 1}, 1)], schedule.pop_due(now, max_jobs=1))
+        self.assertListEqual([({'_id': 2}, 0)], schedule.pop_due(now))
+        self.assertEqual(now + timedelta(hours=1), schedule.get_next_due())
+        self.assertEqual(1, len(schedule))
+
+
+class TestCrawlerDaemonDatabase(TestCase):
+    def setUp(self):
+        self.collection = Mock()
+        for module in (collect_articles, crawler_daemon):
+            patcher = patch.object(module, 'collection', self.collection)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # The database contains one article, whose number of comments hasn't been refreshed yet
+        self.stored_article = {'_id': 0, 'url': base_url + '/binnenland/0/weer.html', 'published': datetime(2016, 5, 1)}
+        self.collection.find.side_effect = self.find
+        self.pages = {
+            base_url: front_page,
+            base_url + '/politiek/1/kabinet.html': get_article_page('Kabinet valt', '01-05-16 12:00', 12),
+            base_url + '/sport/2/oranje.html': get_article_page('Oranje wint', '01-05-16 13:00', 40)
+        }
+        self.client = Mock()
+        self.client.get.side_effect = self.get_page
+        self.write_errors = []
+        self.collection.insert_many.side_effect = self.insert_many
+        self.daemon = CrawlerDaemon(self.client, max_attempts=2)
+        self.daemon.seen_urls = BloomFilter(1000)
+
+    def get_page(self, url):
+        if url not in self.pages:
+            raise URLError('not found')
+        return self.pages[url]
+
+    def insert_many(self, documents, ordered=True):
+        # Like pymongo, assign an '_id' to each document before inserting it
+        for index, document in enumerate(documents):
+            document['_id'] = index + 1
+        if self.write_errors:
+            raise BulkWriteError({'writeErrors': self.write_errors,
+                                  'nInserted': len(documents) - len(self.write_errors)})
+
+    def find(self, query, projection):
+        if query == {'num_comments': None}:
+            return iter([self.stored_article])
+        return iter([{'url': self.stored_article['url']}])
+
+    def publish_front_page_articles_now(self):
+        published = datetime.now().strftime('%d-%m-%y %H:%M')
+        self.pages[base_url + '/politiek/1/kabinet.html'] = get_article_page('Kabinet valt', published, 12)
+        self.pages[base_url + '/sport/2/oranje.html'] = get_article_page('Oranje wint', published, 40)
+        self.pages[self.stored_article['url']] = get_article_page('Weer', '01-05-16 00:00', 7)
+
+    def get_requested_urls(self):
+        return [call[0][0] for call in self.client.get.call_args_list]
+
+    def test_poll_schedules_refresh_of_inserted_articles_only(self):
+        # Another crawler inserted the second article between fetching and inserting it
+        self.write_errors = [{'index': 1, 'code': duplicate_key_error_code, 'errmsg': 'duplicate key'}]
+        self.assertEqual(3, self.daemon.poll())
+        self.assertEqual(1, len(self.daemon.schedule))
+        self.assertEqual(datetime(2016, 5, 2, 12), self.daemon.schedule.get_next_due())
+        self.assertListEqual([({'_id': 1, 'url': base_url + '/politiek/1/kabinet.html'}, 0)],
+                             self.daemon.schedule.pop_due(datetime(2016, 5, 3)))
+        self.assertIn(base_url + '/politiek/1/kabinet.html', self.daemon.seen_urls)
+        self.assertIn(base_url + '/sport/2/oranje.html', self.daemon.seen_urls)
+        self.assertNotIn(base_url + '/economie/3/beurs.html', self.daemon.seen_urls)
+
+    def test_poll_retries_article_that_cannot_be_retrieved_until_max_attempts(self):
+        self.assertEqual(3, self.daemon.poll())
+        self.assertEqual(2, len(self.daemon.schedule))
+        # Only the link that failed is retrieved again, without counting it as a new link
+        self.client.get.reset_mock()
+        self.assertEqual(0, self.daemon.poll())
+        self.assertListEqual([base_url, base_url + '/economie/3/beurs.html'], self.get_requested_urls())
+        self.assertIn(base_url + '/economie/3/beurs.html', self.daemon.seen_urls)
+        self.client.get.reset_mock()
+        self.assertEqual(0, self.daemon.poll())
+        self.assertListEqual([base_url], self.get_requested_urls())
+        self.collection.insert_many.assert_called_once()
+
+    def test_poll_returns_none_if_front_page_cannot_be_retrieved(self):
+        del self.pages[base_url]
+        self.assertIsNone(self.daemon.poll())
+        self.collection.insert_many.assert_not_called()
+
+    def test_refresh_due_comments_updates_articles_and_reschedules_failures(self):
+        now = datetime(2016, 5, 2, 14)
+        self.collection.bulk_write.return_value = Mock(modified_count=1, deleted_count=0)
+        self.daemon.schedule.schedule({'_id': 1, 'url': base_url + '/politiek/1/kabinet.html'}, now)
+        self.daemon.schedule.schedule({'_id': 3, 'url': base_url + '/economie/3/beurs.html'}, now)
+        self.daemon.schedule.schedule({'_id': 2, 'url': base_url + '/sport/2/oranje.html'}, now + timedelta(hours=1))
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            self.assertEqual(2, self.daemon.refresh_due_comments(executor, now))
+            self.assertListEqual([UpdateOne({'_id': 1}, {'$set': {'num_comments': 12}})],
+                                 self.collection.bulk_write.call_args[0][0])
+            later = now + self.daemon.retry_delay
+            self.assertListEqual([({'_id': 2, 'url': base_url + '/sport/2/oranje.html'}, 0),
+                                  ({'_id': 3, 'url': base_url + '/economie/3/beurs.html'}, 1)],
+                                 self.daemon.schedule.pop_due(later))
+
+            # The second failure is the last attempt
+            self.daemon.schedule.schedule({'_id': 3, 'url': base_url + '/economie/3/beurs.html'}, later, 1)
+            self.assertEqual(1, self.daemon.refresh_due_comments(executor, later))
+            self.assertEqual(0, len(self.daemon.schedule))
+
+    def test_poll_returns_none_if_front_page_is_empty(self):
+        self.pages[base_url] = b''
+        self.assertIsNone(self.daemon.poll())
+
+    def test_warm_adds_stored_urls_and_schedules_refreshes(self):
+        self.daemon.warm()
+        self.collection.create_index.assert_called_once_with('url', unique=True)
+        self.assertIn(self.stored_article['url'], self.daemon.seen_urls)
+        self.assertEqual(min_seen_urls_capacity, self.daemon.seen_urls.capacity)
+        self.assertListEqual([({'_id': 0, 'url': self.stored_article['url']}, 0)],
+                             self.daemon.schedule.pop_due(datetime(2016, 5, 2)))
+
+    def test_run_polls_and_refreshes_until_stopped(self):
+        self.collection.bulk_write.return_value = Mock(modified_count=1, deleted_count=0)
+        self.publish_front_page_articles_now()
+        stop_event = threading.Event()
+        self.daemon.run(stop_event, on_cycle=stop_event.set)
+        self.assertListEqual([base_url + '/politiek/1/kabinet.html', base_url + '/sport/2/oranje.html'],
+                             [article['url'] for article in self.collection.insert_many.call_args[0][0]])
+        self.assertListEqual([UpdateOne({'_id': 0}, {'$set': {'num_comments': 7}})],
+                             self.collection.bulk_write.call_args[0][0])
+        self.assertEqual(2, len(self.daemon.schedule))
+
+    def test_run_keeps_running_and_keeps_refreshes_scheduled_after_database_errors(self):
+        self.collection.insert_many.side_effect = AutoReconnect('connection lost')
+        self.collection.bulk_write.side_effect = AutoReconnect('connection lost')
+        self.publish_front_page_articles_now()
+        cycles = []
+
+        def on_cycle():
+            cycles.append(datetime.now())
+            if len(cycles) == 2:
+                stop_event.set()
+
+        stop_event = threading.Event()
+        self.daemon.interval = AdaptiveInterval(min_interval=0.01, max_interval=0.01)
+        self.daemon.run(stop_event, on_cycle)
+        self.assertEqual(2, self.collection.insert_many.call_count)
+        self.assertEqual(1, self.collection.bulk_write.call_count)
+        # The articles that couldn't be saved are retrieved again by the next poll
+        self.assertNotIn(base_url + '/politiek/1/kabinet.html', self.daemon.seen_urls)
+        self.assertListEqual([(0, 0)], [(article['_id'], attempt) for article, attempt in
+                                        self.daemon.schedule.pop_due(cycles[0] + self.daemon.retry_delay)])
@@ -0,0 +1,80 @@
+from datetime import datetime
+from unittest import TestCase
+
+from crawling.extraction import extract_fields, parse_number_of_comments, parse_page
+from crawling.site_schema import compile_site_schema, nu_nl_schema
+
+article_page = (
+    b'<html><head><title>NU</title></head><body>'
+    b'<h1 class="title fluid"> Kabinet <em>valt</em> </h1>'
+    b'<span class="pubdate small">18-10-26 12:30</span>'
+    b'<div class="block-wrapper"><div class="block-content">'
+    b'<p>De <a href="/x">Tweede Kamer</a> stemde</p><p></p><p>gisteren <strong>tegen</strong>.</p>'
+    b'</div></div>'
+    b'<span class="comments-count">1.2K</span>'
+    b'<div class="footer">' + b'<p>footer</p>' * 1000 + b'</div>'
+    b'</body></html>'
+)
+
+
+class TestExtraction(TestCase):
+    def setUp(self):
+        self.site_schema = compile_site_schema(nu_nl_schema)
+
+    def test_parse_number_of_comments_parses_plain_number(self):
+        self.assertEqual(42, parse_number_of_comments(' 42 '))
+
+    def test_parse_number_of_comments_parses_thousands_suffix(self):
+        self.assertEqual(1200, parse_number_of_comments('1.2K'))
+
+    def test_parse_number_of_comments_raises_error_for_invalid_text(self):
+        self.assertRaises(ValueError, parse_number_of_comments, 'comments')
+
+    def test_extract_fields_includes_text_of_nested_elements(self):
+        fields = extract_fields(parse_page(article_page, self.site_schema), self.site_schema)
+        self.assertDictEqual({
+            'title': 'Kabinet valt',
+            'published': datetime(2026, 10, 18, 12, 30),
+            'text': 'De Tweede Kamer stemde\ngisteren tegen.',
+            'num_comments': 1200
+        }, fields)
+
+    def test_extract_fields_raises_error_for_missing_required_field(self):
+        page = parse_page(b'<html><body><p>empty</p></body></html>', self.site_schema)
+        self.assertRaises(ValueError, extract_fields, page, self.site_schema, ['title'])
+        self.assertDictEqual({'num_comments': None, 'text': ''},
+                             extract_fields(page, self.site_schema, ['num_comments', 'text']))
+
+    def test_parse_page_stops_incremental_parsing_once_fields_are_complete(self):
+        site_schema = self.site_schema._replace(chunk_size=64)
+        page = parse_page(article_page, site_schema, ['title', 'published'])
+        self.assertEqual(0, len(page.xpath('//div[@class="footer"]')))
+        self.assertEqual('Kabinet valt', extract_fields(page, site_schema, ['title'])['title'])
+        full_page = parse_page(article_page, site_schema._replace(incremental=False))
+        self.assertEqual(1000, len(full_page.xpath('//div[@class="footer"]/p')))
+
+    def test_parse_page_returns_none_for_empty_page(self):
+        self.assertIsNone(parse_page(b'', self.site_schema))
+        self.assertIsNone(parse_page(b'', self.site_schema._replace(incremental=False)))
+        self.assertDictEqual({'num_comments': None}, extract_fields(None, self.site_schema, ['num_comments']))
+
+    def test_compile_site_schema_rejects_invalid_xpath(self):
+        self.assertRaises(ValueError, compile_site_schema, {'fields': {'title': {'xpath': '//h1['}}})
+
+    def test_parse_page_stops_at_closing_tag_of_first_element_selected_by_whole_path(self):
+        site_schema = compile_site_schema({'incremental': True, 'chunk_size': 32, 'fields': {
+            'title': {'xpath': '//div[@id="main"]/h1'},
+            'text': {'xpath': '//div[@class="w"]//p', 'multiple': True, 'container': '//div[@class="w"]'}
+        }})
+        page_bytes = (b'<html><body><div class="w"><h1>Menu</h1><div class="w"><p>a</p></div><p>b</p></div>'
+                      b'<div id="main"><h1>Titel</h1></div>' + b'<p>footer</p>' * 100 + b'</body></html>')
+        page = parse_page(page_bytes, site_schema)
+        self.assertDictEqual({'title': 'Titel', 'text': 'a\nb'}, extract_fields(page, site_schema))
+        self.assertLess(len(page.xpath('//p')), 10)
+
+    def test_parse_page_parses_whole_page_for_fields_without_end_marker(self):
+        site_schema = compile_site_schema({'incremental': True, 'chunk_size': 32,
+                                           'fields': {'title': {'xpath': '//h1/text()'}}})
+        self.assertIsNone(site_schema.fields['title'].end_marker)
+        page = parse_page(b'<html><body><h1>Titel</h1>' + b'<p>footer</p>' * 100 + b'</body></html>', site_schema)
+        self.assertEqual(100, len(page.xpath('//p')))
@@ -0,0 +1,108 @@
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+from urllib.error import HTTPError
+
+from crawling.http_client import HttpClient
+from crawling.response_cache import ResponseCache
+
+
+class TestHttpClient(TestCase):
+    def setUp(self):
+        self.requests = []
+        self.in_flight = [0, 0]
+        self.dropped_paths = set()
+        test = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                test.requests.append((self.path, self.client_address[1], self.headers.get('If-None-Match')))
+                if self.path == '/drop' and self.path not in test.dropped_paths:
+                    # Close the connection without responding, like a server closing an idle keep-alive connection
+                    test.dropped_paths.add(self.path)
+                    self.close_connection = True
+                    return
+                if self.path == '/old':
+                    self.send_response(301)
+                    self.send_header('Location', '/new')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.path == '/missing':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.headers.get('If-None-Match') == '"1"':
+                    self.send_response(304)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.path == '/slow':
+                    with lock:
+                        test.in_flight[0] += 1
+                        test.in_flight[1] = max(test.in_flight)
+                    time.sleep(0.1)
+                    with lock:
+                        test.in_flight[0] -= 1
+                self.send_response(200)
+                self.send_header('ETag', '"1"')
+                self.send_header('Content-Length', '4')
+                self.end_headers()
+                self.wfile.write(b'page')
+
+            def log_message(self, format, *args):
+                pass
+
+        lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_reuses_keep_alive_connection_of_thread(self):
+        with HttpClient() as client:
+            self.assertEqual(b'page', client.get(self.base_url + '/a'))
+            self.assertEqual(b'page', client.get(self.base_url + '/b'))
+        self.assertEqual(1, len({client_port for _, client_port, _ in self.requests}))
+
+    def test_get_retries_once_on_dropped_connection(self):
+        with HttpClient() as client:
+            self.assertEqual(b'page', client.get(self.base_url + '/drop'))
+        self.assertListEqual(['/drop', '/drop'], [path for path, _, _ in self.requests])
+        self.assertNotEqual(self.requests[0][1], self.requests[1][1])
+
+    def test_get_raises_http_error_for_error_status(self):
+        with HttpClient() as client:
+            with self.assertRaises(HTTPError):
+                client.get(self.base_url + '/missing')
+
+    def test_requests_to_host_are_limited_and_spaced(self):
+        with HttpClient(max_requests_per_host=2) as client:
+            with ThreadPoolExecutor(max_workers=6) as executor:
+                list(executor.map(client.get, [self.base_url + '/slow'] * 6))
+        self.assertEqual(2, self.in_flight[1])
+
+        with HttpClient(min_delay_per_host=0.1) as client:
+            start_time = time.monotonic()
+            for _ in range(3):
+                client.get(self.base_url + '/a')
+            self.assertGreaterEqual(time.monotonic() - start_time, 0.2)
+
+    def test_get_sends_conditional_headers_after_redirect(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with HttpClient(cache=ResponseCache(directory)) as client:
+                self.assertEqual(b'page', client.get(self.base_url + '/old'))
+                self.assertEqual(b'page', client.get(self.base_url + '/old'))
+        self.assertListEqual([('/old', None), ('/new', None), ('/old', '"1"'), ('/new', '"1"')],
+                             [(path, etag) for path, _, etag in self.requests])
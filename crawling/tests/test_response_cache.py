@@ -0,0 +1,101 @@
+import os
+import tempfile
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+from urllib.error import URLError
+
+from crawling.http_client import HttpClient
+from crawling.response_cache import ResponseCache
+
+
+class TestResponseCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_get_returns_stored_response_with_validators(self):
+        cache = ResponseCache(self.directory.name)
+        cache.put('http://example.com/a', b'<html>a</html>', {'ETag': '"1"', 'Last-Modified': 'Mon, 01 Jan 2018'})
+        cached_response = cache.get('http://example.com/a')
+        self.assertEqual(b'<html>a</html>', cached_response.body)
+        self.assertEqual('"1"', cached_response.etag)
+        self.assertEqual('Mon, 01 Jan 2018', cached_response.last_modified)
+        self.assertIsNone(cache.get('http://example.com/b'))
+
+    def test_size_is_restored_when_reopened(self):
+        cache = ResponseCache(self.directory.name)
+        cache.put('http://example.com/a', b'a' * 1000)
+        cache.put('http://example.com/a', b'b' * 1000)
+        self.assertEqual(cache.get_size(), ResponseCache(self.directory.name).get_size())
+
+    def test_put_evicts_least_recently_used_responses(self):
+        cache = ResponseCache(self.directory.name)
+        for index in range(3):
+            cache.put('http://example.com/%d' % index, os.urandom(1000))
+        size = cache.get_size()
+        # Make the first response the most recently used one
+        for index, age in enumerate([0, 20, 10]):
+            path = cache._get_path('http://example.com/%d' % index)
+            os.utime(path, (time.time() - age, time.time() - age))
+        cache.max_size = size
+        cache.put('http://example.com/3', os.urandom(1000))
+        self.assertIsNotNone(cache.get('http://example.com/0'))
+        self.assertIsNone(cache.get('http://example.com/1'))
+        self.assertIsNone(cache.get('http://example.com/2'))
+        self.assertIsNotNone(cache.get('http://example.com/3'))
+        self.assertLessEqual(cache.get_size(), size)
+
+
+class TestHttpClientWithCache(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.requests = []
+        requests = self.requests
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                requests.append(self.headers.get('If-None-Match'))
+                if self.headers.get('If-None-Match') == '"1"':
+                    self.send_response(304)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', '"1"')
+                self.send_header('Content-Length', '4')
+                self.end_headers()
+                self.wfile.write(b'page')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), RequestHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/article' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_get_revalidates_cached_page_with_conditional_request(self):
+        with HttpClient(cache=ResponseCache(self.directory.name)) as client:
+            self.assertEqual(b'page', client.get(self.url))
+            self.assertEqual(b'page', client.get(self.url))
+        self.assertListEqual([None, '"1"'], self.requests)
+
+    def test_get_in_replay_mode_serves_only_from_cache(self):
+        with HttpClient(cache=ResponseCache(self.directory.name)) as client:
+            client.get(self.url)
+        with HttpClient(cache=ResponseCache(self.directory.name, replay=True)) as client:
+            self.assertEqual(b'page', client.get(self.url))
+            with self.assertRaises(URLError):
+                client.get(self.url + '/other')
+        self.assertEqual(1, len(self.requests))
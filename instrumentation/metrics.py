@@ -0,0 +1,328 @@
+"""
+Collects timers, counters and gauges from all stages of the pipeline, such as download latency, HTML parse time,
+database read and write time, preprocessing throughput, vectorization time and the fit time of each fold.
+Metrics are kept in memory by a process-wide registry and written at the end of a run, either as a Prometheus
+textfile, to be picked up by the textfile collector of the node exporter, or appended to a JSON lines file,
+with one line per run, to chart metrics over time.
+
+Stages can additionally be profiled on request: with CPU profiling enabled, each stage writes a cProfile dump
+'<stage>.prof' to the profile directory; with memory profiling enabled, its peak memory use is recorded as a gauge
+and its largest allocation sites are written to '<stage>.memory.txt'.
+Metrics are only collected in the calling process; work done by worker processes is recorded by the parent
+when their results arrive.
+"""
+import cProfile
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+
+metric_prefix = 'newsclassification_'
+metrics_formats = ('prometheus', 'jsonl')
+profile_modes = ('cpu', 'memory', 'all')
+
+Sample = namedtuple('Sample', ['name', 'type', 'labels', 'value'])
+TimerSummary = namedtuple('TimerSummary', ['count', 'sum', 'max'])
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timers = {}
+_profiling = {'directory': None, 'cpu': False, 'memory': False, 'active': False}
+
+
+def get_key(name, labels):
+    """
+    :param name: name of a metric
+    :param labels: dict of label names and values
+    :return: hashable key identifying the metric with these labels
+    """
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def increment(name, value=1, **labels):
+    """
+    :param name: name of the counter
+    :param value: amount to increase the counter by
+    :param labels: labels distinguishing this counter from others of the same name
+    """
+    key = get_key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """
+    :param name: name of the gauge
+    :param value: current value of the gauge
+    :param labels: labels distinguishing this gauge from others of the same name
+    """
+    with _lock:
+        _gauges[get_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    """
+    :param name: name of the timer
+    :param seconds: duration to add to the timer
+    :param labels: labels distinguishing this timer from others of the same name
+    """
+    key = get_key(name, labels)
+    with _lock:
+        count, total, maximum = _timers.get(key, (0, 0.0, 0.0))
+        _timers[key] = TimerSummary(count + 1, total + seconds, max(maximum, seconds))
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Adds the duration of the block to a timer, also if the block raises an exception.
+    :param name: name of the timer
+    :param labels: labels distinguishing this timer from others of the same name
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start_time, **labels)
+
+
+def timed(iterable, name, **labels):
+    """
+    :param iterable: iterable whose items are expensive to produce, such as a database cursor
+    :param name: name of the timer to add the time spent producing each item to
+    :param labels: labels distinguishing this timer from others of the same name
+    :return: generator of the items of iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        start_time = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        observe(name, time.perf_counter() - start_time, **labels)
+        yield item
+
+
+@contextmanager
+def stage(name):
+    """
+    Times a stage of the pipeline as 'stage_seconds', and profiles it if profiling is enabled.
+    Stages nested in a profiled stage are only timed, since they are part of its profile.
+    :param name: name of the stage, also used for the names of its profile files
+    """
+    profiled = profile_cpu = profile_memory = False
+    with _lock:
+        if _profiling['directory'] is not None and not _profiling['active']:
+            _profiling['active'] = profiled = True
+            profile_cpu = _profiling['cpu']
+            profile_memory = _profiling['memory'] and not tracemalloc.is_tracing()
+    profiler = cProfile.Profile() if profile_cpu else None
+    if profile_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with timer('stage_seconds', stage=name):
+            yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(_profiling['directory'], '%s.prof' % name))
+        if profile_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            statistics = tracemalloc.take_snapshot().statistics('lineno')
+            tracemalloc.stop()
+            set_gauge('stage_peak_memory_bytes', peak_memory, stage=name)
+            with open(os.path.join(_profiling['directory'], '%s.memory.txt' % name), 'w') as memory_file:
+                memory_file.write('Peak memory: %d bytes\n' % peak_memory)
+                memory_file.writelines('%s\n' % statistic for statistic in statistics[:25])
+        if profiled:
+            with _lock:
+                _profiling['active'] = False
+
+
+def enable_profiling(directory, cpu=True, memory=False):
+    """
+    :param directory: directory to write the profiles of stages to, created if it doesn't exist
+    :param cpu: whether to profile stages with cProfile
+    :param memory: whether to trace the memory allocations of stages with tracemalloc
+    """
+    os.makedirs(directory, exist_ok=True)
+    with _lock:
+        _profiling.update(directory=directory, cpu=cpu, memory=memory)
+
+
+def disable_profiling():
+    """
+    Stops profiling stages started after this call.
+    """
+    with _lock:
+        _profiling.update(directory=None, cpu=False, memory=False)
+
+
+def reset():
+    """
+    Removes all collected metrics.
+    """
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timers.clear()
+
+
+def get_samples():
+    """
+    :return: list of Sample of all collected metrics, sorted by name and labels; the value of a timer is a TimerSummary
+    """
+    with _lock:
+        samples = [Sample(name, 'counter', dict(labels), value) for (name, labels), value in _counters.items()]
+        samples.extend(Sample(name, 'gauge', dict(labels), value) for (name, labels), value in _gauges.items())
+        samples.extend(Sample(name, 'timer', dict(labels), value) for (name, labels), value in _timers.items())
+    return sorted(samples, key=lambda sample: (sample.name, sorted(sample.labels.items())))
+
+
+def format_prometheus(samples):
+    """
+    :param samples: list of Sample
+    :return: string containing samples in the Prometheus text exposition format; timers are exposed as summaries
+        with a '_count' and '_sum', and an additional '_max' gauge
+    """
+    lines = []
+    declared = set()
+    for sample in samples:
+        name = metric_prefix + sample.name
+        metric_type = 'summary' if sample.type == 'timer' else sample.type
+        if name not in declared:
+            declared.add(name)
+            lines.append('# TYPE %s %s' % (name, metric_type))
+        labels = format_prometheus_labels(sample.labels)
+        if sample.type == 'timer':
+            lines.append('%s_count%s %d' % (name, labels, sample.value.count))
+            lines.append('%s_sum%s %r' % (name, labels, float(sample.value.sum)))
+        else:
+            lines.append('%s%s %r' % (name, labels, float(sample.value)))
+    # The maximum of timers is a gauge, which must be declared separately from the summary
+    for sample in samples:
+        if sample.type == 'timer':
+            name = '%s%s_max' % (metric_prefix, sample.name)
+            if name not in declared:
+                declared.add(name)
+                lines.append('# TYPE %s gauge' % name)
+            lines.append('%s%s %r' % (name, format_prometheus_labels(sample.labels), float(sample.value.max)))
+    return ''.join('%s\n' % line for line in lines)
+
+
+def format_prometheus_labels(labels):
+    """
+    :param labels: dict of label names and values
+    :return: labels in Prometheus notation, such as '{stage="preprocess"}', or an empty string if there are none
+    """
+    if not labels:
+        return ''
+    escaped = ('%s="%s"' % (label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for label, value in sorted(labels.items()))
+    return '{%s}' % ','.join(escaped)
+
+
+def write_prometheus_textfile(path, samples=None):
+    """
+    Writes metrics to a Prometheus textfile, replacing it atomically so the collector never reads a partial file.
+    :param path: path of the textfile, which should end in '.prom' for the textfile collector
+    :param samples: list of Sample to write, defaults to all collected metrics
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+    try:
+        with os.fdopen(file_descriptor, 'w') as textfile:
+            textfile.write(format_prometheus(get_samples() if samples is None else samples))
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+
+def append_json_line(path, job, samples=None):
+    """
+    Appends a line containing a JSON object with the time, the job and all metrics to a JSON lines file.
+    :param path: path of the JSON lines file
+    :param job: name of the job the metrics were collected by
+    :param samples: list of Sample to write, defaults to all collected metrics
+    """
+    metrics = []
+    for sample in get_samples() if samples is None else samples:
+        metric = {'name': sample.name, 'type': sample.type, 'labels': sample.labels}
+        if sample.type == 'timer':
+            metric.update(sample.value._asdict())
+        else:
+            metric['value'] = sample.value
+        metrics.append(metric)
+    with open(path, 'a') as json_lines_file:
+        json_lines_file.write(json.dumps({'timestamp': datetime.now().isoformat(), 'job': job,
+                                          'metrics': metrics}) + '\n')
+
+
+def write_metrics(path, metrics_format='prometheus', job=None):
+    """
+    :param path: path of the file to write all collected metrics to
+    :param metrics_format: 'prometheus' to replace a Prometheus textfile, 'jsonl' to append to a JSON lines file
+    :param job: name of the job the metrics were collected by, added as a label in the Prometheus format
+    """
+    if metrics_format not in metrics_formats:
+        raise ValueError("'metrics_format' must be one of %s." % ', '.join(metrics_formats))
+    if metrics_format == 'jsonl':
+        append_json_line(path, job)
+    else:
+        samples = get_samples()
+        if job is not None:
+            samples = [sample._replace(labels=dict(sample.labels, job=job)) for sample in samples]
+        write_prometheus_textfile(path, samples)
+
+
+def add_instrumentation_arguments(parser):
+    """
+    Adds the command line arguments used by 'configure_instrumentation' and 'finish_instrumentation' to parser.
+    :param parser: ArgumentParser of a script
+    """
+    parser.add_argument(
+        '--metrics-file',
+        help='File to write metrics to at the end of the run'
+    )
+    parser.add_argument(
+        '--metrics-format', choices=metrics_formats, default='prometheus',
+        help="'prometheus' to replace a Prometheus textfile, 'jsonl' to append a line to a JSON lines file\n"
+             "(default: prometheus)"
+    )
+    parser.add_argument(
+        '--profile', choices=profile_modes,
+        help="Profile each stage: 'cpu' with cProfile, 'memory' with tracemalloc or 'all' with both"
+    )
+    parser.add_argument(
+        '--profile-dir', default='profiles',
+        help='Directory to write the profiles of stages to (default: profiles)'
+    )
+
+
+def configure_instrumentation(args):
+    """
+    :param args: parsed arguments of a parser 'add_instrumentation_arguments' was applied to
+    """
+    if args.profile:
+        enable_profiling(args.profile_dir, cpu=args.profile in ('cpu', 'all'), memory=args.profile in ('memory', 'all'))
+
+
+def finish_instrumentation(args, job):
+    """
+    Writes all collected metrics to the metrics file given by args, if any.
+    :param args: parsed arguments of a parser 'add_instrumentation_arguments' was applied to
+    :param job: name of the job the metrics were collected by
+    """
+    if args.metrics_file:
+        write_metrics(args.metrics_file, args.metrics_format, job)
@@ -0,0 +1,89 @@
+import json
+import os
+import pstats
+import tempfile
+
+from unittest import TestCase
+
+from instrumentation import metrics
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        metrics.disable_profiling()
+        metrics.reset()
+        self.directory.cleanup()
+
+    def get_sample(self, name, **labels):
+        return next(sample for sample in metrics.get_samples() if sample.name == name and sample.labels == labels)
+
+    def test_increment_adds_to_counter_per_labels(self):
+        metrics.increment('pages_total')
+        metrics.increment('pages_total', 2)
+        metrics.increment('pages_total', reason='error')
+        self.assertEqual(3, self.get_sample('pages_total').value)
+        self.assertEqual(1, self.get_sample('pages_total', reason='error').value)
+
+    def test_timer_records_count_sum_and_max_also_on_exception(self):
+        metrics.observe('download_seconds', 0.5)
+        with self.assertRaises(ValueError):
+            with metrics.timer('download_seconds'):
+                raise ValueError()
+        summary = self.get_sample('download_seconds').value
+        self.assertEqual(2, summary.count)
+        self.assertGreaterEqual(summary.sum, 0.5)
+        self.assertEqual(0.5, summary.max)
+
+    def test_timed_observes_each_item(self):
+        self.assertListEqual([1, 2, 3], list(metrics.timed([1, 2, 3], 'read_seconds', collection='articles')))
+        self.assertEqual(3, self.get_sample('read_seconds', collection='articles').value.count)
+
+    def test_format_prometheus_declares_each_metric_once(self):
+        metrics.increment('pages_total', reason='a"b')
+        metrics.increment('pages_total', reason='c')
+        metrics.observe('fit_seconds', 2.0, classifier='NB')
+        lines = metrics.format_prometheus(metrics.get_samples()).splitlines()
+        self.assertListEqual([
+            '# TYPE newsclassification_fit_seconds summary',
+            'newsclassification_fit_seconds_count{classifier="NB"} 1',
+            'newsclassification_fit_seconds_sum{classifier="NB"} 2.0',
+            '# TYPE newsclassification_pages_total counter',
+            'newsclassification_pages_total{reason="a\\"b"} 1.0',
+            'newsclassification_pages_total{reason="c"} 1.0',
+            '# TYPE newsclassification_fit_seconds_max gauge',
+            'newsclassification_fit_seconds_max{classifier="NB"} 2.0'
+        ], lines)
+
+    def test_write_metrics_appends_json_lines(self):
+        path = os.path.join(self.directory.name, 'metrics.jsonl')
+        metrics.set_gauge('tokens_per_second', 10.0)
+        metrics.write_metrics(path, 'jsonl', 'preprocess')
+        metrics.write_metrics(path, 'jsonl', 'preprocess')
+        with open(path) as json_lines_file:
+            lines = [json.loads(line) for line in json_lines_file]
+        self.assertEqual(2, len(lines))
+        self.assertEqual('preprocess', lines[0]['job'])
+        self.assertListEqual([{'name': 'tokens_per_second', 'type': 'gauge', 'labels': {}, 'value': 10.0}],
+                             lines[0]['metrics'])
+
+    def test_write_metrics_replaces_prometheus_textfile_with_job_label(self):
+        path = os.path.join(self.directory.name, 'metrics.prom')
+        metrics.increment('pages_total')
+        metrics.write_metrics(path, job='crawl')
+        with open(path) as textfile:
+            self.assertIn('newsclassification_pages_total{job="crawl"} 1.0\n', textfile.read())
+        self.assertListEqual(['metrics.prom'], os.listdir(self.directory.name))
+
+    def test_stage_writes_profiles_only_for_outermost_stage(self):
+        metrics.enable_profiling(self.directory.name, cpu=True, memory=True)
+        with metrics.stage('outer'):
+            with metrics.stage('inner'):
+                [0] * 1000
+        self.assertListEqual(['outer.memory.txt', 'outer.prof'], sorted(os.listdir(self.directory.name)))
+        pstats.Stats(os.path.join(self.directory.name, 'outer.prof'))
+        self.assertGreater(self.get_sample('stage_peak_memory_bytes', stage='outer').value, 0)
+        self.assertEqual(1, self.get_sample('stage_seconds', stage='inner').value.count)
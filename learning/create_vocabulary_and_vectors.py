@@ -1,69 +1,464 @@
 """
 Prepares the collected news articles for use by a Naive Bayes classifier.
 First creates a vocabulary, which is the set of all words occurring in all articles.
-It then expresses each news article as a term vector, where the i-th entry indicates
-how many times word i from the vocabulary occurs in the article.
+It then expresses each news article as a sparse term vector, consisting of the indices of the vocabulary words
+occurring in the article and the number of times each of these words occurs in the article.
+In incremental mode, only processed articles that haven't been marked as vectorized are vectorized. Words that aren't
+yet in the vocabulary are appended to it, so the indices of existing words and thus existing vectors stay valid.
+A vocabulary reduced by 'select_features.py' is not extended, since that would add back the terms it removed;
+new articles are vectorized with the reduced vocabulary until the selection is run again.
+Alternatively, in hashing mode, no vocabulary is created. Each word is mapped to one of a fixed number of features
+by hashing it, so all articles are vectorized in a single streaming pass with bounded memory.
+Processed articles whose title and text are stored as token IDs are vectorized by counting the IDs of all articles
+of a batch at once, using the shared token dictionary to map each token ID to its term or hash.
 """
+import numpy
+
+from argparse import ArgumentParser
+from argparse import RawTextHelpFormatter
 from bson import DBRef
 from collections import Counter
-from pymongo import MongoClient
-from pymongo.collection import Collection
-from pymongo.database import Database
+from itertools import islice
+from pymongo.errors import BulkWriteError
+from sklearn.utils import murmurhash3_32
+
+from instrumentation import metrics
+from preprocessing.token_dictionary import TokenDictionary, get_token_ids, is_encoded, tokens_collection_name
+from storage import connection
 
-db_name = 'nu'
 articles_processed_collection_name = 'articles_processed'
 
-db = Database(MongoClient(), db_name)
-processed_collection = Collection(db, articles_processed_collection_name)
-naive_bayes_collection = Collection(db, 'naive_bayes')
-feature_vectors_collection = Collection(db, 'feature_vectors')
+db = connection.get_database()
+processed_collection = connection.get_collection(articles_processed_collection_name)
+naive_bayes_collection = connection.get_collection('naive_bayes')
+feature_vectors_collection = connection.get_collection('feature_vectors')
+tokens_collection = connection.get_collection(tokens_collection_name)
+
+duplicate_key_error_code = 11000
+default_num_hashed_features = 2 ** 20
 
 
-def create_vocabulary(articles):
+def create_vocabulary(articles, token_dictionary=None):
     """
     Creates a set of all words occurring in all articles.
+    A TokenDictionary is required as 'token_dictionary' if any of articles are stored as token IDs.
     """
     print('Creating vocabulary from %d articles...' % len(articles))
-    vocabulary = []
+    vocabulary = set()
+    encoded_articles = get_encoded_articles(articles, token_dictionary)
+    if encoded_articles:
+        token_ids = numpy.concatenate([ids for article in encoded_articles for ids in get_token_ids(article)])
+        occurring_ids = numpy.flatnonzero(numpy.bincount(token_ids, minlength=len(token_dictionary.tokens)))
+        vocabulary.update(token_dictionary.decode(occurring_ids))
     for article in articles:
-        vocabulary.extend(article.get('title', '').split(' '))
-        vocabulary.extend(article.get('text', '').split(' '))
-    vocabulary = sorted(list(set(vocabulary)))
+        if not is_encoded(article):
+            vocabulary.update(article.get('title', '').split(' '))
+            vocabulary.update(article.get('text', '').split(' '))
+    vocabulary = sorted(vocabulary)
     print('Created vocabulary consisting of %d terms.' % len(vocabulary))
     return vocabulary
 
 
-def create_feature_vectors(vocabulary, articles):
+def extend_vocabulary(vocabulary, articles, token_dictionary=None):
+    """
+    Determines which words occurring in articles aren't yet in vocabulary.
+    Appending these to vocabulary keeps the indices of all existing terms unchanged.
+    :param vocabulary: list of terms, or a dict mapping terms to their index, in which terms are looked up faster
+    :param articles: articles to collect new terms from
+    :param token_dictionary: TokenDictionary, required if any of articles are stored as token IDs
+    :return: sorted list of terms occurring in articles that aren't in vocabulary
+    """
+    print('Extending vocabulary of %d terms with %d articles...' % (len(vocabulary), len(articles)))
+    new_terms = set(create_vocabulary(articles, token_dictionary)).difference(vocabulary)
+    return sorted(new_terms)
+
+
+def is_vocabulary_fixed(vocabulary_document):
+    """
+    :param vocabulary_document: vocabulary document of the 'naive_bayes' collection
+    :return: whether the vocabulary was reduced by feature selection, in which case it must not be extended
+    """
+    return vocabulary_document.get('feature_selection') is not None
+
+
+def create_term_index(vocabulary):
     """
-    Creates a vector v of size 'len(vocabulary)' for each article.
-    The value of the i-th element in v is the frequency with which the i-th term in vocabulary occurs in the article.
+    :param vocabulary: list of terms
+    :return: dict mapping each term in vocabulary to its index in vocabulary
+    """
+    return {term: index for index, term in enumerate(vocabulary)}
+
+
+def create_feature_vectors(vocabulary, articles, term_index=None, token_dictionary=None):
+    """
+    Creates a sparse vector for each article, consisting of the indices of the terms in vocabulary that occur in
+    the article ('feature_indices') and the frequency with which each of these terms occurs ('feature_counts').
+    Terms that aren't in vocabulary are ignored.
+    A term index of vocabulary that is maintained across calls can be passed as 'term_index', to avoid recreating it.
+    A TokenDictionary is required as 'token_dictionary' if any of articles are stored as token IDs.
     """
     print('Creating feature vectors for %d articles...' % len(articles))
-    feature_vectors = []
-    for article in articles:
-        # Determine the frequency of each term in article
-        text = article.get('title').split(' ') + article.get('text').split(' ')
-        term_counts = Counter(text)
-        # Represent article as vector of term occurrences
-        feature_vector = [0] * len(vocabulary)
-        for index, term in enumerate(vocabulary):
-            feature_vector[index] = term_counts.get(term, 0)
-        feature_vectors.append({
-            'article_processed_id': DBRef(articles_processed_collection_name, article['_id']),
-            'feature_vector': feature_vector,
-            'num_comments': article.get('num_comments', 0)
-        })
+    with metrics.timer('vectorize_seconds', method='exact'):
+        term_index = term_index if term_index is not None else create_term_index(vocabulary)
+        encoded_articles = get_encoded_articles(articles, token_dictionary)
+        encoded_vectors = iter([])
+        if encoded_articles:
+            encoded_vectors = iter(count_encoded_features(encoded_articles,
+                                                          token_dictionary.get_feature_map(vocabulary, term_index)))
+        feature_vectors = []
+        for article in articles:
+            if is_encoded(article):
+                feature_indices, feature_counts = next(encoded_vectors)
+            else:
+                feature_indices, feature_counts = create_sparse_feature_vector(term_index, article)
+            feature_vectors.append({
+                'article_processed_id': DBRef(articles_processed_collection_name, article['_id']),
+                'feature_indices': feature_indices,
+                'feature_counts': feature_counts,
+                'num_comments': article.get('num_comments', 0)
+            })
+    metrics.increment('articles_vectorized_total', len(feature_vectors), method='exact')
     print('Created %d feature vectors.' % len(feature_vectors))
     return feature_vectors
 
 
-if __name__ == '__main__':
-    articles = [article for article in processed_collection.find()]
-    # Create and save vocabulary
-    vocabulary = create_vocabulary(articles)
+def create_sparse_feature_vector(term_index, article):
+    """
+    :param term_index: dict mapping terms to their index in the vocabulary
+    :param article: article to create feature vector for
+    :return:
+        - sorted list of indices of the terms occurring in article
+        - list of the number of occurrences of each of these terms
+    """
+    # Determine the frequency of each term in article
+    text = article.get('title').split(' ') + article.get('text').split(' ')
+    term_counts = Counter(term_index[term] for term in text if term in term_index)
+    feature_indices = sorted(term_counts)
+    return feature_indices, [term_counts[index] for index in feature_indices]
+
+
+def create_hashed_feature_vectors(articles, num_features, alternate_sign=False, token_dictionary=None):
+    """
+    Creates a sparse vector of size 'num_features' for each article, without using a vocabulary.
+    Each term is mapped to the feature given by its hash modulo num_features.
+    A TokenDictionary is required as 'token_dictionary' if any of articles are stored as token IDs.
+    """
+    print('Creating hashed feature vectors for %d articles...' % len(articles))
+    with metrics.timer('vectorize_seconds', method='hashing'):
+        encoded_articles = get_encoded_articles(articles, token_dictionary)
+        encoded_vectors = iter([])
+        if encoded_articles:
+            # Each token is hashed once, instead of at every occurrence
+            hashes = token_dictionary.get_hashes()
+            token_signs = numpy.where(hashes < 0, -1, 1) if alternate_sign else None
+            encoded_vectors = iter(count_encoded_features(encoded_articles, numpy.abs(hashes) % num_features,
+                                                          token_signs))
+        feature_vectors = []
+        for article in articles:
+            if is_encoded(article):
+                feature_indices, feature_counts = next(encoded_vectors)
+            else:
+                feature_indices, feature_counts = create_hashed_feature_vector(article, num_features, alternate_sign)
+            feature_vectors.append({
+                'article_processed_id': DBRef(articles_processed_collection_name, article['_id']),
+                'feature_indices': feature_indices,
+                'feature_counts': feature_counts,
+                'num_comments': article.get('num_comments', 0)
+            })
+    metrics.increment('articles_vectorized_total', len(feature_vectors), method='hashing')
+    print('Created %d feature vectors.' % len(feature_vectors))
+    return feature_vectors
+
+
+def create_hashed_feature_vector(article, num_features, alternate_sign=False):
+    """
+    :param article: article to create feature vector for
+    :param num_features: number of features to hash terms into
+    :param alternate_sign: whether to use the sign of the hash of each term as the sign of its count,
+        so that collisions tend to cancel out instead of accumulating;
+        the resulting negative counts can't be used with multinomial Naive Bayes
+    :return:
+        - sorted list of indices of the features occurring in article
+        - list of the (signed) number of occurrences of each of these features
+    """
+    text = article.get('title').split(' ') + article.get('text').split(' ')
+    feature_counts = Counter()
+    for term in text:
+        hash_value = murmurhash3_32(term, positive=False)
+        feature_counts[abs(hash_value) % num_features] += -1 if alternate_sign and hash_value < 0 else 1
+    feature_indices = sorted(index for index, count in feature_counts.items() if count != 0)
+    return feature_indices, [feature_counts[index] for index in feature_indices]
+
+
+def get_encoded_articles(articles, token_dictionary):
+    """
+    :param articles: list of processed articles
+    :param token_dictionary: TokenDictionary, or None if articles aren't expected to be stored as token IDs
+    :return: list of the articles that are stored as token IDs
+    :raises ValueError: if any of articles are stored as token IDs, but no token_dictionary is given
+    """
+    encoded_articles = [article for article in articles if is_encoded(article)]
+    if encoded_articles and token_dictionary is None:
+        raise ValueError('Articles stored as token IDs require a token dictionary.')
+    return encoded_articles
+
+
+def count_encoded_features(articles, token_features, token_signs=None):
+    """
+    Counts the features of all articles stored as token IDs at once, instead of article by article.
+    :param articles: list of processed articles stored as token IDs
+    :param token_features: NumPy array containing for each token ID the index of its feature, or -1 to ignore it
+    :param token_signs: optional NumPy array containing for each token ID the sign to count it with
+    :return: list containing for each article
+        - sorted list of indices of the features occurring in the article
+        - list of the (signed) number of occurrences of each of these features
+    """
+    token_id_arrays = [get_token_ids(article) for article in articles]
+    token_ids = numpy.concatenate([ids for arrays in token_id_arrays for ids in arrays])
+    rows = numpy.repeat(numpy.arange(len(articles), dtype=numpy.int64),
+                        [sum(len(ids) for ids in arrays) for arrays in token_id_arrays])
+    features = token_features[token_ids]
+    known = features >= 0
+    rows, features, token_ids = rows[known], features[known], token_ids[known]
+
+    # Combining the row and the feature of each token into one key groups the occurrences of a feature in an article,
+    # sorted by article and then by feature
+    num_features = int(features.max()) + 1 if len(features) > 0 else 1
+    keys, key_indices = numpy.unique(rows * num_features + features, return_inverse=True)
+    counts = numpy.bincount(key_indices, weights=token_signs[token_ids] if token_signs is not None else None,
+                            minlength=len(keys)).astype(numpy.int64)
+    if token_signs is not None:
+        nonzero = counts != 0
+        keys, counts = keys[nonzero], counts[nonzero]
+    boundaries = numpy.searchsorted(keys // num_features, numpy.arange(len(articles) + 1)).tolist()
+    feature_indices = (keys % num_features).tolist()
+    counts = counts.tolist()
+    return [(feature_indices[start:end], counts[start:end]) for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+
+def load_token_dictionary():
+    """
+    :return: TokenDictionary containing all tokens of articles stored as token IDs
+    """
+    with metrics.timer('mongo_read_seconds', collection=tokens_collection_name):
+        return TokenDictionary.load(tokens_collection)
+
+
+def get_articles_to_vectorize():
+    """
+    :return: cursor of the processed articles that haven't been marked as vectorized yet, sorted by '_id'
+    """
+    ensure_indexes()
+    mark_vectorized_articles()
+    return processed_collection.find({'vectorized': None}).sort('_id', 1)
+
+
+def ensure_indexes():
+    """
+    Creates the index used to select processed articles that haven't been vectorized yet, if it doesn't exist yet.
+    """
+    processed_collection.create_index('vectorized')
+
+
+def mark_vectorized_articles(batch_size=1000):
+    """
+    Marks processed articles vectorized by earlier versions, which only recorded the last vectorized article,
+    by looking up the processed articles that have a feature vector.
+    Does nothing once any processed article has been marked as vectorized.
+    :param batch_size: number of processed articles to mark at once
+    """
+    if processed_collection.find_one({'vectorized': True}, {'_id': 1}) is not None:
+        return
+    feature_vectors = feature_vectors_collection.find({}, {'article_processed_id': 1})
+    processed_ids = (feature_vector['article_processed_id'].id for feature_vector in feature_vectors)
+    num_marked = 0
+    for batch in iter(lambda: list(islice(processed_ids, batch_size)), []):
+        num_marked += processed_collection.update_many(
+            {'_id': {'$in': batch}}, {'$set': {'vectorized': True}}
+        ).modified_count
+    if num_marked > 0:
+        print('Marked %d previously vectorized articles.' % num_marked)
+
+
+def mark_articles_vectorized(articles):
+    """
+    Marks processed articles as vectorized, once their feature vectors have been saved.
+    :param articles: list of processed articles
+    """
+    if articles:
+        with metrics.timer('mongo_write_seconds', collection=articles_processed_collection_name):
+            processed_collection.update_many({'_id': {'$in': [article['_id'] for article in articles]}},
+                                             {'$set': {'vectorized': True}})
+
+
+def reset_vectorized_articles():
+    """
+    Removes the vectorized mark of all processed articles, before all feature vectors are replaced.
+    """
+    processed_collection.update_many({'vectorized': True}, {'$unset': {'vectorized': ''}})
+
+
+def update_vocabulary_and_vectors(incremental=False):
+    """
+    Creates the vocabulary and the feature vectors of all processed articles, replacing existing ones.
+    In incremental mode, instead extends the existing vocabulary and creates feature vectors only for processed
+    articles that haven't been vectorized yet. Falls back to a full run if there is no vocabulary to extend.
+    :param incremental: whether to only vectorize newly processed articles
+    """
+    vocabulary_document = naive_bayes_collection.find_one({'type': 'vocabulary'}, sort=[('_id', -1)])
+    if incremental and vocabulary_document is None:
+        print('No vocabulary to extend, creating vocabulary from all articles...')
+        incremental = False
+
+    if incremental:
+        with metrics.timer('mongo_read_seconds', collection=articles_processed_collection_name):
+            articles = list(get_articles_to_vectorize())
+        if not articles:
+            print('No new articles to vectorize.')
+            return
+        token_dictionary = load_token_dictionary()
+        vocabulary = vocabulary_document['vocabulary']
+        if is_vocabulary_fixed(vocabulary_document):
+            print('Not extending the vocabulary reduced by feature selection, '
+                  'run select_features.py again to include new terms.')
+        else:
+            new_terms = extend_vocabulary(vocabulary, articles, token_dictionary)
+            vocabulary = vocabulary + new_terms
+            print('Appending %d terms to vocabulary...' % len(new_terms))
+            naive_bayes_collection.update_one(
+                {'_id': vocabulary_document['_id']}, {'$push': {'vocabulary': {'$each': new_terms}}}
+            )
+        save_feature_vectors_of_articles(vocabulary, articles, vocabulary_document['_id'], token_dictionary)
+    else:
+        with metrics.timer('mongo_read_seconds', collection=articles_processed_collection_name):
+            articles = list(processed_collection.find().sort('_id', 1))
+        token_dictionary = load_token_dictionary()
+        replace_vocabulary_and_vectors(create_vocabulary(articles, token_dictionary), articles,
+                                       token_dictionary=token_dictionary)
+
+
+def replace_vocabulary_and_vectors(vocabulary, articles, vocabulary_settings=None, token_dictionary=None):
+    """
+    Replaces the vocabulary and all feature vectors with vocabulary and the feature vectors of articles.
+    :param vocabulary: list of terms
+    :param articles: processed articles to create feature vectors for, sorted by '_id'
+    :param vocabulary_settings: optional dict of additional fields to save in the vocabulary document,
+        such as the settings used to create the vocabulary
+    :param token_dictionary: TokenDictionary, required if any of articles are stored as token IDs
+    """
     print('Inserting vocabulary into database...')
-    naive_bayes_collection.insert_one({'type': 'vocabulary', 'vocabulary': vocabulary})
-    # Create and save feature vectors
-    feature_vectors = create_feature_vectors(vocabulary, articles)
+    naive_bayes_collection.delete_many({'type': {'$in': ['vocabulary', 'hashing']}})
+    vocabulary_document = {'type': 'vocabulary', 'vocabulary': vocabulary}
+    vocabulary_document.update(vocabulary_settings or {})
+    vocabulary_id = naive_bayes_collection.insert_one(vocabulary_document).inserted_id
+    reset_vectorized_articles()
+    feature_vectors_collection.delete_many({})
+    save_feature_vectors_of_articles(vocabulary, articles, vocabulary_id, token_dictionary)
+
+
+def save_feature_vectors_of_articles(vocabulary, articles, vocabulary_id, token_dictionary=None):
+    """
+    Creates and saves the feature vectors of articles, then marks articles as vectorized,
+    so the next incremental run skips them.
+    :param vocabulary: list of terms
+    :param articles: processed articles to create feature vectors for, sorted by '_id'
+    :param vocabulary_id: '_id' of the vocabulary document
+    :param token_dictionary: TokenDictionary, required if any of articles are stored as token IDs
+    """
+    feature_vectors = create_feature_vectors(vocabulary, articles, token_dictionary=token_dictionary)
+    save_feature_vectors(feature_vectors)
+    mark_articles_vectorized(articles)
+
+
+def update_hashed_vectors(num_features=default_num_hashed_features, alternate_sign=False, incremental=False,
+                          batch_size=1000):
+    """
+    Creates hashed feature vectors of all processed articles in a single pass, replacing existing feature vectors
+    and the vocabulary. The hashing settings are saved to the 'naive_bayes' collection.
+    In incremental mode, instead only creates feature vectors for processed articles that haven't been vectorized yet.
+    Falls back to a full run if the existing feature vectors were created with different settings.
+    :param num_features: number of features to hash terms into
+    :param alternate_sign: whether to use the sign of the hash of each term as the sign of its count
+    :param incremental: whether to only vectorize newly processed articles
+    :param batch_size: number of articles to vectorize and insert at once
+    """
+    hashing_document = naive_bayes_collection.find_one({'type': 'hashing'})
+    if incremental and not (hashing_document is not None and hashing_document['num_features'] == num_features and
+                            hashing_document['alternate_sign'] == alternate_sign):
+        print('No hashed feature vectors with the same settings to extend, vectorizing all articles...')
+        incremental = False
+
+    if incremental:
+        articles = get_articles_to_vectorize()
+    else:
+        naive_bayes_collection.delete_many({'type': {'$in': ['vocabulary', 'hashing']}})
+        reset_vectorized_articles()
+        feature_vectors_collection.delete_many({})
+        naive_bayes_collection.insert_one(
+            {'type': 'hashing', 'num_features': num_features, 'alternate_sign': alternate_sign}
+        )
+        articles = processed_collection.find().sort('_id', 1)
+
+    token_dictionary = load_token_dictionary()
+    articles = iter(articles)
+    batches = metrics.timed(iter(lambda: list(islice(articles, batch_size)), []),
+                            'mongo_read_seconds', collection=articles_processed_collection_name)
+    for batch in batches:
+        save_feature_vectors(create_hashed_feature_vectors(batch, num_features, alternate_sign, token_dictionary))
+        mark_articles_vectorized(batch)
+
+
+def save_feature_vectors(feature_vectors):
+    """
+    Inserts feature vectors into the database.
+    Feature vectors of articles that already have one are skipped.
+    :param feature_vectors: list of feature vectors
+    """
+    feature_vectors_collection.create_index('article_processed_id', unique=True)
+    if not feature_vectors:
+        return
     print('Inserting feature vectors into database...')
-    feature_vectors_collection.insert_many(feature_vectors)
+    try:
+        with metrics.timer('mongo_write_seconds', collection='feature_vectors'):
+            feature_vectors_collection.insert_many(feature_vectors, ordered=False)
+    except BulkWriteError as e:
+        # Ignore duplicate key errors, raise all others
+        if any(error['code'] != duplicate_key_error_code for error in e.details['writeErrors']):
+            raise
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description="Creates a vocabulary and feature vectors from the preprocessed articles.\n",
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--incremental', action='store_true',
+        help='Only vectorize processed articles that haven\'t been vectorized yet, extending the existing vocabulary'
+    )
+    parser.add_argument(
+        '--features', choices=['exact', 'hashing'], default='exact',
+        help="'exact' to map each word of a vocabulary to its own feature,\n"
+             "'hashing' to hash words into a fixed number of features without a vocabulary (default: exact)"
+    )
+    parser.add_argument(
+        '--num-features', type=int, default=default_num_hashed_features,
+        help='Number of features to hash words into in hashing mode (default: %d)' % default_num_hashed_features
+    )
+    parser.add_argument(
+        '--alternate-sign', action='store_true',
+        help='Use the sign of the hash of each word as the sign of its count in hashing mode;\n'
+             'the resulting negative counts cannot be used with multinomial Naive Bayes'
+    )
+    metrics.add_instrumentation_arguments(parser)
+    connection.add_connection_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure_instrumentation(args)
+    connection.configure_connection(args)
+
+    with metrics.stage('vectorize'):
+        if args.features == 'hashing':
+            update_hashed_vectors(args.num_features, args.alternate_sign, args.incremental)
+        else:
+            update_vocabulary_and_vectors(args.incremental)
+    metrics.finish_instrumentation(args, 'vectorize')
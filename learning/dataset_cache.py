@@ -0,0 +1,199 @@
+"""
+On-disk cache of prepared datasets.
+Exports the feature matrix, target values, numbers of comments and vocabulary prepared from a database
+to NumPy '.npy' files, in a directory named after a fingerprint of the collections they were prepared from.
+Loading memory-maps these files, so repeated experiments start without querying the database
+and processes using the same dataset share its pages instead of holding their own copy.
+"""
+import hashlib
+import json
+import numpy
+import os
+import shutil
+import tempfile
+
+from collections import namedtuple
+from scipy.sparse import csr_matrix
+
+from learning.prepare_data import load_feature_vectors_and_classes, get_feature_vectors_and_target_values
+from storage import connection
+
+cache_format_version = 2
+metadata_file_name = 'metadata.json'
+array_names = ('data', 'indices', 'indptr', 'target_values', 'num_comments', 'vocabulary')
+
+Dataset = namedtuple('Dataset', ['feature_vectors', 'target_values', 'num_comments', 'vocabulary'])
+
+
+def get_default_cache_dir():
+    """
+    :return: absolute path of the dataset cache directory, resolves to
+        '/absolute/path/to/project/NewsClassification/cache/datasets'
+    """
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    project_dir = os.path.abspath(os.path.join(file_dir, '..'))
+    return os.path.join(project_dir, 'cache', 'datasets')
+
+
+def get_dataset_fingerprint(db):
+    """
+    :param db: database containing the 'feature_vectors' and 'naive_bayes' collections
+    :return: hexadecimal fingerprint that changes whenever feature vectors are added or replaced,
+        or the vocabulary, hashing settings or target classes change
+    """
+    feature_vectors = db['feature_vectors']
+    last_feature_vector = feature_vectors.find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    naive_bayes = db['naive_bayes']
+    vocabulary = naive_bayes.find_one({'type': 'vocabulary'}, {'vocabulary': 0}, sort=[('_id', -1)])
+    num_terms = get_vocabulary_size(db)
+    hashing_settings = load_hashing_settings(db)
+    target_classes = naive_bayes.find_one({'type': 'classes'}, {'_id': 0})
+
+    fingerprint_source = json.dumps([
+        cache_format_version,
+        db.name,
+        feature_vectors.count(),
+        str(last_feature_vector['_id']) if last_feature_vector else None,
+        str(vocabulary['_id']) if vocabulary else None,
+        num_terms,
+        hashing_settings,
+        target_classes
+    ], sort_keys=True, default=str)
+    return hashlib.sha1(fingerprint_source.encode('utf-8')).hexdigest()
+
+
+def get_vocabulary_size(db):
+    """
+    :param db: database containing the 'naive_bayes' collection
+    :return: number of terms in the most recent vocabulary, or None if there is no vocabulary
+    """
+    result = list(db['naive_bayes'].aggregate([
+        {'$match': {'type': 'vocabulary'}},
+        {'$sort': {'_id': -1}},
+        {'$limit': 1},
+        {'$project': {'size': {'$size': '$vocabulary'}}}
+    ]))
+    return result[0]['size'] if result else None
+
+
+def load_hashing_settings(db):
+    """
+    :param db: database containing the 'naive_bayes' collection
+    :return: dict containing the 'num_features' and 'alternate_sign' settings the feature vectors were hashed with,
+        or None if the feature vectors are based on a vocabulary
+    """
+    return db['naive_bayes'].find_one(
+        {'type': 'hashing'}, {'_id': 0, 'num_features': 1, 'alternate_sign': 1}
+    )
+
+
+def has_signed_features(db):
+    """
+    :param db: database containing the 'naive_bayes' collection
+    :return: whether the feature vectors were hashed with 'alternate_sign', so they contain negative counts,
+        which multinomial Naive Bayes can't be trained on
+    """
+    hashing_settings = load_hashing_settings(db)
+    return hashing_settings is not None and bool(hashing_settings.get('alternate_sign'))
+
+
+def get_number_of_features(db):
+    """
+    :param db: database containing the 'naive_bayes' collection
+    :return: number of features of the feature vectors, or None if it is unknown
+    """
+    hashing_settings = load_hashing_settings(db)
+    if hashing_settings is not None:
+        return hashing_settings['num_features']
+    return get_vocabulary_size(db)
+
+
+def load_vocabulary(db):
+    """
+    :param db: database containing the 'naive_bayes' collection
+    :return: list of terms of the most recent vocabulary, or an empty list if there is no vocabulary
+    """
+    vocabulary = db['naive_bayes'].find_one({'type': 'vocabulary'}, sort=[('_id', -1)])
+    return vocabulary['vocabulary'] if vocabulary else []
+
+
+def export_dataset(dataset_dir, feature_vectors, target_values, num_comments, vocabulary):
+    """
+    Writes a dataset to 'dataset_dir'. The files are written to a temporary directory first,
+    so other processes never see a partially written dataset.
+    :param dataset_dir: directory to write the dataset to
+    :param feature_vectors: SciPy CSR matrix containing feature vectors
+    :param target_values: NumPy ndarray containing target values
+    :param num_comments: NumPy ndarray containing the number of comments of each feature vector
+    :param vocabulary: list of terms corresponding to the columns of feature_vectors, empty for hashed feature vectors
+    """
+    parent_dir = os.path.dirname(os.path.abspath(dataset_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(dir=parent_dir)
+    feature_vectors = csr_matrix(feature_vectors)
+    arrays = {
+        'data': feature_vectors.data,
+        'indices': feature_vectors.indices,
+        'indptr': feature_vectors.indptr,
+        'target_values': numpy.asarray(target_values, dtype=str),
+        'num_comments': numpy.asarray(num_comments, dtype=numpy.int64),
+        'vocabulary': numpy.array(vocabulary, dtype=str)
+    }
+    try:
+        for name in array_names:
+            numpy.save(os.path.join(temp_dir, '%s.npy' % name), arrays[name])
+        with open(os.path.join(temp_dir, metadata_file_name), 'w') as metadata_file:
+            json.dump({'version': cache_format_version, 'shape': list(feature_vectors.shape)}, metadata_file)
+        os.rename(temp_dir, dataset_dir)
+    except OSError:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        # Another process may have exported the same dataset in the meantime
+        if not os.path.exists(os.path.join(dataset_dir, metadata_file_name)):
+            raise
+
+
+def load_dataset(dataset_dir):
+    """
+    :param dataset_dir: directory containing a dataset written by 'export_dataset'
+    :return: Dataset containing a SciPy CSR matrix of feature vectors backed by memory-mapped files, and
+        memory-mapped NumPy ndarrays of target values, numbers of comments and the vocabulary,
+        or None if 'dataset_dir' doesn't contain a dataset of the current format
+    """
+    try:
+        with open(os.path.join(dataset_dir, metadata_file_name)) as metadata_file:
+            metadata = json.load(metadata_file)
+    except (OSError, ValueError):
+        return None
+    if metadata.get('version') != cache_format_version:
+        return None
+
+    arrays = {name: numpy.load(os.path.join(dataset_dir, '%s.npy' % name), mmap_mode='r') for name in array_names}
+    feature_vectors = csr_matrix(
+        (arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(metadata['shape']), copy=False
+    )
+    return Dataset(feature_vectors, arrays['target_values'], arrays['num_comments'], arrays['vocabulary'])
+
+
+def load_cached_dataset(db_name, cache_dir=None):
+    """
+    Loads the dataset prepared from database 'db_name' from the cache, exporting it first if it isn't cached yet.
+    :param db_name: name of database to use
+    :param cache_dir: directory containing cached datasets, defaults to 'get_default_cache_dir()'
+    :return: Dataset containing feature vectors, target values, numbers of comments and the vocabulary
+    """
+    db = connection.get_database(db_name)
+    dataset_dir = os.path.join(cache_dir or get_default_cache_dir(), get_dataset_fingerprint(db))
+    dataset = load_dataset(dataset_dir)
+    if dataset is not None:
+        print('Loaded cached dataset from %s.' % dataset_dir)
+        return dataset
+
+    feature_vector_dicts, target_classes = load_feature_vectors_and_classes(db_name)
+    vocabulary = load_vocabulary(db)
+    feature_vectors, target_values = get_feature_vectors_and_target_values(
+        feature_vector_dicts, target_classes, num_features=get_number_of_features(db)
+    )
+    num_comments = [feature_vector_dict['num_comments'] for feature_vector_dict in feature_vector_dicts]
+    print('Exporting dataset to %s...' % dataset_dir)
+    export_dataset(dataset_dir, feature_vectors, target_values, num_comments, vocabulary)
+    return load_dataset(dataset_dir)
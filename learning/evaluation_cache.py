@@ -0,0 +1,194 @@
+"""
+On-disk cache of cross-validation results.
+Each result is stored under a key combining a hash of the contents of the feature vectors and target values,
+the type and parameters of the classifier, the number of folds and repetitions and the seed the folds were shuffled
+with. Repeating an evaluation on unchanged data with an unchanged classifier therefore loads its scores and times
+from the cache instead of fitting all folds again. The fitted classifier of each fold can be stored as well,
+so they can be inspected later without fitting them again.
+When the cache grows beyond its maximum size, the least recently used results are evicted.
+"""
+import hashlib
+import json
+import joblib
+import numpy
+import os
+import shutil
+import sklearn
+import tempfile
+
+from datetime import datetime
+from scipy.sparse import csr_matrix, issparse
+
+evaluation_cache_version = 1
+default_max_size = 1024 ** 3
+metadata_file_name = 'metadata.json'
+result_file_name = 'result.npz'
+models_file_name = 'models.joblib'
+
+
+def get_default_evaluation_cache_dir():
+    """
+    :return: absolute path of the evaluation cache directory, resolves to
+        '/absolute/path/to/project/NewsClassification/cache/evaluations'
+    """
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    project_dir = os.path.abspath(os.path.join(file_dir, '..'))
+    return os.path.join(project_dir, 'cache', 'evaluations')
+
+
+def get_data_fingerprint(feature_vectors, target_values):
+    """
+    :param feature_vectors: NumPy ndarray or SciPy sparse matrix containing feature vectors as rows
+    :param target_values: NumPy ndarray containing target values
+    :return: hexadecimal hash of the contents of feature_vectors and target_values
+    """
+    digest = hashlib.sha256()
+    if issparse(feature_vectors):
+        feature_vectors = csr_matrix(feature_vectors)
+        arrays = [feature_vectors.data, feature_vectors.indices, feature_vectors.indptr]
+    else:
+        arrays = [feature_vectors]
+    digest.update(json.dumps(['sparse' if issparse(feature_vectors) else 'dense', list(feature_vectors.shape),
+                              [str(array.dtype) for array in arrays]]).encode('utf-8'))
+    for array in arrays:
+        digest.update(memoryview(numpy.ascontiguousarray(array)).cast('B'))
+    # Hash the labels as indices into their sorted set, so the width of the string type doesn't matter
+    labels, label_indices = numpy.unique(numpy.asarray(target_values), return_inverse=True)
+    digest.update(json.dumps([str(label) for label in labels]).encode('utf-8'))
+    digest.update(numpy.ascontiguousarray(label_indices, dtype=numpy.int64).tobytes())
+    return digest.hexdigest()
+
+
+def get_evaluation_key(classifier, feature_vectors, target_values, n_folds, iterations, random_state):
+    """
+    :param classifier: classifier to evaluate
+    :param feature_vectors: feature vectors to evaluate classifier on
+    :param target_values: target values of feature_vectors
+    :param n_folds: number of folds of each cross-validation
+    :param iterations: number of repetitions of the cross-validation
+    :param random_state: seed the folds are shuffled with
+    :return: hexadecimal key identifying the evaluation
+    """
+    description = json.dumps([
+        evaluation_cache_version,
+        sklearn.__version__,
+        '%s.%s' % (type(classifier).__module__, type(classifier).__name__),
+        sorted((name, repr(value)) for name, value in classifier.get_params().items()),
+        n_folds,
+        iterations,
+        random_state,
+        get_data_fingerprint(feature_vectors, target_values)
+    ])
+    return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+
+class EvaluationCache(object):
+    def __init__(self, directory=None, max_size=default_max_size, store_models=True):
+        """
+        :param directory: directory to store results in, defaults to 'get_default_evaluation_cache_dir()'
+        :param max_size: maximum total size in bytes of the stored results and models
+        :param store_models: whether to store the fitted classifier of each fold along with the results
+        """
+        self.directory = directory or get_default_evaluation_cache_dir()
+        self.max_size = max_size
+        self.store_models = store_models
+
+    def get(self, key):
+        """
+        :param key: key of the evaluation, as returned by 'get_evaluation_key'
+        :return: NumPy ndarrays of shape (iterations, n_folds) containing the score, fit time and score time
+            of each fold, or None if the evaluation isn't in the cache
+        """
+        entry_dir = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry_dir, metadata_file_name)) as metadata_file:
+                metadata = json.load(metadata_file)
+            if metadata.get('version') != evaluation_cache_version:
+                return None
+            with numpy.load(os.path.join(entry_dir, result_file_name)) as result:
+                scores, fit_times, score_times = result['scores'], result['fit_times'], result['score_times']
+            # Mark the result as recently used, so it is evicted last
+            os.utime(entry_dir)
+        except (OSError, ValueError, KeyError):
+            return None
+        return scores, fit_times, score_times
+
+    def load_models(self, key):
+        """
+        :param key: key of the evaluation, as returned by 'get_evaluation_key'
+        :return: list of the fitted classifiers of all folds of all repetitions, in order,
+            or None if they weren't stored
+        """
+        try:
+            return joblib.load(os.path.join(self.directory, key, models_file_name))
+        except (OSError, EOFError):
+            return None
+
+    def put(self, key, scores, fit_times, score_times, models=None, description=None):
+        """
+        Stores the result of an evaluation, then evicts results if the cache has grown beyond its maximum size.
+        The files are written to a temporary directory first, so other processes never see a partially written result.
+        :param key: key of the evaluation, as returned by 'get_evaluation_key'
+        :param scores: NumPy ndarray containing the score of each fold
+        :param fit_times: NumPy ndarray containing the fit time of each fold
+        :param score_times: NumPy ndarray containing the score time of each fold
+        :param models: optional list of the fitted classifiers of all folds, stored if 'store_models' is set
+        :param description: optional JSON-serializable description of the evaluation, stored in its metadata
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        entry_dir = os.path.join(self.directory, key)
+        temp_dir = tempfile.mkdtemp(dir=self.directory, prefix='.')
+        try:
+            numpy.savez(os.path.join(temp_dir, result_file_name), scores=scores, fit_times=fit_times,
+                        score_times=score_times)
+            if models is not None and self.store_models:
+                joblib.dump(models, os.path.join(temp_dir, models_file_name))
+            with open(os.path.join(temp_dir, metadata_file_name), 'w') as metadata_file:
+                json.dump({'version': evaluation_cache_version, 'created': datetime.now().isoformat(),
+                           'description': description}, metadata_file)
+            if os.path.exists(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(temp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            # Another process may have stored the same evaluation in the meantime
+            if not os.path.exists(os.path.join(entry_dir, metadata_file_name)):
+                raise
+        if self.get_size() > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used results until the cache is at most its maximum size.
+        """
+        entries = sorted((os.path.getmtime(entry_dir), get_directory_size(entry_dir), entry_dir)
+                         for entry_dir in self._get_entry_dirs())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, entry_dir in entries:
+            if size <= self.max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            size -= entry_size
+
+    def get_size(self):
+        """
+        :return: total size in bytes of the stored results and models
+        """
+        return sum(get_directory_size(entry_dir) for entry_dir in self._get_entry_dirs())
+
+    def _get_entry_dirs(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if not name.startswith('.') and os.path.isdir(os.path.join(self.directory, name))]
+
+
+def get_directory_size(directory):
+    """
+    :param directory: directory containing only files
+    :return: total size in bytes of the files in directory
+    """
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+    except OSError:
+        return 0
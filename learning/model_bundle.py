@@ -0,0 +1,118 @@
+"""
+Saves a trained classifier together with everything needed to apply it to new articles:
+the vocabulary or hashing settings its feature vectors are based on, the target classes it predicts
+and the stopwords used during preprocessing.
+A loaded bundle classifies raw articles in memory, applying the same preprocessing and vectorization
+as the training pipeline without accessing the database.
+"""
+import joblib
+import numpy
+
+from collections import namedtuple
+from datetime import datetime
+from scipy.sparse import csr_matrix
+
+from learning.create_vocabulary_and_vectors import create_hashed_feature_vector, create_sparse_feature_vector, \
+    create_term_index
+from preprocessing.process_articles import preprocess_text
+
+bundle_format_versions = (1, 2)
+
+ModelBundle = namedtuple('ModelBundle', ['classifier', 'vocabulary', 'target_classes', 'stop_words', 'hashing',
+                                         'term_index'])
+
+
+def create_model_bundle(classifier, vocabulary, target_classes, stop_words, hashing=None):
+    """
+    :param classifier: fitted classifier
+    :param vocabulary: list of terms corresponding to the features classifier was fitted on
+    :param target_classes: dictionary containing a 'target class label -> comment interval' mapping
+    :param stop_words: set of stopwords used to preprocess the articles classifier was fitted on
+    :param hashing: dict containing the 'num_features' and 'alternate_sign' settings the feature vectors
+        classifier was fitted on were hashed with, or None if they are based on vocabulary
+    :return: ModelBundle
+    """
+    vocabulary = [str(term) for term in vocabulary]
+    return ModelBundle(classifier, vocabulary, dict(target_classes), frozenset(stop_words),
+                       dict(hashing) if hashing else None, create_term_index(vocabulary))
+
+
+def save_model_bundle(bundle, path):
+    """
+    :param bundle: ModelBundle to save
+    :param path: path of the file to save the bundle to
+    """
+    joblib.dump({
+        'version': bundle_format_versions[-1],
+        'created': datetime.now(),
+        'classifier': bundle.classifier,
+        'vocabulary': bundle.vocabulary,
+        'target_classes': bundle.target_classes,
+        'stop_words': sorted(bundle.stop_words),
+        'hashing': bundle.hashing
+    }, path)
+    print('Saved %s classifier with %d features to %s.' %
+          (type(bundle.classifier).__name__, get_number_of_features(bundle), path))
+
+
+def load_model_bundle(path):
+    """
+    :param path: path of a file written by 'save_model_bundle'
+    :return: ModelBundle
+    """
+    contents = joblib.load(path)
+    if contents.get('version') not in bundle_format_versions:
+        raise ValueError('%s does not contain a supported model bundle.' % path)
+    return create_model_bundle(contents['classifier'], contents['vocabulary'], contents['target_classes'],
+                               contents['stop_words'], contents.get('hashing'))
+
+
+def get_number_of_features(bundle):
+    """
+    :param bundle: ModelBundle
+    :return: number of features of the feature vectors the classifier of bundle expects
+    """
+    if bundle.hashing:
+        return bundle.hashing['num_features']
+    return len(bundle.vocabulary)
+
+
+def vectorize_articles(bundle, articles):
+    """
+    :param bundle: ModelBundle to vectorize articles for
+    :param articles: list of dicts containing the raw 'title' and 'text' of articles
+    :return: SciPy CSR matrix containing a feature vector for each article
+    """
+    indptr = [0]
+    indices = []
+    counts = []
+    for article in articles:
+        processed_article = {
+            'title': preprocess_text(article.get('title', ''), bundle.stop_words),
+            'text': preprocess_text(article.get('text', ''), bundle.stop_words)
+        }
+        if bundle.hashing:
+            feature_indices, feature_counts = create_hashed_feature_vector(
+                processed_article, bundle.hashing['num_features'], bundle.hashing['alternate_sign']
+            )
+        else:
+            feature_indices, feature_counts = create_sparse_feature_vector(bundle.term_index, processed_article)
+        indices.extend(feature_indices)
+        counts.extend(feature_counts)
+        indptr.append(len(indices))
+    return csr_matrix(
+        (numpy.array(counts, dtype=numpy.float64), numpy.array(indices, dtype=numpy.int32),
+         numpy.array(indptr, dtype=numpy.int32)),
+        shape=(len(articles), get_number_of_features(bundle))
+    )
+
+
+def predict_articles(bundle, articles):
+    """
+    :param bundle: ModelBundle to classify articles with
+    :param articles: list of dicts containing the raw 'title' and 'text' of articles
+    :return: list containing the predicted class of each article
+    """
+    if not articles:
+        return []
+    return bundle.classifier.predict(vectorize_articles(bundle, articles)).tolist()
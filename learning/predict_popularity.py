@@ -0,0 +1,203 @@
+"""
+Predicts the popularity class of new articles using a model bundle written by 'train_evaluate_classifiers.py export'.
+The bundle is loaded once, after which articles are classified either in batches read from a JSON lines file,
+or by a local HTTP server that collects concurrent requests into micro-batches.
+
+Articles are JSON objects containing a 'title' and a 'text'; every other field is passed through unchanged.
+The server accepts a POST request to '/predict' with either a single article or a list of articles as body,
+and responds with the same article(s) extended with a 'predicted_class' field.
+Invalid articles are rejected with status 400 before they are queued, so they can't fail the other requests
+of a micro-batch.
+"""
+import json
+import queue
+import sys
+import threading
+import time
+
+from argparse import ArgumentParser
+from argparse import RawTextHelpFormatter
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+
+from learning.model_bundle import load_model_bundle, predict_articles
+
+
+class MicroBatcher(object):
+    def __init__(self, bundle, max_batch_size=64, max_wait=0.005):
+        """
+        Classifies articles submitted from multiple threads in batches, on a single worker thread.
+        :param bundle: ModelBundle to classify articles with
+        :param max_batch_size: maximum number of articles to classify at once
+        :param max_wait: maximum number of seconds to wait for more articles after the first one of a batch arrived
+        """
+        self.bundle = bundle
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, article):
+        """
+        :param article: dict containing the raw 'title' and 'text' of an article
+        :return: Future that resolves to the predicted class of article
+        """
+        future = Future()
+        self._queue.put((article, future))
+        return future
+
+    def predict(self, articles):
+        """
+        :param articles: list of dicts containing the raw 'title' and 'text' of articles
+        :return: list containing the predicted class of each article
+        """
+        futures = [self.submit(article) for article in articles]
+        return [future.result() for future in futures]
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                predictions = predict_articles(self.bundle, [article for article, _ in batch])
+            except Exception:
+                # Classify the articles one by one, so an article that can't be classified only fails its own request
+                for article, future in batch:
+                    self._predict_single(article, future)
+                continue
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(prediction)
+
+    def _predict_single(self, article, future):
+        try:
+            future.set_result(predict_articles(self.bundle, [article])[0])
+        except Exception as e:
+            future.set_exception(e)
+
+
+def get_article_error(article):
+    """
+    :param article: article of a request body
+    :return: description of why article can't be classified, or None if it can
+    """
+    if not isinstance(article, dict):
+        return 'Articles must be JSON objects.'
+    for field in ('title', 'text'):
+        if not isinstance(article.get(field), str):
+            return "Articles must contain a '%s' string." % field
+    return None
+
+
+def create_request_handler(batcher):
+    """
+    :param batcher: MicroBatcher to classify articles with
+    :return: request handler class for an HTTP server that serves predictions at '/predict'
+    """
+
+    class PredictionRequestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != '/predict':
+                self.send_json(404, {'error': 'Not found.'})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            except ValueError:
+                self.send_json(400, {'error': 'Request body must be JSON.'})
+                return
+            articles = body if isinstance(body, list) else [body]
+            for index, article in enumerate(articles):
+                error = get_article_error(article)
+                if error is not None:
+                    self.send_json(400, {'error': error, 'index': index})
+                    return
+            try:
+                predicted_classes = batcher.predict(articles)
+            except Exception as e:
+                self.send_json(500, {'error': 'Could not classify articles: %s' % e})
+                return
+            for article, predicted_class in zip(articles, predicted_classes):
+                article['predicted_class'] = predicted_class
+            self.send_json(200, articles if isinstance(body, list) else articles[0])
+
+        def send_json(self, status, content):
+            response = json.dumps(content).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictionRequestHandler
+
+
+def predict_in_batches(bundle, input_file, output_file, batch_size=1000):
+    """
+    Classifies the articles in JSON lines file input_file and writes them with their predicted class to output_file.
+    :param bundle: ModelBundle to classify articles with
+    :param input_file: file containing one JSON article per line
+    :param output_file: file to write one JSON article per line to
+    :param batch_size: number of articles to classify at once
+    :return: number of classified articles
+    """
+    lines = (line for line in input_file if line.strip())
+    num_predicted = 0
+    for batch in iter(lambda: list(islice(lines, batch_size)), []):
+        articles = [json.loads(line) for line in batch]
+        for article, predicted_class in zip(articles, predict_articles(bundle, articles)):
+            article['predicted_class'] = predicted_class
+            output_file.write(json.dumps(article) + '\n')
+        num_predicted += len(articles)
+    return num_predicted
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description="Predicts the popularity class of articles using a saved model bundle.\n",
+        formatter_class=RawTextHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    batch_parser = subparsers.add_parser('batch', help='Classify articles from a JSON lines file')
+    batch_parser.add_argument('model', help='Path of the model bundle')
+    batch_parser.add_argument('input', nargs='?', help='JSON lines file of articles (default: standard input)')
+    batch_parser.add_argument(
+        '--batch-size', type=int, default=1000,
+        help='Number of articles to classify at once (default: 1000)'
+    )
+    serve_parser = subparsers.add_parser('serve', help='Serve predictions over HTTP')
+    serve_parser.add_argument('model', help='Path of the model bundle')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    serve_parser.add_argument('--port', type=int, default=8080, help='Port to listen on (default: 8080)')
+    serve_parser.add_argument(
+        '--max-batch-size', type=int, default=64,
+        help='Maximum number of articles to classify at once (default: 64)'
+    )
+    serve_parser.add_argument(
+        '--max-wait-ms', type=float, default=5,
+        help='Maximum number of milliseconds to wait for more articles to fill a batch (default: 5)'
+    )
+    args = parser.parse_args()
+
+    model_bundle = load_model_bundle(args.model)
+    if args.command == 'batch':
+        with (open(args.input) if args.input else sys.stdin) as articles_file:
+            count = predict_in_batches(model_bundle, articles_file, sys.stdout, args.batch_size)
+        print('Classified %d articles.' % count, file=sys.stderr)
+    else:
+        micro_batcher = MicroBatcher(model_bundle, args.max_batch_size, args.max_wait_ms / 1000.0)
+        server = ThreadingHTTPServer((args.host, args.port), create_request_handler(micro_batcher))
+        print('Serving predictions on http://%s:%d/predict...' % (args.host, args.port))
+        server.serve_forever()
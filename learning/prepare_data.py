@@ -3,22 +3,31 @@ Prepares the dataset containing feature vectors and class labels for use by clas
 1)
 Two inputs are loaded using 'load_feature_vectors_and_classes':
 - List of dictionaries of the form:
-    [{feature_vector: [0, 3, 1, ...], num_comments: [10]},
-     {feature_vector: [1, 0, 0, ...], num_comments: [20]]
+    [{feature_indices: [1, 2, ...], feature_counts: [3, 1, ...], num_comments: [10]},
+     {feature_indices: [0, ...], feature_counts: [1, ...], num_comments: [20]]
 - Dict of target classes of the form:
     {'very_low': {'start': 0, 'end': 10), 'low': {'start': 11, 'end': 20), 'medium': {'start': 21, 'end': 30),
     'high': {'start': 31, 'end': 40), 'very_high': {'start': 41, 'end': 50),}
 2)
-Based on these, it creates a list of feature vectors and target values using 'get_feature_vectors_and_target_values'.
+Based on these, it creates a sparse matrix of feature vectors and an array of target values
+using 'get_feature_vectors_and_target_values'.
 With the examples given above, this would look like:
-- [[0, 3, 1, ...], [1, 0, 0, ...]]
+- csr_matrix([[0, 3, 1, ...], [1, 0, 0, ...]])
 - ['very_low', 'low']
+The comment intervals of the target classes must be consecutive, so every number of comments
+belongs to exactly one class.
+Dense feature vectors of the form {feature_vector: [0, 3, 1, ...], num_comments: [10]}, as stored by earlier versions,
+are converted to the same sparse matrix.
 """
 import numpy
 
-from pymongo import MongoClient
-from pymongo.collection import Collection
-from pymongo.database import Database
+from collections import namedtuple
+from scipy.sparse import csr_matrix
+
+from instrumentation import metrics
+from storage import connection
+
+ClassBins = namedtuple('ClassBins', ['starts', 'ends', 'labels'])
 
 
 def load_feature_vectors_and_classes(db_name):
@@ -30,26 +39,37 @@ def load_feature_vectors_and_classes(db_name):
         {start: <integer>, end: <integer>}
     """
     print('Loading feature vectors and target classes...')
-    db = Database(MongoClient(), db_name)
+    db = connection.get_database(db_name)
     collection_names = db.collection_names()
     if not ('naive_bayes' in collection_names and 'feature_vectors' in collection_names):
         print('Database missing collections needed to train classifier on.')
         exit()
 
-    target_classes = Collection(db, 'naive_bayes').find_one({'type': 'classes'})
-    if 'classes' not in target_classes:
-        raise KeyError("'target_classes' must contain a 'classes' key.")
+    target_classes = load_target_classes(db)
+    with metrics.timer('mongo_read_seconds', collection='feature_vectors'):
+        feature_vectors = list(db['feature_vectors'].find())
+    return feature_vectors, target_classes
+
 
-    feature_vectors = list(Collection(db, 'feature_vectors').find())
-    return feature_vectors, target_classes['classes']
+def load_target_classes(db):
+    """
+    :param db: database containing the 'naive_bayes' collection
+    :return: dictionary where the keys are the class labels and the values are dictionaries of the form
+        {start: <integer>, end: <integer>}
+    """
+    target_classes = db['naive_bayes'].find_one({'type': 'classes'})
+    if target_classes is None or 'classes' not in target_classes:
+        raise KeyError("'target_classes' must contain a 'classes' key.")
+    return target_classes['classes']
 
 
-def get_feature_vectors_and_target_values(feature_vector_dicts, target_classes):
+def get_feature_vectors_and_target_values(feature_vector_dicts, target_classes, num_features=None):
     """
     :param feature_vector_dicts: list of dicts containing feature vectors and number of comments
     :param target_classes: dictionary containing a 'target class label -> comment interval' mapping
+    :param num_features: number of columns of the feature matrix, defaults to the highest feature index plus one
     :return:
-        - NumPy ndarray containing feature vectors
+        - SciPy CSR matrix containing feature vectors as rows
         - NumPy ndarray containing target values, with the i-th element corresponding to
           the target value of the i-th feature vector
     """
@@ -58,24 +78,115 @@ def get_feature_vectors_and_target_values(feature_vector_dicts, target_classes):
     if not isinstance(target_classes, dict):
         raise TypeError("'target_classes' must be a dict.")
 
-    print('Preparing %d feature vectors of size %d each...'
-          % (len(feature_vector_dicts), len(feature_vector_dicts[0]['feature_vector'])))
-    feature_vectors = []
-    target_values = []
+    class_bins = compile_class_bins(target_classes)
+    print('Preparing %d feature vectors...' % len(feature_vector_dicts))
+    feature_vectors = create_feature_matrix(feature_vector_dicts, num_features)
+    print('Prepared %d feature vectors of size %d each.' % feature_vectors.shape)
+    # Determine the class label corresponding to each feature vector
+    num_comments = numpy.array([feature_vector_document['num_comments']
+                                for feature_vector_document in feature_vector_dicts])
+    target_values_arr = get_classes_for_number_of_comments(num_comments, class_bins)
+    return feature_vectors, target_values_arr
 
-    def get_class_for_number_of_comments(num_comments):
-        """
-        :param num_comments: number of comments to determine class for
-        :return: class within which the specified number of comments belongs to ('very low', 'high', etc.)
-        """
-        for class_name, comments_range in target_classes.items():
-            if comments_range['start'] <= num_comments <= comments_range['end']:
-                return class_name
+
+def create_feature_matrix(feature_vector_dicts, num_features=None):
+    """
+    :param feature_vector_dicts: list of dicts containing feature vectors
+    :param num_features: number of columns of the feature matrix, defaults to the highest feature index plus one
+    :return: SciPy CSR matrix containing feature vectors as rows
+    """
+    indptr = [0]
+    indices = []
+    counts = []
+    min_num_features = 0
 
     for feature_vector_document in feature_vector_dicts:
-        feature_vectors.append(feature_vector_document['feature_vector'])
-        # Add the class label corresponding to 'feature_vector' to 'target_values'
-        target_values.append(get_class_for_number_of_comments(feature_vector_document['num_comments']))
+        feature_indices, feature_counts = get_feature_indices_and_counts(feature_vector_document)
+        indices.extend(feature_indices)
+        counts.extend(feature_counts)
+        indptr.append(len(indices))
+        if 'feature_vector' in feature_vector_document:
+            min_num_features = max(min_num_features, len(feature_vector_document['feature_vector']))
+
+    if num_features is None:
+        num_features = max(min_num_features, max(indices) + 1 if indices else 0)
+    return csr_matrix(
+        (numpy.array(counts, dtype=numpy.float64), numpy.array(indices, dtype=numpy.int32),
+         numpy.array(indptr, dtype=numpy.int32)),
+        shape=(len(feature_vector_dicts), num_features)
+    )
 
-    target_values_arr = numpy.array(target_values)
-    return numpy.array(feature_vectors), target_values_arr
+
+def compile_class_bins(target_classes):
+    """
+    :param target_classes: dictionary containing a 'target class label -> comment interval' mapping,
+        where each interval is a dict of the form {start: <integer>, end: <integer>} including both ends
+    :return: ClassBins containing the starts, ends and labels of the target classes, sorted by start
+    :raises ValueError: if an interval is empty, or if intervals overlap or leave a gap between them
+    """
+    if not target_classes:
+        raise ValueError("'target_classes' must contain at least one class.")
+    sorted_classes = sorted(target_classes.items(), key=lambda item: item[1]['start'])
+    starts = numpy.array([comments_range['start'] for _, comments_range in sorted_classes])
+    ends = numpy.array([comments_range['end'] for _, comments_range in sorted_classes])
+    labels = numpy.array([class_name for class_name, _ in sorted_classes])
+
+    empty = numpy.flatnonzero(starts > ends)
+    if empty.size > 0:
+        raise ValueError("Class '%s' has an empty comment interval." % labels[empty[0]])
+    overlaps = numpy.flatnonzero(starts[1:] <= ends[:-1])
+    if overlaps.size > 0:
+        raise ValueError("Classes '%s' and '%s' overlap." % (labels[overlaps[0]], labels[overlaps[0] + 1]))
+    gaps = numpy.flatnonzero(starts[1:] > ends[:-1] + 1)
+    if gaps.size > 0:
+        raise ValueError("Classes '%s' and '%s' leave a gap between them." % (labels[gaps[0]], labels[gaps[0] + 1]))
+    return ClassBins(starts, ends, labels)
+
+
+def get_classes_for_number_of_comments(num_comments, class_bins):
+    """
+    :param num_comments: NumPy ndarray of numbers of comments to determine classes for
+    :param class_bins: ClassBins as returned by 'compile_class_bins'
+    :return: NumPy ndarray containing the class each number of comments belongs to ('very low', 'high', etc.)
+    :raises ValueError: if a number of comments doesn't belong to any class
+    """
+    bin_indices = numpy.searchsorted(class_bins.starts, num_comments, side='right') - 1
+    outside = (bin_indices < 0) | (num_comments > class_bins.ends[numpy.maximum(bin_indices, 0)])
+    if outside.any():
+        raise ValueError('Number of comments %s does not belong to any class.' % num_comments[outside][0])
+    return class_bins.labels[bin_indices]
+
+
+def get_quantile_classes(num_comments, class_names):
+    """
+    Divides the observed numbers of comments into consecutive intervals containing roughly equal numbers of
+    articles, one for each class.
+    :param num_comments: NumPy ndarray of observed numbers of comments
+    :param class_names: class labels, from the lowest to the highest number of comments
+    :return: dictionary containing a 'target class label -> comment interval' mapping covering all integers
+        from zero to the highest observed number of comments
+    """
+    quantiles = numpy.quantile(num_comments, numpy.arange(1, len(class_names)) / float(len(class_names)))
+    target_classes = {}
+    start = 0
+    for class_name, quantile in zip(class_names, quantiles):
+        end = max(int(quantile), start)
+        target_classes[class_name] = {'start': start, 'end': end}
+        start = end + 1
+    target_classes[class_names[-1]] = {'start': start, 'end': max(int(numpy.max(num_comments)), start)}
+    return target_classes
+
+
+def get_feature_indices_and_counts(feature_vector_document):
+    """
+    :param feature_vector_document: dict containing either a sparse feature vector ('feature_indices' and
+        'feature_counts') or a dense feature vector ('feature_vector')
+    :return:
+        - indices of the non-zero elements of the feature vector
+        - values of the non-zero elements of the feature vector
+    """
+    if 'feature_vector' in feature_vector_document:
+        feature_vector = numpy.asarray(feature_vector_document['feature_vector'])
+        feature_indices = numpy.flatnonzero(feature_vector)
+        return feature_indices.tolist(), feature_vector[feature_indices].tolist()
+    return feature_vector_document['feature_indices'], feature_vector_document['feature_counts']
@@ -0,0 +1,139 @@
+"""
+Searches for the parameters of a classifier that result in the best cross-validation score, using successive halving.
+All candidate parameter combinations are first evaluated on a small stratified sample of the dataset.
+Only the best 1 / 'factor' of them are evaluated again, on a sample that is 'factor' times larger,
+until a single round on the full dataset remains.
+The feature matrix is prepared once and the samples of each round are shared by all candidates of that round.
+"""
+import numpy
+
+from collections import namedtuple
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid, StratifiedShuffleSplit
+
+from learning.train_evaluate_classifiers import repeated_cross_validation
+
+SearchRound = namedtuple('SearchRound', ['num_samples', 'candidate_scores'])
+
+
+def parse_parameter_grid(parameter_specs):
+    """
+    :param parameter_specs: list of strings of the form 'name=value1,value2,...'
+    :return: dict mapping each parameter name to the list of its values, parsed as integers, floats, booleans or None
+        where possible
+    """
+    parameter_grid = {}
+    for parameter_spec in parameter_specs:
+        name, separator, values = parameter_spec.partition('=')
+        if not separator or not name or not values:
+            raise ValueError("Parameter '%s' must be of the form 'name=value1,value2,...'." % parameter_spec)
+        parameter_grid[name.strip()] = [parse_parameter_value(value.strip()) for value in values.split(',')]
+    return parameter_grid
+
+
+def parse_parameters(parameter_specs):
+    """
+    :param parameter_specs: list of strings of the form 'name=value'
+    :return: dict mapping each parameter name to its value, parsed like the values of 'parse_parameter_grid'
+    :raises ValueError: if a parameter is malformed or has more than one value
+    """
+    parameter_grid = parse_parameter_grid(parameter_specs)
+    multiple_values = sorted(name for name, values in parameter_grid.items() if len(values) > 1)
+    if multiple_values:
+        raise ValueError('Parameters must have a single value, but %s has multiple; search compares multiple values.' %
+                         ', '.join(multiple_values))
+    return {name: values[0] for name, values in parameter_grid.items()}
+
+
+def parse_parameter_value(value):
+    """
+    :param value: string representation of a parameter value
+    :return: value as an integer, float, boolean or None if it represents one, or the string itself otherwise
+    """
+    constants = {'true': True, 'false': False, 'none': None}
+    if value.lower() in constants:
+        return constants[value.lower()]
+    for value_type in (int, float):
+        try:
+            return value_type(value)
+        except ValueError:
+            pass
+    return value
+
+
+def search_hyperparameters(classifier, feature_vectors, target_values, parameter_grid, factor=3, min_samples=None,
+                           n_folds=5, n_jobs=1, random_state=None):
+    """
+    :param classifier: classifier to search parameters for
+    :param feature_vectors: feature vectors to use for evaluation
+    :param target_values: labels representing values for each feature vector
+    :param parameter_grid: dict mapping parameter names of classifier to lists of values to try
+    :param factor: factor by which the number of candidates is reduced and the sample size is increased each round
+    :param min_samples: number of samples in the first round, defaults to the size that leaves a single round on
+        the full dataset, but at least two samples per class per fold
+    :param n_folds: number of folds to use for cross-validation
+    :param n_jobs: number of worker processes to distribute the fits over, -1 to use all CPUs
+    :param random_state: seed for sampling and shuffling the folds, making the search reproducible
+    :return:
+        - dict containing the best parameters
+        - cross-validation score of the best parameters on the full dataset
+        - list of SearchRound, containing the number of samples used in each round and the list of
+          (parameters, score) tuples of the candidates evaluated in that round, from best to worst
+    """
+    if factor < 2:
+        raise ValueError("'factor' must be at least 2.")
+    candidates = list(ParameterGrid(parameter_grid))
+    num_samples_total = feature_vectors.shape[0]
+    num_rounds, num_candidates = 1, len(candidates)
+    while num_candidates > 1:
+        num_candidates = max(1, num_candidates // factor)
+        num_rounds += 1
+    if min_samples is None:
+        min_samples = max(num_samples_total // factor ** (num_rounds - 1),
+                          2 * n_folds * len(numpy.unique(target_values)))
+    print('Searching %d parameter combinations for %s in %d rounds...' %
+          (len(candidates), type(classifier).__name__, num_rounds))
+
+    rounds = []
+    num_samples = min(min_samples, num_samples_total)
+    for round_index in range(num_rounds):
+        if round_index == num_rounds - 1 or len(candidates) == 1:
+            num_samples = num_samples_total
+        sample_vectors, sample_values = get_stratified_sample(feature_vectors, target_values, num_samples,
+                                                              random_state)
+        candidate_scores = []
+        for parameters in candidates:
+            candidate = clone(classifier).set_params(**parameters)
+            result = repeated_cross_validation(candidate, sample_vectors, sample_values, n_folds=n_folds,
+                                               iterations=1, n_jobs=n_jobs, random_state=random_state)
+            candidate_scores.append((parameters, result.mean_score))
+        candidate_scores.sort(key=lambda candidate_score: candidate_score[1], reverse=True)
+        rounds.append(SearchRound(num_samples, candidate_scores))
+        print('Round %d: evaluated %d candidates on %d samples, best score %f with %s.' %
+              (round_index + 1, len(candidates), num_samples, candidate_scores[0][1], candidate_scores[0][0]))
+
+        if num_samples == num_samples_total:
+            break
+        # Keep the best 1 / 'factor' of the candidates and evaluate them on 'factor' times as many samples
+        candidates = [parameters for parameters, _ in candidate_scores[:max(1, len(candidates) // factor)]]
+        num_samples = min(num_samples * factor, num_samples_total)
+
+    best_parameters, best_score = rounds[-1].candidate_scores[0]
+    return best_parameters, best_score, rounds
+
+
+def get_stratified_sample(feature_vectors, target_values, num_samples, random_state=None):
+    """
+    :param feature_vectors: feature vectors to sample from
+    :param target_values: labels representing values for each feature vector
+    :param num_samples: number of samples to draw
+    :param random_state: seed for sampling
+    :return: 'num_samples' feature vectors and their target values, with the same class distribution as
+        target_values, or all feature vectors and target values if too few would be left out to stratify the sample
+    """
+    if num_samples > feature_vectors.shape[0] - len(numpy.unique(target_values)):
+        return feature_vectors, target_values
+    splitter = StratifiedShuffleSplit(n_splits=1, train_size=num_samples, random_state=random_state)
+    sample_indices, _ = next(splitter.split(numpy.zeros(len(target_values)), target_values))
+    sample_indices.sort()
+    return feature_vectors[sample_indices], target_values[sample_indices]
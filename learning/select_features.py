@@ -0,0 +1,178 @@
+"""
+Reduces the vocabulary before the feature vectors are created, by selecting the terms that are most useful
+for classification.
+Terms can be pruned by document frequency, removing terms that occur in too few articles (such as typos)
+or in too many articles to tell them apart. Of the remaining terms, the 'k' best can be kept, ranked by their
+frequency in the corpus, their chi-squared statistic or their mutual information with the target classes.
+
+The reduced vocabulary replaces the existing one, and the feature vectors of all articles are recreated with it.
+It is recorded with the selection settings, so later incremental runs vectorize new articles with the reduced
+vocabulary instead of extending it with the removed terms; run the selection again to include terms of new articles.
+Before doing so, both classifiers are cross-validated on the full and on the reduced feature vectors,
+to report how the dimensionality, training time and accuracy change.
+"""
+import math
+import numpy
+
+from argparse import ArgumentParser
+from argparse import RawTextHelpFormatter
+from sklearn.feature_selection import chi2, mutual_info_classif
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.svm import LinearSVC
+
+from learning.create_vocabulary_and_vectors import create_feature_vectors, create_vocabulary, db, \
+    load_token_dictionary, processed_collection, replace_vocabulary_and_vectors
+from learning.prepare_data import compile_class_bins, create_feature_matrix, get_classes_for_number_of_comments, \
+    load_target_classes
+from learning.train_evaluate_classifiers import repeated_cross_validation
+from storage import connection
+
+selection_methods = ('frequency', 'chi2', 'mutual_info')
+
+
+def get_document_frequencies(feature_vectors):
+    """
+    :param feature_vectors: SciPy CSR matrix containing feature vectors as rows
+    :return: NumPy ndarray containing the number of feature vectors in which each feature occurs
+    """
+    return numpy.asarray((feature_vectors > 0).sum(axis=0)).ravel()
+
+
+def select_features(feature_vectors, target_values=None, min_df=1, max_df=1.0, top_k=None, method='frequency'):
+    """
+    :param feature_vectors: SciPy CSR matrix containing feature vectors as rows
+    :param target_values: NumPy ndarray containing target values, required for the 'chi2' and 'mutual_info' methods
+    :param min_df: minimum number of feature vectors a feature must occur in if an integer,
+        or minimum fraction of feature vectors it must occur in if a float
+    :param max_df: maximum number of feature vectors a feature may occur in if an integer,
+        or maximum fraction of feature vectors it may occur in if a float
+    :param top_k: maximum number of features to select, all features within the document frequency bounds if None
+    :param method: how to rank features when selecting the 'top_k' best: 'frequency' for the total number of
+        occurrences, 'chi2' for the chi-squared statistic or 'mutual_info' for the mutual information between
+        feature and target values
+    :return: sorted NumPy ndarray containing the indices of the selected features
+    """
+    if method not in selection_methods:
+        raise ValueError("'method' must be one of %s." % ', '.join(selection_methods))
+    num_documents = feature_vectors.shape[0]
+    min_count = min_df if isinstance(min_df, int) else int(math.ceil(min_df * num_documents))
+    max_count = max_df if isinstance(max_df, int) else int(math.floor(max_df * num_documents))
+    document_frequencies = get_document_frequencies(feature_vectors)
+    selected = numpy.flatnonzero((document_frequencies >= min_count) & (document_frequencies <= max_count))
+
+    if top_k is not None and top_k < len(selected):
+        scores = score_features(feature_vectors[:, selected], target_values, method)
+        # Sort by descending score, keeping the original order of features with equal scores
+        selected = numpy.sort(selected[numpy.argsort(-scores, kind='mergesort')[:top_k]])
+    return selected
+
+
+def score_features(feature_vectors, target_values, method):
+    """
+    :param feature_vectors: SciPy CSR matrix containing feature vectors as rows
+    :param target_values: NumPy ndarray containing target values
+    :param method: 'frequency', 'chi2' or 'mutual_info', see 'select_features'
+    :return: NumPy ndarray containing a score for each feature, where a higher score means a more useful feature
+    """
+    if method == 'frequency':
+        return numpy.asarray(feature_vectors.sum(axis=0)).ravel()
+    if target_values is None:
+        raise ValueError("'target_values' are required for method '%s'." % method)
+    if method == 'chi2':
+        scores, _ = chi2(feature_vectors, target_values)
+    else:
+        scores = mutual_info_classif(feature_vectors, target_values, discrete_features=True, random_state=0)
+    return numpy.nan_to_num(scores)
+
+
+def compare_feature_sets(feature_vectors, selected_features, target_values, n_folds=5, n_jobs=1, random_state=0):
+    """
+    Cross-validates a multinomial Naive Bayes classifier and a linear SVM on all features and on the selected ones.
+    :param feature_vectors: SciPy CSR matrix containing feature vectors as rows
+    :param selected_features: indices of the selected features
+    :param target_values: NumPy ndarray containing target values
+    :param n_folds: number of folds to use for cross-validation
+    :param n_jobs: number of worker processes to distribute the fits over, -1 to use all CPUs
+    :param random_state: seed for shuffling the folds, so both feature sets are evaluated on the same folds
+    :return: dict mapping classifier names to dicts mapping 'all' and 'selected' to the CrossValidationResult
+        on all features and on the selected features
+    """
+    feature_sets = {'all': feature_vectors, 'selected': feature_vectors[:, selected_features]}
+    return {
+        name: {
+            feature_set: repeated_cross_validation(classifier, vectors, target_values, n_folds=n_folds, iterations=1,
+                                                   n_jobs=n_jobs, random_state=random_state)
+            for feature_set, vectors in feature_sets.items()
+        }
+        for name, classifier in (('multinomial Naive Bayes', MultinomialNB()), ('linear SVM', LinearSVC()))
+    }
+
+
+def parse_document_frequency(value):
+    """
+    :param value: string containing an integer number of documents or a fractional number of documents
+    :return: value as an integer if it doesn't contain a decimal point, as a float otherwise
+    """
+    return float(value) if '.' in value else int(value)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description="Selects the most useful terms of the vocabulary, then recreates the vocabulary and feature\n"
+                    "vectors with only those terms.\n",
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--min-df', type=parse_document_frequency, default=1,
+        help='Minimum number (integer) or fraction (float) of articles a term must occur in (default: 1)'
+    )
+    parser.add_argument(
+        '--max-df', type=parse_document_frequency, default=1.0,
+        help='Maximum number (integer) or fraction (float) of articles a term may occur in (default: 1.0)'
+    )
+    parser.add_argument(
+        '--top-k', type=int, default=None,
+        help='Maximum number of terms to keep, ranked by --method'
+    )
+    parser.add_argument(
+        '--method', choices=selection_methods, default='frequency',
+        help='How to rank terms for --top-k (default: frequency)'
+    )
+    parser.add_argument(
+        '--folds', type=int, default=5,
+        help='Number of cross-validation folds used to compare all and selected terms (default: 5)'
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of worker processes to distribute the cross-validation fits over, -1 to use all CPUs (default: 1)'
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='Only report the effect of the selection, without replacing the vocabulary and feature vectors'
+    )
+    connection.add_connection_arguments(parser)
+    args = parser.parse_args()
+    connection.configure_connection(args)
+
+    articles = list(processed_collection.find().sort('_id', 1))
+    token_dictionary = load_token_dictionary()
+    vocabulary = create_vocabulary(articles, token_dictionary)
+    vectors = create_feature_matrix(create_feature_vectors(vocabulary, articles, token_dictionary=token_dictionary),
+                                    len(vocabulary))
+    values = get_classes_for_number_of_comments(numpy.array([article['num_comments'] for article in articles]),
+                                                compile_class_bins(load_target_classes(db)))
+
+    selected_terms = select_features(vectors, values, args.min_df, args.max_df, args.top_k, args.method)
+    print('\nSelected %d of %d terms (%.1f%%).' %
+          (len(selected_terms), len(vocabulary), 100.0 * len(selected_terms) / max(len(vocabulary), 1)))
+    for classifier_name, results in compare_feature_sets(vectors, selected_terms, values, args.folds,
+                                                         args.jobs).items():
+        print('%s: score %f -> %f, total fit time %.3f -> %.3f seconds' %
+              (classifier_name, results['all'].mean_score, results['selected'].mean_score,
+               results['all'].fit_times.sum(), results['selected'].fit_times.sum()))
+
+    if not args.dry_run:
+        settings = {'min_df': args.min_df, 'max_df': args.max_df, 'top_k': args.top_k, 'method': args.method,
+                    'num_terms_before': len(vocabulary)}
+        replace_vocabulary_and_vectors([vocabulary[index] for index in selected_terms], articles,
+                                       {'feature_selection': settings}, token_dictionary)
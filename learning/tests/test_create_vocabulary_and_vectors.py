@@ -1,7 +1,15 @@
-from bson import ObjectId
+import copy
+
+from bson import DBRef, ObjectId
 from unittest import TestCase
+from unittest.mock import Mock, patch
 
-from learning.create_vocabulary_and_vectors import create_vocabulary, create_feature_vectors
+from learning import create_vocabulary_and_vectors
+from learning.create_vocabulary_and_vectors import create_vocabulary, create_feature_vectors, \
+    create_term_index, extend_vocabulary, create_hashed_feature_vectors, mark_vectorized_articles, \
+    replace_vocabulary_and_vectors, update_vocabulary_and_vectors
+from preprocessing.process_articles import encode_processed_articles
+from preprocessing.token_dictionary import TokenDictionary
 
 
 class TestCreateVocabularyAndVectors(TestCase):
@@ -32,4 +40,156 @@ class TestCreateVocabularyAndVectors(TestCase):
             vocabulary,
             [{'_id': ObjectId(), 'title': 'article news', 'text': 'article very interesting'}]
         )
-        self.assertEqual([0, 2, 0, 0, 1, 0, 1, 0, 0, 1, 0], feature_vectors[0].get('feature_vector', []))
+        self.assertEqual([1, 4, 6, 9], feature_vectors[0].get('feature_indices', []))
+        self.assertEqual([2, 1, 1, 1], feature_vectors[0].get('feature_counts', []))
+
+    def test_create_feature_vector_ignores_terms_outside_vocabulary(self):
+        feature_vectors = create_feature_vectors(
+            ['article', 'news'],
+            [{'_id': ObjectId(), 'title': 'article news', 'text': 'unknown article'}]
+        )
+        self.assertEqual([0, 1], feature_vectors[0].get('feature_indices', []))
+        self.assertEqual([2, 1], feature_vectors[0].get('feature_counts', []))
+
+    def test_create_term_index_maps_terms_to_vocabulary_indices(self):
+        self.assertDictEqual({'a': 0, 'b': 1}, create_term_index(['a', 'b']))
+
+    def test_extend_vocabulary_returns_only_new_terms_in_sorted_order(self):
+        new_terms = extend_vocabulary(['article', 'news'], self.articles)
+        self.assertListEqual(
+            ['a', 'content', 'developments', 'interesting', 'jaw-dropping', 'of', 'piece', 'very', 'viral'], new_terms
+        )
+
+    def test_extend_vocabulary_keeps_existing_feature_indices_valid(self):
+        vocabulary = ['news', 'article']
+        vocabulary += extend_vocabulary(vocabulary, self.articles)
+        feature_vectors = create_feature_vectors(
+            vocabulary, [{'_id': ObjectId(), 'title': 'article news', 'text': 'viral'}]
+        )
+        self.assertEqual([0, 1, vocabulary.index('viral')], feature_vectors[0].get('feature_indices', []))
+
+    def test_create_hashed_feature_vectors_counts_term_occurrences_within_bounds(self):
+        feature_vectors = create_hashed_feature_vectors(
+            [{'_id': ObjectId(), 'title': 'article news', 'text': 'article very interesting'}], 16
+        )
+        feature_indices = feature_vectors[0].get('feature_indices', [])
+        self.assertTrue(all(0 <= index < 16 for index in feature_indices))
+        self.assertListEqual(sorted(feature_indices), feature_indices)
+        self.assertEqual(5, sum(feature_vectors[0].get('feature_counts', [])))
+
+    def test_create_hashed_feature_vectors_maps_same_term_to_same_feature(self):
+        feature_vectors = create_hashed_feature_vectors(
+            [{'_id': ObjectId(), 'title': 'viral', 'text': ''}, {'_id': ObjectId(), 'title': 'news viral', 'text': ''}],
+            2 ** 20
+        )
+        self.assertTrue(set(feature_vectors[0]['feature_indices']) < set(feature_vectors[1]['feature_indices']))
+
+    def test_create_hashed_feature_vectors_with_alternate_sign_keeps_magnitudes(self):
+        article = {'_id': ObjectId(), 'title': 'a news article', 'text': 'very interesting content'}
+        unsigned_vectors = create_hashed_feature_vectors([article], 2 ** 20)
+        signed_vectors = create_hashed_feature_vectors([article], 2 ** 20, alternate_sign=True)
+        self.assertListEqual(unsigned_vectors[0]['feature_indices'], signed_vectors[0]['feature_indices'])
+        self.assertListEqual(unsigned_vectors[0]['feature_counts'],
+                             [abs(count) for count in signed_vectors[0]['feature_counts']])
+
+    def encode_articles(self):
+        token_dictionary = TokenDictionary()
+        encoded_articles = copy.deepcopy(self.articles)
+        encode_processed_articles(encoded_articles, token_dictionary)
+        return encoded_articles, token_dictionary
+
+    def test_create_vocabulary_of_encoded_articles_equals_vocabulary_of_text(self):
+        encoded_articles, token_dictionary = self.encode_articles()
+        self.assertListEqual(create_vocabulary(self.articles), create_vocabulary(encoded_articles, token_dictionary))
+
+    def test_create_vocabulary_of_encoded_articles_requires_token_dictionary(self):
+        encoded_articles, _ = self.encode_articles()
+        self.assertRaises(ValueError, create_vocabulary, encoded_articles)
+
+    def test_create_feature_vectors_of_encoded_articles_equals_vectors_of_text(self):
+        encoded_articles, token_dictionary = self.encode_articles()
+        vocabulary = ['news', 'a', 'viral', 'very']
+        # Mixes encoded and plain articles, which must keep their order
+        articles = [encoded_articles[0], self.articles[1], encoded_articles[1]]
+        expected_vectors = create_feature_vectors(vocabulary, [self.articles[0], self.articles[1], self.articles[1]])
+        feature_vectors = create_feature_vectors(vocabulary, articles, token_dictionary=token_dictionary)
+        for expected_vector, feature_vector in zip(expected_vectors, feature_vectors):
+            self.assertEqual(expected_vector['feature_indices'], feature_vector['feature_indices'])
+            self.assertEqual(expected_vector['feature_counts'], feature_vector['feature_counts'])
+
+    def test_create_hashed_feature_vectors_of_encoded_articles_equals_vectors_of_text(self):
+        encoded_articles, token_dictionary = self.encode_articles()
+        for alternate_sign in (False, True):
+            expected_vectors = create_hashed_feature_vectors(self.articles, 4, alternate_sign)
+            feature_vectors = create_hashed_feature_vectors(encoded_articles, 4, alternate_sign, token_dictionary)
+            for expected_vector, feature_vector in zip(expected_vectors, feature_vectors):
+                self.assertEqual(expected_vector['feature_indices'], feature_vector['feature_indices'])
+                self.assertEqual(expected_vector['feature_counts'], feature_vector['feature_counts'])
+
+
+class TestIncrementalVectorization(TestCase):
+    def setUp(self):
+        self.articles = [
+            {'_id': ObjectId(), 'title': 'a news article', 'text': 'very interesting content'},
+            {'_id': ObjectId(), 'title': 'viral piece of news', 'text': 'jaw-dropping developments'}
+        ]
+        self.processed_collection = Mock()
+        self.naive_bayes_collection = Mock()
+        self.feature_vectors_collection = Mock()
+        for name in ('processed_collection', 'naive_bayes_collection', 'feature_vectors_collection'):
+            patcher = patch.object(create_vocabulary_and_vectors, name, getattr(self, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.object(create_vocabulary_and_vectors, 'load_token_dictionary',
+                               return_value=TokenDictionary([]))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_incremental_update_vectorizes_unmarked_articles_and_marks_them(self):
+        vocabulary_id = ObjectId()
+        self.naive_bayes_collection.find_one.return_value = {'_id': vocabulary_id, 'type': 'vocabulary',
+                                                             'vocabulary': ['a', 'news']}
+        self.processed_collection.find_one.return_value = {'_id': ObjectId()}
+        self.processed_collection.find.return_value.sort.return_value = iter(self.articles)
+        update_vocabulary_and_vectors(incremental=True)
+
+        self.processed_collection.find.assert_called_once_with({'vectorized': None})
+        feature_vectors = self.feature_vectors_collection.insert_many.call_args[0][0]
+        self.assertListEqual([article['_id'] for article in self.articles],
+                             [feature_vector['article_processed_id'].id for feature_vector in feature_vectors])
+        self.processed_collection.update_many.assert_called_once_with(
+            {'_id': {'$in': [article['_id'] for article in self.articles]}}, {'$set': {'vectorized': True}}
+        )
+
+    def test_mark_vectorized_articles_marks_articles_with_feature_vectors_once(self):
+        self.processed_collection.find_one.return_value = None
+        self.feature_vectors_collection.find.return_value = iter(
+            {'article_processed_id': DBRef('articles_processed', article['_id'])} for article in self.articles
+        )
+        self.processed_collection.update_many.return_value.modified_count = 2
+        mark_vectorized_articles()
+        self.processed_collection.update_many.assert_called_once_with(
+            {'_id': {'$in': [article['_id'] for article in self.articles]}}, {'$set': {'vectorized': True}}
+        )
+
+        self.processed_collection.find_one.return_value = {'_id': self.articles[0]['_id']}
+        mark_vectorized_articles()
+        self.assertEqual(1, self.feature_vectors_collection.find.call_count)
+
+    def test_incremental_update_after_feature_selection_keeps_vocabulary_reduced(self):
+        vocabulary_id = ObjectId()
+        self.naive_bayes_collection.insert_one.return_value.inserted_id = vocabulary_id
+        replace_vocabulary_and_vectors(['news', 'viral'], self.articles, {'feature_selection': {'top_k': 2}})
+        vocabulary_document = dict(self.naive_bayes_collection.insert_one.call_args[0][0], _id=vocabulary_id)
+
+        new_articles = [{'_id': ObjectId(), 'title': 'news article', 'text': 'interesting viral content'}]
+        self.naive_bayes_collection.find_one.return_value = vocabulary_document
+        self.processed_collection.find_one.return_value = {'_id': self.articles[0]['_id']}
+        self.processed_collection.find.return_value.sort.return_value = iter(new_articles)
+        self.feature_vectors_collection.insert_many.reset_mock()
+        update_vocabulary_and_vectors(incremental=True)
+
+        self.naive_bayes_collection.update_one.assert_not_called()
+        feature_vectors = self.feature_vectors_collection.insert_many.call_args[0][0]
+        self.assertEqual([0, 1], feature_vectors[0]['feature_indices'])
+        self.assertEqual([1, 1], feature_vectors[0]['feature_counts'])
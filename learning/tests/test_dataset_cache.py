@@ -0,0 +1,47 @@
+import numpy
+import os
+import shutil
+import tempfile
+
+from scipy.sparse import csr_matrix
+from unittest import TestCase
+from unittest.mock import Mock
+
+from learning.dataset_cache import export_dataset, has_signed_features, load_dataset
+
+
+class TestDatasetCache(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.dataset_dir = os.path.join(self.cache_dir, 'fingerprint')
+        self.feature_vectors = csr_matrix(numpy.array([[0, 2, 0], [1, 0, 3]], dtype=numpy.float64))
+        self.target_values = numpy.array(['very_low', 'low'])
+        self.num_comments = numpy.array([5, 15])
+        self.vocabulary = ['article', 'news', 'viral']
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_load_dataset_returns_exported_dataset(self):
+        export_dataset(self.dataset_dir, self.feature_vectors, self.target_values, self.num_comments,
+                       self.vocabulary)
+        feature_vectors, target_values, num_comments, vocabulary = load_dataset(self.dataset_dir)
+        self.assertListEqual(self.feature_vectors.toarray().tolist(), feature_vectors.toarray().tolist())
+        self.assertListEqual(['very_low', 'low'], target_values.tolist())
+        self.assertListEqual([5, 15], num_comments.tolist())
+        self.assertListEqual(self.vocabulary, vocabulary.tolist())
+
+    def test_load_dataset_memory_maps_arrays(self):
+        export_dataset(self.dataset_dir, self.feature_vectors, self.target_values, self.num_comments,
+                       self.vocabulary)
+        dataset = load_dataset(self.dataset_dir)
+        self.assertIsInstance(dataset.target_values, numpy.memmap)
+
+    def test_load_dataset_returns_none_for_missing_dataset(self):
+        self.assertIsNone(load_dataset(self.dataset_dir))
+
+    def test_has_signed_features_only_for_hashing_with_alternate_sign(self):
+        for hashing_settings, signed_features in [(None, False), ({'num_features': 16, 'alternate_sign': False}, False),
+                                                  ({'num_features': 16, 'alternate_sign': True}, True)]:
+            db = {'naive_bayes': Mock(find_one=Mock(return_value=hashing_settings))}
+            self.assertEqual(signed_features, has_signed_features(db))
@@ -0,0 +1,54 @@
+import numpy
+import shutil
+import tempfile
+
+from scipy.sparse import csr_matrix
+from sklearn.naive_bayes import MultinomialNB
+from unittest import TestCase
+
+from learning.evaluation_cache import EvaluationCache, get_evaluation_key
+from learning.train_evaluate_classifiers import repeated_cross_validation
+
+
+class TestEvaluationCache(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = EvaluationCache(self.cache_dir)
+        self.feature_vectors = csr_matrix(numpy.array([[0, 2], [1, 0], [3, 0], [0, 1]], dtype=numpy.float64))
+        self.target_values = numpy.array(['low', 'high', 'high', 'low'])
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_evaluation_key_changes_with_data_and_parameters(self):
+        key = get_evaluation_key(MultinomialNB(), self.feature_vectors, self.target_values, 2, 1, 0)
+        self.assertEqual(key, get_evaluation_key(MultinomialNB(), self.feature_vectors.copy(),
+                                                 self.target_values.astype('<U8'), 2, 1, 0))
+        self.assertNotEqual(key, get_evaluation_key(MultinomialNB(alpha=0.5), self.feature_vectors,
+                                                    self.target_values, 2, 1, 0))
+        self.assertNotEqual(key, get_evaluation_key(MultinomialNB(), self.feature_vectors * 2,
+                                                    self.target_values, 2, 1, 0))
+        self.assertNotEqual(key, get_evaluation_key(MultinomialNB(), self.feature_vectors, self.target_values, 2, 1, 1))
+
+    def test_repeated_cross_validation_loads_cached_result_and_models(self):
+        result = repeated_cross_validation(MultinomialNB(), self.feature_vectors, self.target_values, n_folds=2,
+                                           iterations=2, random_state=0, cache=self.cache)
+        cached_result = repeated_cross_validation(MultinomialNB(), self.feature_vectors, self.target_values,
+                                                  n_folds=2, iterations=2, random_state=0, cache=self.cache)
+        self.assertListEqual(result.scores.tolist(), cached_result.scores.tolist())
+        self.assertListEqual(result.fit_times.tolist(), cached_result.fit_times.tolist())
+        key = get_evaluation_key(MultinomialNB(), self.feature_vectors, self.target_values, 2, 2, 0)
+        models = self.cache.load_models(key)
+        self.assertEqual(4, len(models))
+        self.assertListEqual(['high', 'low'], models[0].classes_.tolist())
+
+    def test_put_evicts_least_recently_used_results(self):
+        scores = numpy.zeros((1, 2))
+        self.cache.put('first', scores, scores, scores)
+        self.cache.max_size = self.cache.get_size() * 2
+        self.cache.put('second', scores, scores, scores)
+        self.cache.get('first')
+        self.cache.put('third', scores, scores, scores)
+        self.assertIsNotNone(self.cache.get('first'))
+        self.assertIsNone(self.cache.get('second'))
+        self.assertIsNotNone(self.cache.get('third'))
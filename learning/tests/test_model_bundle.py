@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+
+from sklearn.naive_bayes import MultinomialNB
+from unittest import TestCase
+
+from learning.model_bundle import create_model_bundle, load_model_bundle, predict_articles, save_model_bundle, \
+    vectorize_articles
+
+
+class TestModelBundle(TestCase):
+    def setUp(self):
+        self.vocabulary = ['economie', 'kat', 'mat', 'voetbal']
+        self.target_classes = {'low': {'start': 0, 'end': 10}, 'high': {'start': 11, 'end': 100}}
+        classifier = MultinomialNB().fit([[0, 2, 1, 0], [3, 0, 0, 2]], ['low', 'high'])
+        self.bundle = create_model_bundle(classifier, self.vocabulary, self.target_classes, ['de', 'op'])
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_vectorize_articles_preprocesses_raw_text(self):
+        vectors = vectorize_articles(self.bundle, [{'title': 'De kat', 'text': 'De kat zit op de mat.'}])
+        self.assertListEqual([[0, 2, 1, 0]], vectors.toarray().tolist())
+
+    def test_predict_articles_returns_class_per_article(self):
+        predictions = predict_articles(self.bundle, [
+            {'title': 'Kat', 'text': 'Een kat op een mat'},
+            {'title': 'Economie', 'text': 'Voetbal en economie'}
+        ])
+        self.assertListEqual(['low', 'high'], predictions)
+
+    def test_load_model_bundle_returns_saved_bundle(self):
+        path = os.path.join(self.temp_dir, 'model.joblib')
+        save_model_bundle(self.bundle, path)
+        bundle = load_model_bundle(path)
+        self.assertListEqual(self.vocabulary, bundle.vocabulary)
+        self.assertDictEqual(self.target_classes, bundle.target_classes)
+        self.assertEqual(frozenset(['de', 'op']), bundle.stop_words)
+        self.assertEqual(1, bundle.term_index['kat'])
+
+    def test_vectorize_articles_hashes_terms_for_hashing_bundle(self):
+        bundle = create_model_bundle(MultinomialNB(), [], self.target_classes, ['de'],
+                                     {'num_features': 32, 'alternate_sign': False})
+        vectors = vectorize_articles(bundle, [{'title': 'De kat', 'text': 'kat mat'}])
+        self.assertTupleEqual((1, 32), vectors.shape)
+        self.assertEqual(3, vectors.sum())
@@ -0,0 +1,77 @@
+import io
+import json
+import threading
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer
+from sklearn.naive_bayes import MultinomialNB
+from unittest import TestCase
+from urllib.error import HTTPError
+
+from learning.model_bundle import create_model_bundle
+from learning.predict_popularity import MicroBatcher, create_request_handler, predict_in_batches
+
+
+class TestPredictPopularity(TestCase):
+    def setUp(self):
+        classifier = MultinomialNB().fit([[2, 0], [0, 2]], ['low', 'high'])
+        self.bundle = create_model_bundle(
+            classifier, ['kat', 'voetbal'], {'low': {'start': 0, 'end': 10}, 'high': {'start': 11, 'end': 100}}, []
+        )
+
+    def test_micro_batcher_predicts_class_per_article(self):
+        batcher = MicroBatcher(self.bundle, max_batch_size=2)
+        predictions = batcher.predict([{'title': 'kat', 'text': ''}, {'title': 'voetbal', 'text': ''},
+                                       {'title': 'kat kat', 'text': ''}])
+        self.assertListEqual(['low', 'high', 'low'], predictions)
+
+    def test_predict_in_batches_adds_predicted_class_to_articles(self):
+        input_file = io.StringIO('{"title": "kat", "text": "", "id": 1}\n\n{"title": "voetbal", "text": "", "id": 2}\n')
+        output_file = io.StringIO()
+        self.assertEqual(2, predict_in_batches(self.bundle, input_file, output_file, batch_size=1))
+        articles = [json.loads(line) for line in output_file.getvalue().splitlines()]
+        self.assertListEqual([(1, 'low'), (2, 'high')],
+                             [(article['id'], article['predicted_class']) for article in articles])
+
+    def test_micro_batcher_fails_only_article_that_cannot_be_classified(self):
+        batcher = MicroBatcher(self.bundle, max_batch_size=2, max_wait=1)
+        invalid_future = batcher.submit({'title': None, 'text': ''})
+        valid_future = batcher.submit({'title': 'voetbal', 'text': ''})
+        self.assertEqual('high', valid_future.result())
+        self.assertIsInstance(invalid_future.exception(), Exception)
+
+    def test_server_rejects_malformed_request_without_failing_others_in_batch(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), create_request_handler(
+            MicroBatcher(self.bundle, max_batch_size=2, max_wait=0.2)
+        ))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:%d/predict' % server.server_port
+
+        def post(body):
+            request = urllib.request.Request(url, json.dumps(body).encode('utf-8'), method='POST')
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    return response.status, json.loads(response.read().decode('utf-8'))
+            except HTTPError as e:
+                return e.code, json.loads(e.read().decode('utf-8'))
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(post, [{'title': 12, 'text': ''}, {'title': 'kat', 'text': '', 'id': 1},
+                                               'kat']))
+        self.assertEqual(400, results[0][0])
+        self.assertEqual((200, {'title': 'kat', 'text': '', 'id': 1, 'predicted_class': 'low'}), results[1])
+        self.assertEqual(400, results[2][0])
+
+    def test_server_responds_with_error_if_classification_fails(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), create_request_handler(MicroBatcher(None)))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        request = urllib.request.Request('http://127.0.0.1:%d/predict' % server.server_port,
+                                         b'{"title": "kat", "text": ""}', method='POST')
+        with self.assertRaises(HTTPError) as context:
+            urllib.request.urlopen(request, timeout=10)
+        self.assertEqual(500, context.exception.code)
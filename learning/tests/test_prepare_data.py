@@ -1,8 +1,10 @@
 import numpy
 
+from scipy.sparse import csr_matrix
 from unittest import TestCase
 
-from learning.prepare_data import get_feature_vectors_and_target_values
+from learning.prepare_data import get_feature_vectors_and_target_values, compile_class_bins, \
+    get_classes_for_number_of_comments, get_quantile_classes
 
 
 class TestPrepareData(TestCase):
@@ -11,9 +13,19 @@ class TestPrepareData(TestCase):
                                       {'feature_vector': [1, 0], 'num_comments': 20}]
         self.target_classes = {'very_low': {'start': 0, 'end': 10}, 'low': {'start': 11, 'end': 20}}
 
-    def test_get_feature_vectors_and_target_values_returns_ndarray_of_vectors(self):
+    def test_get_feature_vectors_and_target_values_returns_csr_matrix_of_vectors(self):
         vectors, _ = get_feature_vectors_and_target_values(self.feature_vectors_dicts, self.target_classes)
-        self.assertIsInstance(vectors, numpy.ndarray)
+        self.assertIsInstance(vectors, csr_matrix)
+
+    def test_get_feature_vectors_and_target_values_converts_dense_vectors(self):
+        vectors, _ = get_feature_vectors_and_target_values(self.feature_vectors_dicts, self.target_classes)
+        self.assertListEqual([[0, 1], [1, 0]], vectors.toarray().tolist())
+
+    def test_get_feature_vectors_and_target_values_converts_sparse_vectors(self):
+        feature_vectors_dicts = [{'feature_indices': [1, 3], 'feature_counts': [2, 1], 'num_comments': 10},
+                                 {'feature_indices': [0], 'feature_counts': [4], 'num_comments': 20}]
+        vectors, _ = get_feature_vectors_and_target_values(feature_vectors_dicts, self.target_classes, num_features=5)
+        self.assertListEqual([[0, 2, 0, 1, 0], [4, 0, 0, 0, 0]], vectors.toarray().tolist())
 
     def test_get_feature_vectors_and_target_values_returns_ndarray_of_values(self):
         _, values = get_feature_vectors_and_target_values(self.feature_vectors_dicts, self.target_classes)
@@ -26,3 +38,31 @@ class TestPrepareData(TestCase):
     def test_get_feature_vectors_and_target_values_returns_correct_values(self):
         _, values = get_feature_vectors_and_target_values(self.feature_vectors_dicts, self.target_classes)
         self.assertListEqual(['very_low', 'low'], values.tolist())
+
+    def test_get_feature_vectors_and_target_values_raises_error_for_number_of_comments_outside_classes(self):
+        feature_vectors_dicts = [{'feature_vector': [0, 1], 'num_comments': 21}]
+        self.assertRaises(ValueError, get_feature_vectors_and_target_values, feature_vectors_dicts,
+                          self.target_classes)
+
+    def test_compile_class_bins_sorts_classes_by_start(self):
+        class_bins = compile_class_bins({'low': {'start': 11, 'end': 20}, 'very_low': {'start': 0, 'end': 10}})
+        self.assertListEqual(['very_low', 'low'], class_bins.labels.tolist())
+
+    def test_compile_class_bins_raises_error_for_overlapping_classes(self):
+        self.assertRaises(ValueError, compile_class_bins,
+                          {'very_low': {'start': 0, 'end': 10}, 'low': {'start': 10, 'end': 20}})
+
+    def test_compile_class_bins_raises_error_for_gap_between_classes(self):
+        self.assertRaises(ValueError, compile_class_bins,
+                          {'very_low': {'start': 0, 'end': 10}, 'low': {'start': 12, 'end': 20}})
+
+    def test_get_classes_for_number_of_comments_labels_all_values(self):
+        values = get_classes_for_number_of_comments(numpy.array([0, 10, 11, 20]),
+                                                    compile_class_bins(self.target_classes))
+        self.assertListEqual(['very_low', 'very_low', 'low', 'low'], values.tolist())
+
+    def test_get_quantile_classes_divides_articles_evenly(self):
+        num_comments = numpy.array([1, 2, 3, 4, 10, 20, 30, 40])
+        target_classes = get_quantile_classes(num_comments, ['low', 'high'])
+        values = get_classes_for_number_of_comments(num_comments, compile_class_bins(target_classes))
+        self.assertListEqual(['low'] * 4 + ['high'] * 4, values.tolist())
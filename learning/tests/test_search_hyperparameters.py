@@ -0,0 +1,43 @@
+import numpy
+
+from sklearn.naive_bayes import MultinomialNB
+from unittest import TestCase
+
+from learning.search_hyperparameters import parse_parameter_grid, parse_parameters, search_hyperparameters
+
+
+class TestSearchHyperparameters(TestCase):
+    def setUp(self):
+        random_state = numpy.random.RandomState(0)
+        self.target_values = numpy.array(['low', 'high'] * 45)
+        self.feature_vectors = random_state.randint(0, 3, (90, 6))
+        self.feature_vectors[self.target_values == 'high', 0] += 5
+
+    def test_parse_parameter_grid_parses_values(self):
+        parameter_grid = parse_parameter_grid(['alpha=0.1,1', 'loss=hinge', 'fit_prior=false', 'max_iter=100'])
+        self.assertDictEqual(
+            {'alpha': [0.1, 1], 'loss': ['hinge'], 'fit_prior': [False], 'max_iter': [100]}, parameter_grid
+        )
+
+    def test_parse_parameter_grid_raises_error_for_missing_values(self):
+        self.assertRaises(ValueError, parse_parameter_grid, ['alpha'])
+
+    def test_parse_parameters_rejects_multiple_values(self):
+        self.assertDictEqual({'C': 0.1, 'loss': 'hinge'}, parse_parameters(['C=0.1', 'loss=hinge']))
+        self.assertRaises(ValueError, parse_parameters, ['C=0.1,1,10'])
+
+    def test_search_hyperparameters_halves_candidates_each_round(self):
+        _, _, rounds = search_hyperparameters(
+            MultinomialNB(), self.feature_vectors, self.target_values,
+            {'alpha': [0.01, 0.1, 0.5, 1.0], 'fit_prior': [True, False]}, factor=2, n_folds=2, random_state=0
+        )
+        self.assertListEqual([8, 4, 2, 1], [len(search_round.candidate_scores) for search_round in rounds])
+        self.assertEqual(90, rounds[-1].num_samples)
+        self.assertLess(rounds[0].num_samples, rounds[-1].num_samples)
+
+    def test_search_hyperparameters_returns_best_candidate_of_last_round(self):
+        parameters, score, rounds = search_hyperparameters(
+            MultinomialNB(), self.feature_vectors, self.target_values, {'alpha': [0.1, 1.0]}, n_folds=2,
+            random_state=0
+        )
+        self.assertTupleEqual((parameters, score), rounds[-1].candidate_scores[0])
@@ -0,0 +1,40 @@
+import numpy
+
+from scipy.sparse import csr_matrix
+from unittest import TestCase
+
+from learning.select_features import compare_feature_sets, get_document_frequencies, select_features
+
+
+class TestSelectFeatures(TestCase):
+    def setUp(self):
+        self.feature_vectors = csr_matrix(numpy.array([
+            [1, 0, 3, 1],
+            [1, 0, 0, 2],
+            [1, 1, 0, 0],
+            [1, 0, 4, 0]
+        ]))
+        self.target_values = numpy.array(['high', 'low', 'low', 'high'])
+
+    def test_get_document_frequencies_counts_feature_vectors_per_feature(self):
+        self.assertListEqual([4, 1, 2, 2], get_document_frequencies(self.feature_vectors).tolist())
+
+    def test_select_features_applies_absolute_min_df(self):
+        self.assertListEqual([0, 2, 3], select_features(self.feature_vectors, min_df=2).tolist())
+
+    def test_select_features_applies_fractional_max_df(self):
+        self.assertListEqual([1, 2, 3], select_features(self.feature_vectors, max_df=0.75).tolist())
+
+    def test_select_features_keeps_top_k_most_frequent(self):
+        self.assertListEqual([0, 2], select_features(self.feature_vectors, top_k=2).tolist())
+
+    def test_select_features_keeps_top_k_by_chi2(self):
+        selected = select_features(self.feature_vectors, self.target_values, max_df=0.75, top_k=1, method='chi2')
+        self.assertListEqual([2], selected.tolist())
+
+    def test_select_features_requires_target_values_for_mutual_info(self):
+        self.assertRaises(ValueError, select_features, self.feature_vectors, top_k=1, method='mutual_info')
+
+    def test_compare_feature_sets_evaluates_both_feature_sets(self):
+        results = compare_feature_sets(self.feature_vectors, [0, 2], self.target_values, n_folds=2)
+        self.assertSetEqual({'all', 'selected'}, set(results['linear SVM']))
@@ -1,10 +1,12 @@
 import numpy
 
+from scipy.sparse import csr_matrix
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.svm import LinearSVC, SVC
 from unittest import TestCase
 
-from learning.train_evaluate_classifiers import evaluate_classifier_using_repeated_cross_validation
+from learning.train_evaluate_classifiers import evaluate_classifier_using_repeated_cross_validation, \
+    get_classifiers_to_evaluate, insert_default_command, repeated_cross_validation
 
 
 class TestTrainEvaluateClassifiers(TestCase):
@@ -22,6 +24,53 @@ class TestTrainEvaluateClassifiers(TestCase):
             LinearSVC(), self.feature_vectors, self.target_values, n_folds=2, iterations=1)
         self.assertIsInstance(score, float)
 
+    def test_evaluate_multinomial_nb_using_repeated_cross_validation_accepts_sparse_matrix(self):
+        score = evaluate_classifier_using_repeated_cross_validation(
+            MultinomialNB(), csr_matrix(self.feature_vectors), self.target_values, n_folds=2, iterations=1)
+        self.assertIsInstance(score, float)
+
     def test_unsupported_classifier_raises_error(self):
         self.assertRaises(TypeError, lambda l: evaluate_classifier_using_repeated_cross_validation(
             SVC(), self.feature_vectors, self.target_values, n_folds=2, iterations=1))
+
+    def test_repeated_cross_validation_returns_score_and_timing_per_fold(self):
+        result = repeated_cross_validation(
+            MultinomialNB(), self.feature_vectors, self.target_values, n_folds=2, iterations=3, random_state=0)
+        self.assertTupleEqual((3, 2), result.scores.shape)
+        self.assertTupleEqual((3, 2), result.fit_times.shape)
+        self.assertTupleEqual((3, 2), result.score_times.shape)
+        self.assertAlmostEqual(result.scores.mean(), result.mean_score)
+
+    def test_repeated_cross_validation_in_parallel_is_reproducible(self):
+        serial_result = repeated_cross_validation(
+            LinearSVC(), self.feature_vectors, self.target_values, n_folds=2, iterations=3, n_jobs=1, random_state=0)
+        parallel_result = repeated_cross_validation(
+            LinearSVC(), self.feature_vectors, self.target_values, n_folds=2, iterations=3, n_jobs=2, random_state=0)
+        self.assertListEqual(serial_result.scores.tolist(), parallel_result.scores.tolist())
+
+    def test_get_classifiers_to_evaluate_leaves_out_naive_bayes_for_signed_features(self):
+        self.assertListEqual([MultinomialNB, LinearSVC],
+                             [type(classifier) for classifier in get_classifiers_to_evaluate()])
+        signed_feature_vectors = self.feature_vectors - self.feature_vectors.T[::-1].T
+        self.assertRaises(ValueError, MultinomialNB().fit, signed_feature_vectors, self.target_values)
+        for classifier in get_classifiers_to_evaluate(signed_features=True):
+            self.assertIsInstance(evaluate_classifier_using_repeated_cross_validation(
+                classifier, signed_feature_vectors, self.target_values, n_folds=2, iterations=1), float)
+
+    def test_insert_default_command_keeps_bare_database_name_form_working(self):
+        commands = ('evaluate', 'search', 'export')
+        self.assertListEqual(['evaluate', 'news', '--seed', '1'],
+                             insert_default_command(['news', '--seed', '1'], commands))
+        self.assertListEqual(['evaluate', '--jobs', '2', 'news'],
+                             insert_default_command(['--jobs', '2', 'news'], commands))
+        self.assertListEqual(['search', 'news', '--classifier', 'nb'],
+                             insert_default_command(['search', 'news', '--classifier', 'nb'], commands))
+        self.assertListEqual(['--help'], insert_default_command(['--help'], commands))
+
+    def test_insert_default_command_ignores_command_names_after_first_argument(self):
+        commands = ('evaluate', 'search', 'export')
+        self.assertListEqual(['evaluate', 'news', '--cache-dir', 'search'],
+                             insert_default_command(['news', '--cache-dir', 'search'], commands))
+        self.assertListEqual(['evaluate', '--seed', '1', 'export'],
+                             insert_default_command(['--seed', '1', 'export'], commands))
+        self.assertListEqual(['evaluate', 'news', '--help'], insert_default_command(['news', '--help'], commands))
@@ -0,0 +1,47 @@
+import numpy
+
+from scipy.sparse import csr_matrix
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import MultinomialNB
+from unittest import TestCase
+
+from learning.train_out_of_core import create_classifiers, stream_dataset_batches, train_out_of_core
+
+
+class TestTrainOutOfCore(TestCase):
+    def setUp(self):
+        random_state = numpy.random.RandomState(0)
+        self.target_values = numpy.array(['low', 'high'] * 50)
+        feature_vectors = random_state.randint(0, 3, (100, 4))
+        feature_vectors[self.target_values == 'high', 0] += 5
+        self.feature_vectors = csr_matrix(feature_vectors)
+        self.classifiers = {'nb': MultinomialNB(), 'svm': SGDClassifier(loss='hinge', random_state=0)}
+
+    def test_stream_dataset_batches_covers_all_feature_vectors(self):
+        batches = list(stream_dataset_batches(self.feature_vectors, self.target_values, batch_size=30))
+        self.assertListEqual([30, 30, 30, 10], [feature_vectors.shape[0] for feature_vectors, _ in batches])
+
+    def test_train_out_of_core_returns_result_per_classifier(self):
+        results = train_out_of_core(self.classifiers, stream_dataset_batches(self.feature_vectors, self.target_values,
+                                                                             batch_size=20), ['high', 'low'])
+        self.assertSetEqual({'nb', 'svm'}, set(results))
+        self.assertEqual(100, results['nb'].num_trained)
+        self.assertIsNone(results['nb'].holdout_score)
+        self.assertGreater(results['nb'].progressive_score, 0.5)
+
+    def test_train_out_of_core_holds_out_every_nth_batch(self):
+        results = train_out_of_core(self.classifiers, stream_dataset_batches(self.feature_vectors, self.target_values,
+                                                                             batch_size=20), ['high', 'low'],
+                                    holdout_every=2)
+        self.assertEqual(60, results['svm'].num_trained)
+        self.assertEqual(40, results['svm'].num_held_out)
+        self.assertIsNotNone(results['svm'].holdout_score)
+
+    def test_create_classifiers_leaves_out_naive_bayes_for_signed_features(self):
+        self.assertListEqual(['multinomial Naive Bayes', 'linear SVM'], list(create_classifiers()))
+        classifiers = create_classifiers(signed_features=True)
+        self.assertListEqual(['linear SVM'], list(classifiers))
+        signed_feature_vectors = csr_matrix(self.feature_vectors.toarray() - 1)
+        results = train_out_of_core(classifiers, stream_dataset_batches(signed_feature_vectors, self.target_values,
+                                                                        batch_size=20), ['high', 'low'])
+        self.assertEqual(100, results['linear SVM'].num_trained)
@@ -1,20 +1,38 @@
 """
 Trains a multinomial Naive Bayes classifier and a linear SVM.
 Evaluates the trained classifiers using cross-validation.
+The fits of all folds of all repetitions can be distributed over a pool of worker processes,
+which read the feature vectors from a shared memory-mapped copy instead of each receiving their own.
+Seeded evaluations are stored in an on-disk evaluation cache, so repeating them on unchanged data
+loads their results instead of fitting all folds again.
 """
 import numpy
+import os
+import sys
+import time
 
 from argparse import ArgumentParser
 from argparse import RawTextHelpFormatter
-from sklearn.model_selection import cross_val_score, StratifiedKFold
+from collections import namedtuple
+from joblib import Parallel, delayed
+from scipy.sparse import issparse
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.svm import LinearSVC
 
-from learning.prepare_data import load_feature_vectors_and_classes, get_feature_vectors_and_target_values
+from instrumentation import metrics
+from learning.dataset_cache import load_cached_dataset
+from learning.evaluation_cache import EvaluationCache, get_evaluation_key
+from learning.prepare_data import load_feature_vectors_and_classes, get_feature_vectors_and_target_values, \
+    compile_class_bins, get_classes_for_number_of_comments, get_quantile_classes
+from storage import connection
+
+CrossValidationResult = namedtuple('CrossValidationResult', ['mean_score', 'scores', 'fit_times', 'score_times'])
 
 
 def evaluate_classifier_using_repeated_cross_validation(classifier, feature_vectors, target_values, n_folds=10,
-                                                        iterations=10):
+                                                        iterations=10, n_jobs=1, random_state=None, cache=None):
     """
     Evaluates the given classifier using n-fold stratified cross-validation.
     Repeats this 'iterations' times and returns the average score.
@@ -23,53 +41,301 @@ def evaluate_classifier_using_repeated_cross_validation(classifier, feature_vect
     :param target_values: labels representing values for each feature vector
     :param n_folds: number of folds to use for cross-validation
     :param iterations: number of evaluations to run
+    :param n_jobs: number of worker processes to distribute the fits over, -1 to use all CPUs
+    :param random_state: seed for shuffling the folds, making the evaluation reproducible
+    :param cache: optional EvaluationCache to load the result from or store it in, only used if random_state is set
     :return: mean cross-validation score of all runs
     """
+    print('\nEvaluating %s classifier with %d runs of %d-fold stratified cross-validation...' %
+          (classifier, iterations, n_folds))
+    result = repeated_cross_validation(classifier, feature_vectors, target_values, n_folds, iterations, n_jobs,
+                                       random_state, cache)
+    print('Mean cross-validation score: %f (standard deviation %f), mean fit time: %.3f seconds' %
+          (result.mean_score, result.scores.std(), result.fit_times.mean()))
+    return result.mean_score
+
+
+def repeated_cross_validation(classifier, feature_vectors, target_values, n_folds=10, iterations=10, n_jobs=1,
+                              random_state=None, cache=None):
+    """
+    Runs 'iterations' repetitions of n-fold stratified cross-validation of the given classifier,
+    fitting all folds of all repetitions in parallel on 'n_jobs' worker processes.
+    :param classifier: classifier to evaluate
+    :param feature_vectors: feature vectors to use for evaluation
+    :param target_values: labels representing values for each feature vector
+    :param n_folds: number of folds to use for cross-validation
+    :param iterations: number of evaluations to run
+    :param n_jobs: number of worker processes to distribute the fits over, -1 to use all CPUs
+    :param random_state: seed for shuffling the folds, repetition i uses seed 'random_state + i'
+    :param cache: optional EvaluationCache to load the result from or store it in, along with the fitted classifier
+        of each fold; only used if random_state is set, since unseeded folds differ on every run
+    :return: CrossValidationResult containing the mean score and NumPy ndarrays of shape (iterations, n_folds)
+        containing the score, fit time and score time of each fold
+    """
     if not (isinstance(classifier, MultinomialNB) or isinstance(classifier, LinearSVC)):
         raise TypeError("'classifier' must be MultinomialNB or LinearSVC.")
     check_vectors_and_values(feature_vectors, target_values)
     if not isinstance(n_folds, int):
         raise TypeError("'n_folds' must be an integer.")
 
-    print('\nEvaluating %s classifier with %d runs of %d-fold stratified cross-validation...' %
-          (classifier, iterations, n_folds))
-    scores = []
-    for _ in range(iterations):
-        k_fold = StratifiedKFold(n_splits=n_folds, shuffle=True)
-        scores.append(cross_val_score(classifier, feature_vectors, target_values, cv=k_fold).mean())
+    key = None
+    if cache is not None and random_state is not None:
+        key = get_evaluation_key(classifier, feature_vectors, target_values, n_folds, iterations, random_state)
+        cached_result = cache.get(key)
+        metrics.increment('evaluation_cache_total', outcome='miss' if cached_result is None else 'hit')
+        if cached_result is not None:
+            print('Loaded cached evaluation from %s.' % os.path.join(cache.directory, key))
+            scores, fit_times, score_times = cached_result
+            return CrossValidationResult(float(scores.mean()), scores, fit_times, score_times)
+    store_models = key is not None and cache.store_models
 
-    score = sum(scores) / float(len(scores))
-    print('Mean cross-validation score: %f' % score)
-    return score
+    splits = []
+    for iteration in range(iterations):
+        seed = None if random_state is None else random_state + iteration
+        k_fold = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed)
+        splits.extend(k_fold.split(feature_vectors, target_values))
+
+    # Arrays larger than 'max_nbytes' are dumped to a memory-mapped file once and shared by all workers
+    results = Parallel(n_jobs=n_jobs, max_nbytes='1M', mmap_mode='r')(
+        delayed(fit_and_score_fold)(clone(classifier), feature_vectors, target_values, train_indices, test_indices,
+                                    return_classifier=store_models)
+        for train_indices, test_indices in splits
+    )
+    scores, fit_times, score_times = (numpy.array(values).reshape(iterations, n_folds)
+                                      for values in list(zip(*results))[:3])
+    # The folds may have been fitted by worker processes, so their times are recorded here
+    for fit_time, score_time in zip(fit_times.ravel(), score_times.ravel()):
+        metrics.observe('fold_fit_seconds', fit_time, classifier=type(classifier).__name__)
+        metrics.observe('fold_score_seconds', score_time, classifier=type(classifier).__name__)
+    if key is not None:
+        models = [result[3] for result in results] if store_models else None
+        cache.put(key, scores, fit_times, score_times, models=models,
+                  description={'classifier': repr(classifier), 'shape': list(feature_vectors.shape),
+                               'n_folds': n_folds, 'iterations': iterations, 'random_state': random_state})
+    return CrossValidationResult(float(scores.mean()), scores, fit_times, score_times)
+
+
+def fit_and_score_fold(classifier, feature_vectors, target_values, train_indices, test_indices,
+                       return_classifier=False):
+    """
+    :param classifier: unfitted classifier
+    :param feature_vectors: feature vectors of all folds
+    :param target_values: labels of all folds
+    :param train_indices: indices of the feature vectors to fit the classifier on
+    :param test_indices: indices of the feature vectors to score the classifier on
+    :param return_classifier: whether to return the fitted classifier as well
+    :return: accuracy on the test fold, number of seconds spent fitting and number of seconds spent scoring,
+        followed by the fitted classifier if return_classifier is set
+    """
+    start_time = time.perf_counter()
+    classifier.fit(feature_vectors[train_indices], target_values[train_indices])
+    fit_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    score = classifier.score(feature_vectors[test_indices], target_values[test_indices])
+    score_time = time.perf_counter() - start_time
+    if return_classifier:
+        return score, fit_time, score_time, classifier
+    return score, fit_time, score_time
 
 
 def check_vectors_and_values(feature_vectors, target_values):
     """
-    Checks whether feature_vectors and target_values are NumPy nd-arrays.
-    :param feature_vectors: array of feature vectors
+    Checks whether feature_vectors is a NumPy nd-array or SciPy sparse matrix and target_values is a NumPy nd-array.
+    :param feature_vectors: array or sparse matrix of feature vectors
     :param target_values: array of target values
     """
-    if not isinstance(feature_vectors, numpy.ndarray):
-        raise TypeError("'feature_vectors' must be a NumPy ndarray.")
+    if not (isinstance(feature_vectors, numpy.ndarray) or issparse(feature_vectors)):
+        raise TypeError("'feature_vectors' must be a NumPy ndarray or SciPy sparse matrix.")
     if not isinstance(target_values, numpy.ndarray):
         raise TypeError("'target_values' must be a NumPy ndarray.")
 
 
+def get_classifiers_to_evaluate(signed_features=False):
+    """
+    :param signed_features: whether the feature vectors contain negative counts, as when they were hashed with
+        'alternate_sign'; multinomial Naive Bayes only accepts non-negative counts, so it is left out
+    :return: list of the classifiers to evaluate
+    """
+    if signed_features:
+        print('Skipping multinomial Naive Bayes, which requires non-negative counts, '
+              'since the feature vectors were hashed with alternate signs.')
+        return [LinearSVC()]
+    return [MultinomialNB(), LinearSVC()]
+
+
+def insert_default_command(arguments, commands, default_command='evaluate'):
+    """
+    Keeps the invocation of earlier versions, which only took '<db_name>' and options, working
+    by inserting 'default_command' before the arguments if they don't start with one of commands.
+    The parser takes no options before the subcommand, so only the first argument can be a subcommand;
+    later arguments equal to a command name, such as the name of a database or the value of an option, are not.
+    :param arguments: list of command line arguments, without the name of the script
+    :param commands: names of the subcommands
+    :param default_command: name of the subcommand to run if arguments don't start with one
+    :return: list of command line arguments starting with a subcommand, unless help of the script is requested
+    """
+    if not arguments or arguments[0] in commands or arguments[0] in ('-h', '--help'):
+        return arguments
+    return [default_command] + arguments
+
+
 if __name__ == '__main__':
+    from nltk.corpus import stopwords
+
+    from learning.dataset_cache import get_number_of_features, has_signed_features, load_hashing_settings, \
+        load_vocabulary
+    from learning.model_bundle import create_model_bundle, save_model_bundle
+    from learning.prepare_data import load_target_classes
+    from learning.search_hyperparameters import parse_parameter_grid, parse_parameters, search_hyperparameters
+
+    dataset_parser = ArgumentParser(add_help=False)
+    dataset_parser.add_argument(
+        'db_name',
+        help='Name of database to use'
+    )
+    dataset_parser.add_argument(
+        '--cache-dir',
+        help='Directory of the on-disk dataset cache (default: cache/datasets in the project directory)'
+    )
+    dataset_parser.add_argument(
+        '--no-cache', action='store_true',
+        help='Prepare the dataset from the database without using the on-disk dataset cache'
+    )
+    dataset_parser.add_argument(
+        '--quantile-classes', action='store_true',
+        help='Derive the comment intervals of the target classes from quantiles of the data,\n'
+             'so each class contains roughly the same number of articles'
+    )
+    dataset_parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of worker processes to distribute the cross-validation fits over, -1 to use all CPUs (default: 1)'
+    )
+    dataset_parser.add_argument(
+        '--seed', type=int, default=None,
+        help='Seed for shuffling the cross-validation folds, making the evaluation reproducible'
+    )
+    dataset_parser.add_argument(
+        '--evaluation-cache-dir',
+        help='Directory of the on-disk evaluation cache (default: cache/evaluations in the project directory)'
+    )
+    dataset_parser.add_argument(
+        '--evaluation-cache-size', type=int, default=1024,
+        help='Maximum size in megabytes of the evaluation cache, least recently used results are evicted\n'
+             '(default: 1024)'
+    )
+    dataset_parser.add_argument(
+        '--no-evaluation-cache', action='store_true',
+        help='Evaluate without loading or storing results in the evaluation cache;\n'
+             'results are only cached if --seed is given'
+    )
+    metrics.add_instrumentation_arguments(dataset_parser)
+    connection.add_connection_arguments(dataset_parser, database=False)
+
     parser = ArgumentParser(
         description="Trains a multinomial Naive Bayes classifier and a linear SVM "
                     "using feature vectors and target values from a given database.\n",
+        epilog="Without a command, '<db_name> [options]' runs 'evaluate <db_name> [options]'.",
         formatter_class=RawTextHelpFormatter
     )
-    parser.add_argument(
-        'db_name',
-        help='Name of database to use'
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    subparsers.add_parser(
+        'evaluate', parents=[dataset_parser], formatter_class=RawTextHelpFormatter,
+        help='Evaluate both classifiers with their default parameters using repeated cross-validation'
+    )
+    search_parser = subparsers.add_parser(
+        'search', parents=[dataset_parser], formatter_class=RawTextHelpFormatter,
+        help='Search the parameters of a classifier using successive halving'
+    )
+    search_parser.add_argument(
+        '--classifier', choices=['nb', 'svm'], required=True,
+        help="Classifier to search parameters for, 'nb' for multinomial Naive Bayes or 'svm' for linear SVM"
+    )
+    search_parser.add_argument(
+        '--param', action='append', required=True, metavar='NAME=VALUE1,VALUE2,...',
+        help='Values to try for a parameter of the classifier, for example alpha=0.01,0.1,1 or C=0.1,1,10;\n'
+             'can be given multiple times'
+    )
+    search_parser.add_argument(
+        '--factor', type=int, default=3,
+        help='Factor by which the number of candidates shrinks and the sample size grows each round (default: 3)'
     )
-    args = parser.parse_args()
+    search_parser.add_argument(
+        '--folds', type=int, default=5,
+        help='Number of cross-validation folds used to score each candidate (default: 5)'
+    )
+    export_parser = subparsers.add_parser(
+        'export', parents=[dataset_parser], formatter_class=RawTextHelpFormatter,
+        help='Train a classifier on the full dataset and save it as a model bundle for predicting new articles'
+    )
+    export_parser.add_argument(
+        '--classifier', choices=['nb', 'svm'], required=True,
+        help="Classifier to train, 'nb' for multinomial Naive Bayes or 'svm' for linear SVM"
+    )
+    export_parser.add_argument(
+        '--param', action='append', default=[], metavar='NAME=VALUE',
+        help='Value of a parameter of the classifier, for example alpha=0.1; can be given multiple times'
+    )
+    export_parser.add_argument(
+        '--output', required=True,
+        help='Path of the file to save the model bundle to'
+    )
+    args = parser.parse_args(insert_default_command(sys.argv[1:], subparsers.choices))
+    if args.command == 'export':
+        try:
+            parameters = parse_parameters(args.param)
+        except ValueError as e:
+            parser.error(str(e))
+    metrics.configure_instrumentation(args)
+    connection.configure_connection(args)
+    database = connection.get_database(args.db_name)
+    signed_features = has_signed_features(database)
+    if args.command in ('search', 'export') and args.classifier == 'nb' and signed_features:
+        parser.error('--classifier nb requires non-negative counts, but the feature vectors were hashed with '
+                     'alternate signs; use --classifier svm.')
 
     # Prepare data for learning
-    vectors, classes = load_feature_vectors_and_classes(args.db_name)
-    vectors, values = get_feature_vectors_and_target_values(vectors, classes)
-    # Evaluate performance of multinomial NB and linear SVM
-    evaluate_classifier_using_repeated_cross_validation(MultinomialNB(), vectors, values)
-    evaluate_classifier_using_repeated_cross_validation(LinearSVC(), vectors, values)
+    with metrics.stage('prepare_dataset'):
+        if args.no_cache:
+            vector_dicts, classes = load_feature_vectors_and_classes(args.db_name)
+            vocabulary = load_vocabulary(database)
+            vectors, values = get_feature_vectors_and_target_values(vector_dicts, classes,
+                                                                    num_features=get_number_of_features(database))
+            comments = numpy.array([vector_dict['num_comments'] for vector_dict in vector_dicts])
+        else:
+            vectors, values, comments, vocabulary = load_cached_dataset(args.db_name, args.cache_dir)
+            classes = load_target_classes(database)
+        if args.quantile_classes:
+            classes = get_quantile_classes(comments, compile_class_bins(classes).labels)
+            print('Using quantile classes %s.' % classes)
+            values = get_classes_for_number_of_comments(comments, compile_class_bins(classes))
+
+    with metrics.stage(args.command):
+        if args.command == 'search':
+            classifier = MultinomialNB() if args.classifier == 'nb' else LinearSVC()
+            parameters, score, _ = search_hyperparameters(
+                classifier, vectors, values, parse_parameter_grid(args.param), factor=args.factor, n_folds=args.folds,
+                n_jobs=args.jobs, random_state=args.seed
+            )
+            print('Best parameters: %s, cross-validation score: %f' % (parameters, score))
+        elif args.command == 'export':
+            try:
+                stop_words = stopwords.words('dutch')
+            except LookupError as e:
+                print(e)
+                exit()
+            classifier = MultinomialNB() if args.classifier == 'nb' else LinearSVC()
+            classifier.set_params(**parameters)
+            print('Training %s on %d feature vectors...' % (classifier, vectors.shape[0]))
+            classifier.fit(vectors, values)
+            save_model_bundle(create_model_bundle(classifier, vocabulary, classes, stop_words,
+                                                  load_hashing_settings(database)), args.output)
+        else:
+            # Evaluate performance of multinomial NB and linear SVM
+            evaluation_cache = None if args.no_evaluation_cache else EvaluationCache(
+                args.evaluation_cache_dir, max_size=args.evaluation_cache_size * 1024 ** 2
+            )
+            for classifier in get_classifiers_to_evaluate(signed_features):
+                evaluate_classifier_using_repeated_cross_validation(classifier, vectors, values, n_jobs=args.jobs,
+                                                                    random_state=args.seed, cache=evaluation_cache)
+    metrics.finish_instrumentation(args, 'learn')
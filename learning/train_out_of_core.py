@@ -0,0 +1,167 @@
+"""
+Trains a multinomial Naive Bayes classifier and a linear SVM out-of-core.
+Feature vectors are streamed in mini-batches from the 'feature_vectors' collection or from the on-disk dataset cache,
+and the classifiers are updated with 'partial_fit', so the dataset never has to fit in memory at once.
+The linear SVM is an SGDClassifier with hinge loss, which supports incremental training.
+
+The classifiers are evaluated with progressive validation: each batch is scored before they are trained on it.
+Additionally, every n-th batch can be held out, in which case it is only scored and never trained on.
+"""
+import numpy
+
+from argparse import ArgumentParser
+from argparse import RawTextHelpFormatter
+from collections import namedtuple
+from itertools import islice
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import MultinomialNB
+
+from learning.dataset_cache import get_number_of_features, has_signed_features, load_cached_dataset
+from learning.prepare_data import compile_class_bins, create_feature_matrix, get_classes_for_number_of_comments, \
+    load_target_classes
+from storage import connection
+
+OutOfCoreResult = namedtuple('OutOfCoreResult', ['progressive_score', 'holdout_score', 'num_trained', 'num_held_out'])
+
+
+def stream_feature_vector_batches(db, class_bins, num_features, batch_size=1000):
+    """
+    :param db: database containing the 'feature_vectors' collection
+    :param class_bins: ClassBins as returned by 'compile_class_bins'
+    :param num_features: number of features of the feature vectors
+    :param batch_size: number of feature vectors per batch
+    :return: generator of tuples of a SciPy CSR matrix containing at most 'batch_size' feature vectors
+        and a NumPy ndarray containing their target values
+    """
+    cursor = db['feature_vectors'].find(
+        {}, {'feature_indices': 1, 'feature_counts': 1, 'feature_vector': 1, 'num_comments': 1}
+    ).batch_size(batch_size)
+    for batch in iter(lambda: list(islice(cursor, batch_size)), []):
+        feature_vectors = create_feature_matrix(batch, num_features)
+        num_comments = numpy.array([feature_vector_dict['num_comments'] for feature_vector_dict in batch])
+        yield feature_vectors, get_classes_for_number_of_comments(num_comments, class_bins)
+
+
+def stream_dataset_batches(feature_vectors, target_values, batch_size=1000):
+    """
+    :param feature_vectors: SciPy CSR matrix containing feature vectors, such as a memory-mapped cached dataset
+    :param target_values: NumPy ndarray containing target values
+    :param batch_size: number of feature vectors per batch
+    :return: generator of tuples of a SciPy CSR matrix containing at most 'batch_size' feature vectors
+        and a NumPy ndarray containing their target values
+    """
+    for start in range(0, feature_vectors.shape[0], batch_size):
+        yield feature_vectors[start:start + batch_size], target_values[start:start + batch_size]
+
+
+def create_classifiers(signed_features=False):
+    """
+    :param signed_features: whether the feature vectors contain negative counts, as when they were hashed with
+        'alternate_sign'; multinomial Naive Bayes only accepts non-negative counts, so it is left out
+    :return: dict mapping names to untrained classifiers supporting 'partial_fit'
+    """
+    classifiers = {}
+    if signed_features:
+        print('Skipping multinomial Naive Bayes, which requires non-negative counts, '
+              'since the feature vectors were hashed with alternate signs.')
+    else:
+        classifiers['multinomial Naive Bayes'] = MultinomialNB()
+    classifiers['linear SVM'] = SGDClassifier(loss='hinge')
+    return classifiers
+
+
+def train_out_of_core(classifiers, batches, classes, holdout_every=None):
+    """
+    Trains classifiers incrementally on batches, evaluating them with progressive validation.
+    :param classifiers: dict mapping names to classifiers supporting 'partial_fit'
+    :param batches: iterable of tuples of feature vectors and target values
+    :param classes: all class labels that can occur in the target values
+    :param holdout_every: if given, every 'holdout_every'-th batch is only used for evaluation
+    :return: dict mapping the names of classifiers to an OutOfCoreResult containing their progressive validation
+        score on the batches they were trained on, their score on the held out batches (None if no batches were held
+        out), the number of feature vectors they were trained on and the number of feature vectors held out
+    """
+    num_correct = dict.fromkeys(classifiers, 0.0)
+    num_correct_held_out = dict.fromkeys(classifiers, 0.0)
+    num_scored = 0
+    num_trained = 0
+    num_held_out = 0
+    for batch_index, (feature_vectors, target_values) in enumerate(batches, 1):
+        batch_size = feature_vectors.shape[0]
+        held_out = holdout_every is not None and batch_index % holdout_every == 0
+        for name, classifier in classifiers.items():
+            # Score on the batch before training on it, unless the classifier hasn't been trained at all yet
+            if num_trained > 0:
+                score = classifier.score(feature_vectors, target_values) * batch_size
+                if held_out:
+                    num_correct_held_out[name] += score
+                else:
+                    num_correct[name] += score
+            if not held_out:
+                classifier.partial_fit(feature_vectors, target_values, classes=classes)
+        if held_out:
+            num_held_out += batch_size if num_trained > 0 else 0
+        else:
+            num_scored += batch_size if num_trained > 0 else 0
+            num_trained += batch_size
+        print('Processed batch %d, trained on %d feature vectors, held out %d.' %
+              (batch_index, num_trained, num_held_out))
+
+    return {
+        name: OutOfCoreResult(
+            num_correct[name] / num_scored if num_scored else None,
+            num_correct_held_out[name] / num_held_out if num_held_out else None,
+            num_trained,
+            num_held_out
+        )
+        for name in classifiers
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description="Trains a multinomial Naive Bayes classifier and a linear SVM on mini-batches of feature vectors\n"
+                    "from a given database, without loading all of them into memory.\n",
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        'db_name',
+        help='Name of database to use'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=1000,
+        help='Number of feature vectors per mini-batch (default: 1000)'
+    )
+    parser.add_argument(
+        '--holdout-every', type=int, default=None,
+        help='Hold out every n-th mini-batch for evaluation instead of training on it'
+    )
+    parser.add_argument(
+        '--from-cache', action='store_true',
+        help='Stream the feature vectors from the memory-mapped on-disk dataset cache instead of the database'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        help='Directory of the on-disk dataset cache (default: cache/datasets in the project directory)'
+    )
+    connection.add_connection_arguments(parser, database=False)
+    args = parser.parse_args()
+    connection.configure_connection(args)
+
+    database = connection.get_database(args.db_name)
+    bins = compile_class_bins(load_target_classes(database))
+    if args.from_cache:
+        dataset = load_cached_dataset(args.db_name, args.cache_dir)
+        mini_batches = stream_dataset_batches(dataset.feature_vectors, dataset.target_values, args.batch_size)
+    else:
+        features = get_number_of_features(database)
+        if features is None:
+            print('Database contains neither a vocabulary nor hashing settings to determine the number of features.')
+            exit()
+        mini_batches = stream_feature_vector_batches(database, bins, features, args.batch_size)
+
+    results = train_out_of_core(create_classifiers(has_signed_features(database)), mini_batches, bins.labels,
+                                args.holdout_every)
+    for classifier_name, result in results.items():
+        print('%s: progressive validation score %s, holdout score %s, trained on %d feature vectors.' %
+              (classifier_name, result.progressive_score, result.holdout_score, result.num_trained))
@@ -0,0 +1,493 @@
+"""
+Runs the stages of the pipeline in a single process: crawling, preprocessing, vectorization and preparing the dataset.
+The stages are chained as generators of batches, so each batch of articles flows from one stage into the next
+without being read back from the database in between.
+
+With checkpoints, which is the default, every stage also persists its output to the collection the separate scripts
+use ('articles_processed', 'feature_vectors' and the vocabulary) and records its progress in the
+'pipeline_checkpoints' collection. An interrupted run can then be resumed at the first stage that didn't complete,
+which reads its input from the database and skips the work that was already done.
+Without checkpoints, only the number of comments of crawled articles is written to the database; the resulting dataset
+is only exported to a directory and/or evaluated, which requires a full run.
+
+In incremental mode, only articles whose number of comments was updated by this run are preprocessed and vectorized,
+extending the existing vocabulary, after which the dataset is prepared from all feature vectors in the database.
+In full mode, all articles are preprocessed and vectorized again, replacing the processed articles, the vocabulary
+and the feature vectors, and the dataset is prepared directly from the stream of feature vectors.
+"""
+import numpy
+import os
+
+from argparse import ArgumentParser
+from argparse import RawTextHelpFormatter
+from bson import ObjectId
+from datetime import datetime
+from itertools import chain, islice
+from multiprocessing import cpu_count
+from scipy.sparse import csr_matrix, vstack
+
+from crawling.collect_articles import add_client_arguments, collect_articles, configure_client_arguments, \
+    create_client, refresh_number_of_comments
+from instrumentation import metrics
+from learning.create_vocabulary_and_vectors import articles_processed_collection_name, create_feature_vectors, \
+    create_hashed_feature_vectors, create_term_index, db, default_num_hashed_features, extend_vocabulary, \
+    feature_vectors_collection, get_articles_to_vectorize, is_vocabulary_fixed, load_token_dictionary, \
+    mark_articles_vectorized, naive_bayes_collection, processed_collection, reset_vectorized_articles, save_feature_vectors
+from learning.dataset_cache import Dataset, export_dataset, get_dataset_fingerprint, get_default_cache_dir, \
+    load_cached_dataset
+from learning.prepare_data import compile_class_bins, create_feature_matrix, get_classes_for_number_of_comments, \
+    load_target_classes
+from learning.train_evaluate_classifiers import evaluate_classifier_using_repeated_cross_validation, \
+    get_classifiers_to_evaluate
+from preprocessing.process_articles import collection as articles_collection, collection_name, count_tokens, \
+    encode_processed_articles, ensure_processed_index, get_articles_to_preprocess, load_stop_words, preprocess_batch, \
+    preprocess_in_pool, save_processed_articles, tokens_collection
+from storage import connection
+
+stage_names = ('crawl', 'preprocess', 'vectorize', 'dataset')
+checkpoints_collection = connection.get_collection('pipeline_checkpoints')
+
+
+class Vectorizer(object):
+    def __init__(self, features='exact', num_features=default_num_hashed_features, alternate_sign=False,
+                 vocabulary=None, token_dictionary=None, fixed_vocabulary=False):
+        """
+        Creates feature vectors of batches of articles, extending the vocabulary with the new terms of each batch.
+        :param features: 'exact' to map each term of the vocabulary to its own feature, 'hashing' to hash terms
+        :param num_features: number of features to hash terms into in hashing mode
+        :param alternate_sign: whether to use the sign of the hash of each term as the sign of its count
+        :param vocabulary: list of terms to extend in exact mode, defaults to an empty vocabulary
+        :param token_dictionary: TokenDictionary, required to vectorize articles stored as token IDs
+        :param fixed_vocabulary: whether to ignore terms that aren't in vocabulary instead of appending them,
+            such as for a vocabulary reduced by feature selection
+        """
+        self.features = features
+        self.num_features = num_features
+        self.alternate_sign = alternate_sign
+        self.token_dictionary = token_dictionary
+        self.fixed_vocabulary = fixed_vocabulary
+        self.vocabulary = list(vocabulary or [])
+        self._term_index = create_term_index(self.vocabulary)
+
+    def vectorize(self, articles):
+        """
+        :param articles: list of processed articles
+        :return:
+            - list of feature vector dicts of articles
+            - list of terms that were appended to the vocabulary, empty in hashing mode or with a fixed vocabulary
+        """
+        if self.features == 'hashing':
+            return create_hashed_feature_vectors(articles, self.num_features, self.alternate_sign,
+                                                 self.token_dictionary), []
+        if self.fixed_vocabulary:
+            return create_feature_vectors(self.vocabulary, articles, self._term_index, self.token_dictionary), []
+        new_terms = extend_vocabulary(self._term_index, articles, self.token_dictionary)
+        for term in new_terms:
+            self._term_index[term] = len(self.vocabulary)
+            self.vocabulary.append(term)
+        return create_feature_vectors(self.vocabulary, articles, self._term_index, self.token_dictionary), new_terms
+
+    def get_number_of_features(self):
+        """
+        :return: number of features of the feature vectors created so far
+        """
+        return self.num_features if self.features == 'hashing' else len(self.vocabulary)
+
+
+def crawl(client=None, max_workers=1, batch_size=100):
+    """
+    Collects new articles, then updates the number of comments of articles that are old enough.
+    :param client: optional HttpClient to download pages with
+    :param max_workers: maximum number of pages to download concurrently
+    :param batch_size: maximum number of comment updates per batch
+    :return: generator of lists of articles whose number of comments was updated, including their title and text
+    """
+    collect_articles(client, max_workers)
+    for articles in refresh_number_of_comments(client, max_workers, batch_size, fields=('title', 'text')):
+        if articles:
+            yield articles
+
+
+def read_in_batches(cursor, collection_name_to_time, batch_size):
+    """
+    :param cursor: database cursor
+    :param collection_name_to_time: name of the collection cursor reads from, to label the time spent reading
+    :param batch_size: number of documents per batch
+    :return: generator of lists of at most 'batch_size' documents
+    """
+    documents = iter(cursor)
+    return metrics.timed(iter(lambda: list(islice(documents, batch_size)), []),
+                         'mongo_read_seconds', collection=collection_name_to_time)
+
+
+def preprocess_stream(article_batches, stop_words, processes=1, checkpoints=True, token_dictionary=None):
+    """
+    :param article_batches: iterable of lists of articles containing a 'title', 'text' and 'num_comments'
+    :param stop_words: set of stopwords to filter text by
+    :param processes: number of worker processes to use
+    :param checkpoints: whether to save the preprocessed articles and mark the original articles as preprocessed
+    :param token_dictionary: optional TokenDictionary to store the title and text of preprocessed articles
+        as token IDs with
+    :return: generator of lists of preprocessed articles, each with an '_id'
+    """
+    if processes == 1:
+        processed_batches = (preprocess_batch(articles, stop_words) for articles in article_batches)
+    else:
+        processed_batches = preprocess_in_pool(article_batches, stop_words, processes)
+    for processed_articles in processed_batches:
+        metrics.increment('tokens_total', count_tokens(processed_articles))
+        if token_dictionary is not None:
+            encode_processed_articles(processed_articles, token_dictionary)
+            if checkpoints:
+                token_dictionary.save(tokens_collection)
+        if checkpoints:
+            # Inserting the processed articles assigns their '_id', articles that were already saved are left out
+            processed_articles = save_processed_articles(processed_articles)
+        else:
+            for processed_article in processed_articles:
+                processed_article['_id'] = ObjectId()
+        metrics.increment('articles_preprocessed_total', len(processed_articles))
+        if processed_articles:
+            yield processed_articles
+
+
+def vectorize_stream(processed_batches, vectorizer, vectors_document_id=None):
+    """
+    :param processed_batches: iterable of lists of preprocessed articles, sorted by '_id'
+    :param vectorizer: Vectorizer to create the feature vectors with
+    :param vectors_document_id: '_id' of the vocabulary or hashing document in the 'naive_bayes' collection
+        to save new terms to, or None to not save the feature vectors and mark the articles as vectorized
+    :return: generator of lists of feature vector dicts
+    """
+    for processed_articles in processed_batches:
+        feature_vectors, new_terms = vectorizer.vectorize(processed_articles)
+        if vectors_document_id is not None:
+            if new_terms:
+                naive_bayes_collection.update_one(
+                    {'_id': vectors_document_id}, {'$push': {'vocabulary': {'$each': new_terms}}}
+                )
+            save_feature_vectors(feature_vectors)
+            mark_articles_vectorized(processed_articles)
+        yield feature_vectors
+
+
+def start_vectorization(features, num_features, alternate_sign, full, checkpoints, token_dictionary=None):
+    """
+    Determines whether the existing vocabulary or hashed feature vectors can be extended, and if not,
+    replaces them with an empty vocabulary or new hashing settings when checkpoints are saved.
+    :param features: 'exact' or 'hashing'
+    :param num_features: number of features to hash terms into in hashing mode
+    :param alternate_sign: whether to use the sign of the hash of each term as the sign of its count
+    :param full: whether to replace the existing vocabulary and feature vectors
+    :param checkpoints: whether the feature vectors are saved
+    :param token_dictionary: TokenDictionary, required to vectorize articles stored as token IDs
+    :return:
+        - Vectorizer
+        - '_id' of the vocabulary or hashing document to save new terms to, or None without checkpoints
+        - whether only processed articles that haven't been vectorized yet must be vectorized,
+          instead of all processed articles
+    """
+    if features == 'hashing':
+        document = naive_bayes_collection.find_one({'type': 'hashing'})
+        extendable = document is not None and document['num_features'] == num_features and \
+            document['alternate_sign'] == alternate_sign
+    else:
+        document = naive_bayes_collection.find_one({'type': 'vocabulary'}, sort=[('_id', -1)])
+        extendable = document is not None
+    if not full and extendable:
+        fixed_vocabulary = features == 'exact' and is_vocabulary_fixed(document)
+        if fixed_vocabulary:
+            print('Not extending the vocabulary reduced by feature selection, '
+                  'run select_features.py again to include new terms.')
+        vectorizer = Vectorizer(features, num_features, alternate_sign, document.get('vocabulary'), token_dictionary,
+                                fixed_vocabulary)
+        return vectorizer, document['_id'], True
+
+    document_id = None
+    if checkpoints:
+        print('Replacing vocabulary and feature vectors...')
+        naive_bayes_collection.delete_many({'type': {'$in': ['vocabulary', 'hashing']}})
+        reset_vectorized_articles()
+        feature_vectors_collection.delete_many({})
+        if features == 'hashing':
+            document = {'type': 'hashing', 'num_features': num_features, 'alternate_sign': alternate_sign}
+        else:
+            document = {'type': 'vocabulary', 'vocabulary': []}
+        document_id = naive_bayes_collection.insert_one(document).inserted_id
+    return Vectorizer(features, num_features, alternate_sign, token_dictionary=token_dictionary), document_id, False
+
+
+def build_dataset(feature_vector_batches, vectorizer, target_classes):
+    """
+    :param feature_vector_batches: iterable of lists of feature vector dicts
+    :param vectorizer: Vectorizer that created the feature vectors, which determines the number of features
+        once all batches have been created
+    :param target_classes: dictionary containing a 'target class label -> comment interval' mapping
+    :return: Dataset of all feature vectors
+    """
+    matrices = []
+    num_comments = []
+    for feature_vectors in feature_vector_batches:
+        matrices.append(create_feature_matrix(feature_vectors, vectorizer.get_number_of_features()))
+        num_comments.extend(feature_vector['num_comments'] for feature_vector in feature_vectors)
+    # The vocabulary may have grown after earlier batches were converted, so all matrices get the final width
+    num_features = vectorizer.get_number_of_features()
+    matrices = [csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], num_features))
+                for matrix in matrices]
+    feature_vectors = vstack(matrices, format='csr') if matrices else csr_matrix((0, num_features))
+    num_comments = numpy.array(num_comments, dtype=numpy.int64)
+    target_values = get_classes_for_number_of_comments(num_comments, compile_class_bins(target_classes))
+    return Dataset(feature_vectors, target_values, num_comments, vectorizer.vocabulary)
+
+
+def start_checkpoints(stages, full):
+    """
+    :param stages: names of the stages that will run
+    :param full: whether the run is a full run
+    :return: '_id' of the run
+    """
+    run_id = ObjectId()
+    for stage in stages:
+        checkpoints_collection.replace_one({'_id': stage}, {
+            'run_id': run_id, 'full': full, 'started': datetime.now(), 'updated': datetime.now(),
+            'completed': False, 'num_items': 0, 'last_id': None
+        }, upsert=True)
+    return run_id
+
+
+def record_checkpoints(batches, stage, run_id):
+    """
+    :param batches: iterable of lists of documents that have been saved to the database
+    :param stage: name of the stage that saved the documents
+    :param run_id: '_id' of the run
+    :return: generator of the batches, recording the progress of stage after each batch and its completion at the end
+    """
+    for batch in batches:
+        checkpoints_collection.update_one({'_id': stage, 'run_id': run_id}, {
+            '$inc': {'num_items': len(batch)},
+            '$set': {'last_id': batch[-1].get('_id') if batch else None, 'updated': datetime.now()}
+        })
+        yield batch
+    complete_checkpoint(stage, run_id)
+
+
+def complete_checkpoint(stage, run_id):
+    """
+    :param stage: name of the stage that completed
+    :param run_id: '_id' of the run
+    """
+    checkpoints_collection.update_one({'_id': stage, 'run_id': run_id},
+                                      {'$set': {'completed': True, 'updated': datetime.now()}})
+
+
+def get_resume_stage():
+    """
+    :return: name of the first stage the previous run didn't complete, or None if it completed all of its stages
+    """
+    checkpoints = {checkpoint['_id']: checkpoint for checkpoint in checkpoints_collection.find()}
+    for stage in stage_names:
+        if stage in checkpoints and not checkpoints[stage]['completed']:
+            return stage
+    return None
+
+
+def run_pipeline(from_stage='crawl', full=False, checkpoints=True, client=None, max_workers=1, batch_size=1000,
+                 processes=1, features='exact', num_features=default_num_hashed_features, alternate_sign=False,
+                 cache_dir=None, encode_tokens=False):
+    """
+    Runs the stages of the pipeline from 'from_stage' on, passing batches from one stage to the next.
+    :param from_stage: name of the first stage to run; later stages read the output of earlier ones from the database
+    :param full: whether to preprocess and vectorize all articles again instead of only new ones
+    :param checkpoints: whether to save the output and progress of each stage to the database
+    :param client: optional HttpClient to download pages with
+    :param max_workers: maximum number of pages to download concurrently
+    :param batch_size: number of articles per batch
+    :param processes: number of worker processes to preprocess articles with
+    :param features: 'exact' to create feature vectors based on a vocabulary, 'hashing' to hash terms into features
+    :param num_features: number of features to hash terms into in hashing mode
+    :param alternate_sign: whether to use the sign of the hash of each term as the sign of its count in hashing mode
+    :param cache_dir: directory of the dataset cache to export the dataset to with checkpoints,
+        defaults to 'get_default_cache_dir()'
+    :param encode_tokens: whether to store the title and text of preprocessed articles as token IDs
+    :return: Dataset
+    """
+    if not checkpoints and not full and from_stage != 'dataset':
+        raise ValueError('Running without checkpoints requires a full run.')
+    stages = stage_names[stage_names.index(from_stage):]
+    run_id = start_checkpoints(stages, full) if checkpoints else None
+
+    def checkpointed(batches, stage):
+        return record_checkpoints(batches, stage, run_id) if checkpoints else batches
+
+    # Processed articles read back from the database may be stored as token IDs, also if this run doesn't encode them
+    token_dictionary = load_token_dictionary() if stages != ('dataset',) else None
+    batches = None
+    if from_stage == 'crawl':
+        batches = checkpointed(crawl(client, max_workers, batch_size), 'crawl')
+        if full:
+            # All articles are preprocessed again, so crawling only needs to finish before they are read
+            for _ in batches:
+                pass
+            batches = None
+
+    if 'preprocess' in stages:
+        if checkpoints:
+            if full:
+                processed_collection.delete_many({})
+                articles_collection.update_many({'preprocessed': True}, {'$unset': {'preprocessed': ''}})
+            ensure_processed_index()
+        # Articles whose number of comments was updated earlier, but weren't preprocessed yet, are preprocessed first
+        if batches is None or (checkpoints and not full):
+            if full:
+                cursor = articles_collection.find({'num_comments': {'$ne': None}},
+                                                  {'title': 1, 'text': 1, 'num_comments': 1})
+            else:
+                cursor = get_articles_to_preprocess()
+            saved_batches = read_in_batches(cursor, collection_name, batch_size)
+            batches = saved_batches if batches is None else chain(saved_batches, batches)
+        batches = checkpointed(preprocess_stream(batches, load_stop_words(), processes, checkpoints,
+                                                 token_dictionary if encode_tokens else None), 'preprocess')
+
+    if 'vectorize' in stages:
+        vectorizer, vectors_document_id, extending = start_vectorization(
+            features, num_features, alternate_sign, full, checkpoints, token_dictionary
+        )
+        # Processed articles that weren't vectorized yet, for instance by an interrupted run, are vectorized first
+        if batches is None or (checkpoints and not full):
+            cursor = get_articles_to_vectorize() if extending else processed_collection.find().sort('_id', 1)
+            saved_batches = read_in_batches(cursor, articles_processed_collection_name, batch_size)
+            batches = saved_batches if batches is None else chain(saved_batches, batches)
+        batches = checkpointed(vectorize_stream(batches, vectorizer, vectors_document_id), 'vectorize')
+
+    # Unless all feature vectors were created by this run, the dataset is prepared from those in the database
+    if from_stage == 'dataset' or not full:
+        if batches is not None:
+            for _ in batches:
+                pass
+        dataset = load_cached_dataset(db.name, cache_dir)
+    else:
+        dataset = build_dataset(batches, vectorizer, load_target_classes(db))
+        if checkpoints:
+            dataset_dir = os.path.join(cache_dir or get_default_cache_dir(), get_dataset_fingerprint(db))
+            print('Exporting dataset to %s...' % dataset_dir)
+            export_dataset(dataset_dir, *dataset)
+    if checkpoints:
+        complete_checkpoint('dataset', run_id)
+    return dataset
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description="Crawls, preprocesses and vectorizes articles and prepares the dataset in a single pass,\n"
+                    "passing batches of articles from one stage to the next without reading them back from the\n"
+                    "database.\n",
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--from-stage', choices=stage_names, default='crawl',
+        help='First stage to run, reading its input from the database (default: crawl)'
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='Start at the first stage the previous run with checkpoints didn\'t complete'
+    )
+    parser.add_argument(
+        '--full', action='store_true',
+        help='Preprocess and vectorize all articles again, replacing the vocabulary and feature vectors'
+    )
+    parser.add_argument(
+        '--no-checkpoints', action='store_true',
+        help='Don\'t save processed articles, feature vectors and progress to the database; requires --full'
+    )
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help='Maximum number of articles to download concurrently (default: 4)'
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=1000,
+        help='Number of articles per batch (default: 1000)'
+    )
+    parser.add_argument(
+        '--processes', type=int, default=None,
+        help='Number of worker processes to preprocess articles with (default: number of CPUs)'
+    )
+    parser.add_argument(
+        '--features', choices=['exact', 'hashing'], default='exact',
+        help="'exact' to map each word of a vocabulary to its own feature,\n"
+             "'hashing' to hash words into a fixed number of features without a vocabulary (default: exact)"
+    )
+    parser.add_argument(
+        '--num-features', type=int, default=default_num_hashed_features,
+        help='Number of features to hash words into in hashing mode (default: %d)' % default_num_hashed_features
+    )
+    parser.add_argument(
+        '--alternate-sign', action='store_true',
+        help='Use the sign of the hash of each word as the sign of its count in hashing mode'
+    )
+    parser.add_argument(
+        '--encode-tokens', action='store_true',
+        help='Store the preprocessed title and text as IDs of tokens in the shared token dictionary'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        help='Directory of the on-disk dataset cache (default: cache/datasets in the project directory)'
+    )
+    parser.add_argument(
+        '--export-dir',
+        help='Directory to export the dataset to'
+    )
+    parser.add_argument(
+        '--evaluate', action='store_true',
+        help='Evaluate a multinomial Naive Bayes classifier and a linear SVM on the dataset'
+    )
+    parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='Number of worker processes to distribute the cross-validation fits over, -1 to use all CPUs (default: 1)'
+    )
+    parser.add_argument(
+        '--seed', type=int, default=None,
+        help='Seed for shuffling the cross-validation folds, making the evaluation reproducible'
+    )
+    # '--cache-dir' is the dataset cache, so the options of the page cache are '--page-cache-dir' and '--page-cache-size'
+    add_client_arguments(parser, cache_option_prefix='page-')
+    metrics.add_instrumentation_arguments(parser)
+    connection.add_connection_arguments(parser)
+    args = parser.parse_args()
+    configure_client_arguments(parser, args)
+    if args.no_checkpoints and not args.full and args.from_stage != 'dataset':
+        parser.error('--no-checkpoints requires --full.')
+    if args.resume and (args.no_checkpoints or args.full):
+        parser.error('--resume cannot be combined with --no-checkpoints or --full.')
+    metrics.configure_instrumentation(args)
+    connection.configure_connection(args)
+
+    start_stage = args.from_stage
+    if args.resume:
+        start_stage = get_resume_stage()
+        if start_stage is None:
+            print('The previous run completed all of its stages, nothing to resume.')
+            exit()
+        print('Resuming at stage %s...' % start_stage)
+
+    try:
+        load_stop_words()
+    except LookupError as e:
+        print(e)
+        exit()
+
+    with create_client(args) as http_client, metrics.stage('pipeline'):
+        result = run_pipeline(start_stage, args.full, not args.no_checkpoints, http_client, args.workers,
+                              args.batch_size, args.processes or cpu_count(), args.features, args.num_features,
+                              args.alternate_sign, args.cache_dir, args.encode_tokens)
+    print('Prepared dataset of %d feature vectors with %d features.' % result.feature_vectors.shape)
+    if args.export_dir:
+        export_dataset(args.export_dir, *result)
+    if args.evaluate:
+        with metrics.stage('evaluate'):
+            # Features hashed with alternate signs can be negative, which multinomial Naive Bayes doesn't accept
+            feature_counts = result.feature_vectors.data
+            for classifier in get_classifiers_to_evaluate(feature_counts.size > 0 and feature_counts.min() < 0):
+                evaluate_classifier_using_repeated_cross_validation(classifier, result.feature_vectors,
+                                                                    result.target_values, n_jobs=args.jobs,
+                                                                    random_state=args.seed)
+    metrics.finish_instrumentation(args, 'pipeline')
@@ -0,0 +1,145 @@
+from bson import ObjectId
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from pipeline import run_pipeline
+from pipeline.run_pipeline import Vectorizer, build_dataset, get_resume_stage
+
+
+class TestRunPipeline(TestCase):
+    def setUp(self):
+        self.batches = [
+            [{'_id': ObjectId(), 'title': 'a news article', 'text': 'very interesting content', 'num_comments': 3}],
+            [{'_id': ObjectId(), 'title': 'viral piece of news', 'text': 'news content', 'num_comments': 40}]
+        ]
+        self.target_classes = {'few': {'start': 0, 'end': 10}, 'many': {'start': 11, 'end': 1000}}
+
+    def test_vectorizer_extends_vocabulary_with_new_terms_of_each_batch(self):
+        vectorizer = Vectorizer()
+        _, new_terms = vectorizer.vectorize(self.batches[0])
+        self.assertListEqual(['a', 'article', 'content', 'interesting', 'news', 'very'], new_terms)
+        feature_vectors, new_terms = vectorizer.vectorize(self.batches[1])
+        self.assertListEqual(['of', 'piece', 'viral'], new_terms)
+        self.assertEqual(9, vectorizer.get_number_of_features())
+        self.assertEqual([2, 4, 6, 7, 8], feature_vectors[0]['feature_indices'])
+        self.assertEqual([1, 2, 1, 1, 1], feature_vectors[0]['feature_counts'])
+
+    def test_build_dataset_gives_all_batches_the_final_number_of_features(self):
+        vectorizer = Vectorizer()
+        dataset = build_dataset((vectorizer.vectorize(articles)[0] for articles in self.batches), vectorizer,
+                                self.target_classes)
+        self.assertEqual((2, 9), dataset.feature_vectors.shape)
+        self.assertListEqual([3, 40], dataset.num_comments.tolist())
+        self.assertListEqual(['few', 'many'], list(dataset.target_values))
+        self.assertEqual(vectorizer.vocabulary, dataset.vocabulary)
+
+    def test_hashing_vectorizer_has_fixed_number_of_features(self):
+        vectorizer = Vectorizer('hashing', num_features=16)
+        feature_vectors, new_terms = vectorizer.vectorize(self.batches[0])
+        self.assertListEqual([], new_terms)
+        self.assertEqual(16, vectorizer.get_number_of_features())
+        self.assertTrue(all(index < 16 for index in feature_vectors[0]['feature_indices']))
+
+    def test_vectorizer_with_fixed_vocabulary_ignores_new_terms(self):
+        vectorizer = Vectorizer(vocabulary=['news', 'viral'], fixed_vocabulary=True)
+        feature_vectors, new_terms = vectorizer.vectorize(self.batches[1])
+        self.assertListEqual([], new_terms)
+        self.assertListEqual(['news', 'viral'], vectorizer.vocabulary)
+        self.assertEqual([0, 1], feature_vectors[0]['feature_indices'])
+        self.assertEqual([2, 1], feature_vectors[0]['feature_counts'])
+
+
+class CheckpointsCollection(object):
+    """
+    In-memory stand-in for the 'pipeline_checkpoints' collection, supporting the operations of the checkpoints.
+    """
+    def __init__(self):
+        self.documents = {}
+
+    def replace_one(self, query, document, upsert=False):
+        self.documents[query['_id']] = dict(document, _id=query['_id'])
+
+    def update_one(self, query, update):
+        document = self.documents.get(query['_id'])
+        if document is None or document['run_id'] != query['run_id']:
+            return
+        for key, value in update.get('$inc', {}).items():
+            document[key] += value
+        document.update(update.get('$set', {}))
+
+    def find(self):
+        return list(self.documents.values())
+
+
+class TestCheckpoints(TestCase):
+    def setUp(self):
+        self.crawled_batches = [
+            [{'_id': ObjectId(), 'title': 'kabinet valt', 'text': 'kamer stemde tegen', 'num_comments': 3}],
+            [{'_id': ObjectId(), 'title': 'oranje wint', 'text': 'voetbal', 'num_comments': 40}]
+        ]
+        self.processed_articles = []
+        self.vectorized_ids = set()
+        self.checkpoints = CheckpointsCollection()
+        self.crawl = self.patch('crawl', side_effect=lambda *args: iter(self.crawled_batches))
+        self.save_feature_vectors = self.patch('save_feature_vectors')
+        self.load_cached_dataset = self.patch('load_cached_dataset', return_value='dataset')
+        self.patch('checkpoints_collection', self.checkpoints)
+        self.patch('load_token_dictionary', return_value=None)
+        self.patch('ensure_processed_index')
+        self.patch('get_articles_to_preprocess', return_value=[])
+        self.patch('load_stop_words', return_value=set())
+        self.patch('save_processed_articles', side_effect=self.save_processed_articles)
+        self.patch('start_vectorization', side_effect=lambda *args: (Vectorizer(), ObjectId(), True))
+        self.patch('get_articles_to_vectorize', side_effect=lambda: [
+            article for article in self.processed_articles if article['_id'] not in self.vectorized_ids
+        ])
+        self.patch('mark_articles_vectorized', side_effect=lambda articles: self.vectorized_ids.update(
+            article['_id'] for article in articles
+        ))
+        self.patch('naive_bayes_collection')
+        self.patch('db')
+
+    def patch(self, name, new=None, **kwargs):
+        patcher = patch.object(run_pipeline, name, new if new is not None else Mock(**kwargs))
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def save_processed_articles(self, processed_articles):
+        for processed_article in processed_articles:
+            processed_article['_id'] = ObjectId()
+        self.processed_articles.extend(processed_articles)
+        return processed_articles
+
+    def get_checkpoint(self, stage):
+        checkpoint = self.checkpoints.documents[stage]
+        return checkpoint['num_items'], checkpoint['completed']
+
+    def test_interrupted_run_is_resumed_at_first_incomplete_stage(self):
+        self.save_feature_vectors.side_effect = [None, RuntimeError('interrupted')]
+        self.assertRaises(RuntimeError, run_pipeline.run_pipeline, batch_size=1)
+        self.assertEqual((2, False), self.get_checkpoint('crawl'))
+        self.assertEqual((2, False), self.get_checkpoint('preprocess'))
+        self.assertEqual((1, False), self.get_checkpoint('vectorize'))
+        self.assertEqual((0, False), self.get_checkpoint('dataset'))
+        self.assertEqual('crawl', get_resume_stage())
+
+        # No new articles are crawled, the saved article that wasn't vectorized yet is read back from the database
+        self.crawled_batches = []
+        self.save_feature_vectors.side_effect = None
+        self.assertEqual('dataset', run_pipeline.run_pipeline(get_resume_stage(), batch_size=1))
+        self.assertEqual(2, len(self.processed_articles))
+        self.assertSetEqual({article['_id'] for article in self.processed_articles}, self.vectorized_ids)
+        self.assertEqual((1, True), self.get_checkpoint('vectorize'))
+        self.assertIsNone(get_resume_stage())
+
+    def test_resumed_run_skips_completed_stages(self):
+        self.load_cached_dataset.side_effect = [OSError('interrupted'), 'dataset']
+        self.assertRaises(OSError, run_pipeline.run_pipeline, batch_size=1)
+        self.assertEqual((2, True), self.get_checkpoint('vectorize'))
+        self.assertEqual('dataset', get_resume_stage())
+
+        self.assertEqual('dataset', run_pipeline.run_pipeline(get_resume_stage(), batch_size=1))
+        self.crawl.assert_called_once()
+        self.assertEqual(2, self.save_feature_vectors.call_count)
+        self.assertEqual((2, True), self.get_checkpoint('vectorize'))
+        self.assertIsNone(get_resume_stage())
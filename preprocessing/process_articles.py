@@ -1,73 +1,294 @@
 """
 Script to preprocess NU.nl news articles and save them to a separate collection.
 Preprocessing involves converting text to lowercase and removing stopwords.
+Articles are read from the source cursor in batches, which are preprocessed by a pool of worker processes
+and inserted as soon as they are done, so memory use doesn't grow with the number of articles.
+Preprocessed articles are marked with a 'preprocessed' flag, so each run only selects newly eligible articles.
+The flag is set after the preprocessed articles are inserted. If a run stops in between, the next run preprocesses
+those articles again; a unique index on the reference to the original article rejects the second copy,
+after which the articles are marked as usual.
+Optionally, the preprocessed title and text are stored as arrays of token IDs of the shared token dictionary
+instead of as strings, see 'preprocessing/token_dictionary.py'.
 """
 import bson
 import re
+import time
 
+from argparse import ArgumentParser
+from argparse import RawTextHelpFormatter
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool, cpu_count
 from nltk.corpus import stopwords
-from pymongo import MongoClient
-from pymongo.collection import Collection
-from pymongo.database import Database
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from instrumentation import metrics
+from preprocessing.token_dictionary import TokenDictionary, is_encoded, token_ids_dtype, token_ids_fields, \
+    tokens_collection_name
+from storage import connection
 
-db_name = 'nu'
 collection_name = 'articles'
 processed_collection_name = 'articles_processed'
 
-db = Database(MongoClient(), db_name)
-collection = Collection(db, collection_name)
-processed_collection = Collection(db, processed_collection_name)
+collection = connection.get_collection(collection_name)
+processed_collection = connection.get_collection(processed_collection_name)
+tokens_collection = connection.get_collection(tokens_collection_name)
+feature_vectors_collection = connection.get_collection('feature_vectors')
+
+duplicate_key_error_code = 11000
+
+token_separator_pattern = re.compile('\\W+')
 
 
 def get_articles_to_preprocess():
     """
     :return:
-        articles in collection that 1) aren't yet referenced by a preprocessed version in processed_collection
+        articles in collection that 1) haven't been marked as preprocessed yet
         and 2) have had their number of comments updated
     """
+    ensure_indexes()
+    mark_preprocessed_articles()
+    return collection.find({'preprocessed': None, 'num_comments': {'$ne': None}},
+                           {'title': 1, 'text': 1, 'num_comments': 1})
+
+
+def ensure_indexes():
+    """
+    Creates the index used to select articles that haven't been preprocessed yet, if it doesn't exist yet.
+    """
+    collection.create_index([('preprocessed', 1), ('num_comments', 1)])
+    ensure_processed_index()
+
+
+def ensure_processed_index():
+    """
+    Creates a unique index on the reference to the original article of processed articles, if it doesn't exist yet,
+    so an article is never saved twice. Duplicates saved by earlier versions are removed first.
+    """
+    try:
+        processed_collection.create_index('article_id', unique=True)
+    except OperationFailure as e:
+        if e.code != duplicate_key_error_code:
+            raise
+        remove_duplicate_processed_articles()
+        processed_collection.create_index('article_id', unique=True)
+
+
+def remove_duplicate_processed_articles():
+    """
+    Removes all but the first processed article of each original article, along with the feature vectors
+    of the removed ones.
+    """
+    duplicates = processed_collection.aggregate([
+        {'$group': {'_id': '$article_id', 'processed_ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    duplicate_ids = [processed_id for duplicate in duplicates
+                     for processed_id in sorted(duplicate['processed_ids'])[1:]]
+    remaining_ids = iter(duplicate_ids)
+    for batch in iter(lambda: list(islice(remaining_ids, 1000)), []):
+        processed_collection.delete_many({'_id': {'$in': batch}})
+        feature_vectors_collection.delete_many(
+            {'article_processed_id': {'$in': [bson.DBRef(processed_collection_name, _id) for _id in batch]}}
+        )
+    if duplicate_ids:
+        print('Removed %d duplicate preprocessed articles.' % len(duplicate_ids))
+
+
+def mark_preprocessed_articles(batch_size=1000):
+    """
+    Marks articles preprocessed by earlier versions, which only referenced them from processed_collection.
+    Does nothing once any article has been marked as preprocessed.
+    :param batch_size: number of articles to mark at once
+    """
+    if collection.find_one({'preprocessed': True}, {'_id': 1}) is not None:
+        return
     processed_articles = processed_collection.find({'article_id': {'$exists': 1}}, {'article_id': 1})
-    processed_ids = [processed_article['article_id'].id for processed_article in processed_articles]
-    print('Skipping %d preprocessed articles...' % len(processed_ids))
-    return collection.find({'_id': {'$nin': processed_ids}, 'num_comments': {'$ne': None}})
+    processed_ids = (processed_article['article_id'].id for processed_article in processed_articles)
+    num_marked = 0
+    for batch in iter(lambda: list(islice(processed_ids, batch_size)), []):
+        num_marked += collection.update_many({'_id': {'$in': batch}}, {'$set': {'preprocessed': True}}).modified_count
+    if num_marked > 0:
+        print('Marked %d previously preprocessed articles.' % num_marked)
 
 
-def preprocess(articles):
+def preprocess(articles, batch_size=1000, processes=None, encode_tokens=False):
     """
     Applies preprocessing on articles using Dutch stopwords.
-    Saves the preprocessed documents to processed_collection.
+    Saves the preprocessed documents to processed_collection in batches of at most 'batch_size' documents.
     :param articles: articles to preprocess
+    :param batch_size: number of articles to preprocess and insert at once
+    :param processes: number of worker processes to use, defaults to the number of CPUs
+    :param encode_tokens: whether to store the preprocessed title and text as token IDs instead of strings
     """
     try:
-        stop_words = stopwords.words('dutch')
+        stop_words = load_stop_words()
     except LookupError as e:
         print(e)
         exit()
 
+    ensure_processed_index()
     print('Preprocessing %d articles...' % articles.count())
-    processed_articles = []
-    for article in articles:
-        processed_article = dict(
+    start_time = time.perf_counter()
+    processes = processes or cpu_count()
+    articles = iter(articles)
+    batches = metrics.timed(iter(lambda: list(islice(articles, batch_size)), []),
+                            'mongo_read_seconds', collection=collection_name)
+    if processes == 1:
+        processed_batches = (preprocess_batch(batch, stop_words) for batch in batches)
+    else:
+        processed_batches = preprocess_in_pool(batches, stop_words, processes)
+    token_dictionary = TokenDictionary.load(tokens_collection) if encode_tokens else None
+    num_saved = 0
+    num_tokens = 0
+    for processed_articles in processed_batches:
+        num_tokens += count_tokens(processed_articles)
+        if token_dictionary is not None:
+            encode_processed_articles(processed_articles, token_dictionary)
+            token_dictionary.save(tokens_collection)
+        num_saved += len(save_processed_articles(processed_articles))
+    metrics.increment('articles_preprocessed_total', num_saved)
+    metrics.increment('tokens_total', num_tokens)
+    metrics.set_gauge('preprocess_tokens_per_second', num_tokens / max(time.perf_counter() - start_time, 1e-6))
+    print('Saved %d preprocessed articles.' % num_saved)
+
+
+def load_stop_words():
+    """
+    :return: frozenset of Dutch stopwords
+    :raises LookupError: if the NLTK stopwords corpus isn't installed
+    """
+    return frozenset(stopwords.words('dutch'))
+
+
+def preprocess_in_pool(batches, stop_words, processes):
+    """
+    :param batches: iterable of lists of articles to preprocess
+    :param stop_words: set of stopwords to filter text by
+    :param processes: number of worker processes to use
+    :return: generator of lists of preprocessed articles, in the order of batches
+    """
+    with Pool(processes) as pool:
+        # Limit the number of batches in flight, so memory use stays bounded if the database is faster than
+        # the workers
+        max_pending = 2 * processes
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.apply_async(preprocess_batch, (batch, stop_words)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def preprocess_batch(articles, stop_words):
+    """
+    :param articles: list of articles to preprocess
+    :param stop_words: set of stopwords to filter text by
+    :return: list of preprocessed articles, referencing the original articles
+    """
+    return [
+        dict(
             article_id=bson.DBRef(collection_name, article['_id']),
             title=preprocess_text(article.get('title', ''), stop_words),
             text=preprocess_text(article.get('text', ''), stop_words),
             num_comments=article.get('num_comments', 0)
         )
-        processed_articles.append(processed_article)
-    if processed_articles:
-        processed_collection.insert_many(processed_articles)
-        print('Saved preprocessed articles.')
+        for article in articles
+    ]
+
+
+def save_processed_articles(processed_articles):
+    """
+    Inserts preprocessed articles into processed_collection, then marks the original articles as preprocessed.
+    Preprocessed articles whose original article already has one, because an earlier run stopped before marking it,
+    are skipped, but their original articles are still marked. This relies on the index created by
+    'ensure_processed_index', which must be called once before saving.
+    :param processed_articles: list of preprocessed articles to insert into processed_collection
+    :return: list of the inserted preprocessed articles, each with its '_id'
+    """
+    if not processed_articles:
+        return []
+    try:
+        with metrics.timer('mongo_write_seconds', collection=processed_collection_name):
+            processed_collection.insert_many(processed_articles, ordered=False)
+        inserted_articles = processed_articles
+    except BulkWriteError as e:
+        # Ignore duplicate key errors, raise all others
+        if any(error['code'] != duplicate_key_error_code for error in e.details['writeErrors']):
+            raise
+        failed_indexes = set(error['index'] for error in e.details['writeErrors'])
+        inserted_articles = [processed_article for index, processed_article in enumerate(processed_articles)
+                             if index not in failed_indexes]
+    article_ids = [processed_article['article_id'].id for processed_article in processed_articles]
+    with metrics.timer('mongo_write_seconds', collection=collection_name):
+        collection.update_many({'_id': {'$in': article_ids}}, {'$set': {'preprocessed': True}})
+    return inserted_articles
+
+
+def encode_processed_articles(processed_articles, token_dictionary):
+    """
+    Replaces the title and text of preprocessed articles by the IDs of their tokens, adding new tokens to
+    token_dictionary. The dictionary must be saved before the articles are.
+    :param processed_articles: list of preprocessed articles, which is modified in place
+    :param token_dictionary: TokenDictionary to look up and add tokens in
+    """
+    with metrics.timer('encode_tokens_seconds'):
+        for processed_article in processed_articles:
+            for field, token_ids_field in token_ids_fields.items():
+                processed_article[token_ids_field] = token_dictionary.encode(processed_article.pop(field).split(' '))
+
+
+def count_tokens(processed_articles):
+    """
+    :param processed_articles: list of preprocessed articles, whose title and text may be stored as token IDs
+    :return: total number of tokens in the titles and texts of processed_articles
+    """
+    num_tokens = 0
+    for processed_article in processed_articles:
+        if is_encoded(processed_article):
+            num_tokens += sum(len(processed_article[field]) for field in token_ids_fields.values()) // \
+                token_ids_dtype.itemsize
+        else:
+            num_tokens += len(processed_article['title'].split()) + len(processed_article['text'].split())
+    return num_tokens
 
 
 def preprocess_text(text, stop_words):
     """
     :param text: text to preprocess
-    :param stop_words: list of stopwords to filter text by
+    :param stop_words: set of stopwords to filter text by
     :return: a lowercase version of text, split on punctuation marks and filtered by stop_words
     """
     text = text.lower()
-    text = re.split('\\W+', text)
+    text = token_separator_pattern.split(text)
     return ' '.join(word for word in text if word not in stop_words)
 
 
 if __name__ == '__main__':
-    preprocess(get_articles_to_preprocess())
+    parser = ArgumentParser(
+        description="Preprocesses articles that have had their number of comments updated.\n",
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        '--batch-size', type=int, default=1000,
+        help='Number of articles to preprocess and insert at once (default: 1000)'
+    )
+    parser.add_argument(
+        '--processes', type=int, default=None,
+        help='Number of worker processes to use (default: number of CPUs)'
+    )
+    parser.add_argument(
+        '--encode-tokens', action='store_true',
+        help='Store the preprocessed title and text as IDs of tokens in the shared token dictionary,\n'
+             'which takes less space and speeds up creating the vocabulary and feature vectors'
+    )
+    metrics.add_instrumentation_arguments(parser)
+    connection.add_connection_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure_instrumentation(args)
+    connection.configure_connection(args)
+
+    with metrics.stage('preprocess'):
+        preprocess(get_articles_to_preprocess(), args.batch_size, args.processes, args.encode_tokens)
+    metrics.finish_instrumentation(args, 'preprocess')
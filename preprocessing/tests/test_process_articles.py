@@ -0,0 +1,102 @@
+from bson import DBRef, ObjectId
+from pymongo.errors import BulkWriteError, OperationFailure
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from preprocessing import process_articles
+from preprocessing.process_articles import duplicate_key_error_code, ensure_processed_index, \
+    mark_preprocessed_articles, preprocess_batch, preprocess_text, save_processed_articles
+
+
+class TestProcessArticles(TestCase):
+    def setUp(self):
+        self.stop_words = frozenset(['de', 'het', 'een'])
+
+    def test_preprocess_text_lowercases_and_removes_stopwords(self):
+        self.assertEqual('kat zit op mat', preprocess_text('De kat zit op de mat', self.stop_words))
+
+    def test_preprocess_text_splits_on_punctuation(self):
+        self.assertEqual('kat mat', preprocess_text('kat,mat', self.stop_words))
+
+    def test_preprocess_batch_references_original_articles(self):
+        article_id = ObjectId()
+        processed_articles = preprocess_batch(
+            [{'_id': article_id, 'title': 'Een titel', 'text': 'Het verhaal', 'num_comments': 3}], self.stop_words
+        )
+        self.assertEqual(article_id, processed_articles[0]['article_id'].id)
+        self.assertEqual('titel', processed_articles[0]['title'])
+        self.assertEqual('verhaal', processed_articles[0]['text'])
+        self.assertEqual(3, processed_articles[0]['num_comments'])
+
+
+class TestSaveProcessedArticles(TestCase):
+    def setUp(self):
+        self.collection = Mock()
+        self.processed_collection = Mock()
+        self.feature_vectors_collection = Mock()
+        for name in ('collection', 'processed_collection', 'feature_vectors_collection'):
+            patcher = patch.object(process_articles, name, getattr(self, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.article_ids = [ObjectId(), ObjectId()]
+        self.processed_articles = [{'article_id': DBRef('articles', article_id), 'title': 'titel', 'text': 'verhaal'}
+                                   for article_id in self.article_ids]
+
+    def test_save_processed_articles_marks_articles_after_inserting(self):
+        manager = Mock()
+        manager.attach_mock(self.processed_collection.insert_many, 'insert_many')
+        manager.attach_mock(self.collection.update_many, 'update_many')
+        inserted_articles = save_processed_articles(self.processed_articles)
+        self.assertListEqual(self.processed_articles, inserted_articles)
+        # The index is ensured once per run by the callers, not for every batch
+        self.processed_collection.create_index.assert_not_called()
+        self.assertListEqual(['insert_many', 'update_many'], [name for name, _, _ in manager.mock_calls])
+        self.collection.update_many.assert_called_once_with({'_id': {'$in': self.article_ids}},
+                                                            {'$set': {'preprocessed': True}})
+
+    def test_save_processed_articles_skips_articles_saved_before_a_crash_but_marks_them(self):
+        # The first article was inserted by a run that stopped before marking it as preprocessed
+        self.processed_collection.insert_many.side_effect = BulkWriteError({
+            'writeErrors': [{'index': 0, 'code': duplicate_key_error_code, 'errmsg': 'duplicate key'}],
+            'nInserted': 1
+        })
+        inserted_articles = save_processed_articles(self.processed_articles)
+        self.assertListEqual(self.processed_articles[1:], inserted_articles)
+        self.assertFalse(self.processed_collection.insert_many.call_args[1]['ordered'])
+        self.collection.update_many.assert_called_once_with({'_id': {'$in': self.article_ids}},
+                                                            {'$set': {'preprocessed': True}})
+
+    def test_save_processed_articles_raises_other_write_errors(self):
+        self.processed_collection.insert_many.side_effect = BulkWriteError({
+            'writeErrors': [{'index': 0, 'code': 121, 'errmsg': 'document failed validation'}], 'nInserted': 1
+        })
+        with self.assertRaises(BulkWriteError):
+            save_processed_articles(self.processed_articles)
+        self.collection.update_many.assert_not_called()
+
+    def test_ensure_processed_index_removes_duplicates_saved_by_earlier_versions(self):
+        processed_ids = [ObjectId(), ObjectId(), ObjectId()]
+        self.processed_collection.create_index.side_effect = [
+            OperationFailure('duplicate key', duplicate_key_error_code), 'article_id_1'
+        ]
+        self.processed_collection.aggregate.return_value = iter([
+            {'_id': self.processed_articles[0]['article_id'], 'processed_ids': processed_ids, 'count': 3}
+        ])
+        ensure_processed_index()
+        self.processed_collection.delete_many.assert_called_once_with({'_id': {'$in': processed_ids[1:]}})
+        self.feature_vectors_collection.delete_many.assert_called_once_with(
+            {'article_processed_id': {'$in': [DBRef('articles_processed', _id) for _id in processed_ids[1:]]}}
+        )
+        self.assertEqual(2, self.processed_collection.create_index.call_count)
+
+    def test_mark_preprocessed_articles_migrates_articles_once(self):
+        self.collection.find_one.return_value = None
+        self.processed_collection.find.return_value = iter(self.processed_articles)
+        self.collection.update_many.return_value.modified_count = 2
+        mark_preprocessed_articles()
+        self.collection.update_many.assert_called_once_with({'_id': {'$in': self.article_ids}},
+                                                            {'$set': {'preprocessed': True}})
+
+        self.collection.find_one.return_value = {'_id': self.article_ids[0]}
+        mark_preprocessed_articles()
+        self.assertEqual(1, self.processed_collection.find.call_count)
@@ -0,0 +1,35 @@
+import numpy
+
+from unittest import TestCase
+
+from preprocessing.process_articles import count_tokens, encode_processed_articles
+from preprocessing.token_dictionary import TokenDictionary, get_token_ids, is_encoded
+
+
+class TestTokenDictionary(TestCase):
+    def test_encode_assigns_ids_in_order_of_first_occurrence(self):
+        token_dictionary = TokenDictionary(['kat'])
+        encoded = token_dictionary.encode(['mat', 'kat', 'mat', 'zit'])
+        self.assertListEqual([1, 0, 1, 2], numpy.frombuffer(encoded, dtype='<u4').tolist())
+        self.assertListEqual(['kat', 'mat', 'zit'], token_dictionary.tokens)
+
+    def test_encode_processed_articles_replaces_title_and_text(self):
+        token_dictionary = TokenDictionary()
+        processed_articles = [{'title': 'kat mat', 'text': 'mat zit kat', 'num_comments': 1}]
+        encode_processed_articles(processed_articles, token_dictionary)
+        self.assertTrue(is_encoded(processed_articles[0]))
+        self.assertNotIn('title', processed_articles[0])
+        title_ids, text_ids = get_token_ids(processed_articles[0])
+        self.assertListEqual(['kat', 'mat'], token_dictionary.decode(title_ids))
+        self.assertListEqual(['mat', 'zit', 'kat'], token_dictionary.decode(text_ids))
+        self.assertEqual(5, count_tokens(processed_articles))
+
+    def test_get_feature_map_follows_appended_terms(self):
+        token_dictionary = TokenDictionary(['kat', 'mat', 'zit'])
+        vocabulary = ['mat']
+        term_index = {'mat': 0}
+        self.assertListEqual([-1, 0, -1], token_dictionary.get_feature_map(vocabulary, term_index).tolist())
+        vocabulary.append('kat')
+        term_index['kat'] = 1
+        token_dictionary.encode(['hond'])
+        self.assertListEqual([1, 0, -1, -1], token_dictionary.get_feature_map(vocabulary, term_index).tolist())
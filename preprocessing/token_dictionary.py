@@ -0,0 +1,133 @@
+"""
+Shared dictionary of the tokens of preprocessed articles, which assigns each distinct token an integer ID.
+With it, the title and text of a processed article can be stored as packed arrays of 32-bit token IDs
+('title_token_ids' and 'text_token_ids') instead of as space-joined strings. These take less space,
+and are read as NumPy arrays without copying, so creating a vocabulary and feature vectors comes down to
+counting integers instead of splitting the strings and looking up or hashing every token again.
+
+Token IDs are assigned in the order in which tokens are first encoded and never change, so the dictionary
+is only appended to. Only one process should encode articles at a time, since each assigns new IDs on its own.
+"""
+import numpy
+import sys
+
+from array import array
+from bson import Binary
+from sklearn.utils import murmurhash3_32
+
+tokens_collection_name = 'tokens'
+token_ids_fields = {'title': 'title_token_ids', 'text': 'text_token_ids'}
+
+# Token IDs are stored little-endian, regardless of the byte order of the machine that encoded them
+token_ids_dtype = numpy.dtype('<u4')
+
+
+class TokenDictionary(object):
+    def __init__(self, tokens=None):
+        """
+        :param tokens: list of tokens, where the ID of each token is its index, defaults to an empty dictionary
+        """
+        self.tokens = list(tokens or [])
+        self.token_ids = {token: token_id for token_id, token in enumerate(self.tokens)}
+        self._num_saved = len(self.tokens)
+        self._feature_map = None
+        self._hashes = numpy.empty(0, dtype=numpy.int64)
+
+    @classmethod
+    def load(cls, collection):
+        """
+        :param collection: collection containing a document {_id: <token ID>, token: <token>} for each token
+        :return: TokenDictionary containing all tokens in collection
+        """
+        tokens = [document['token'] for document in collection.find().sort('_id', 1)]
+        return cls(tokens)
+
+    def save(self, collection):
+        """
+        Inserts the tokens added since the dictionary was loaded or last saved into collection.
+        This must be done before articles containing their IDs are saved.
+        :param collection: collection to save the tokens to
+        """
+        if self._num_saved < len(self.tokens):
+            collection.insert_many([{'_id': token_id, 'token': self.tokens[token_id]}
+                                    for token_id in range(self._num_saved, len(self.tokens))])
+            self._num_saved = len(self.tokens)
+
+    def encode(self, tokens):
+        """
+        :param tokens: iterable of tokens, which are added to the dictionary if they aren't in it yet
+        :return: BSON Binary containing the IDs of tokens as packed 32-bit unsigned integers
+        """
+        token_ids = array('I')
+        for token in tokens:
+            token_id = self.token_ids.get(token)
+            if token_id is None:
+                token_id = self.token_ids[token] = len(self.tokens)
+                self.tokens.append(token)
+            token_ids.append(token_id)
+        if sys.byteorder == 'big':
+            token_ids.byteswap()
+        return Binary(token_ids.tobytes())
+
+    def decode(self, token_ids):
+        """
+        :param token_ids: NumPy array of token IDs
+        :return: list of the tokens with these IDs
+        """
+        return [self.tokens[token_id] for token_id in token_ids.tolist()]
+
+    def get_feature_map(self, vocabulary, term_index):
+        """
+        Maps token IDs to the indices of the corresponding terms in a vocabulary.
+        The map is kept between calls with the same vocabulary list, which may only be appended to in the meantime,
+        so that only new tokens and new terms have to be looked up.
+        :param vocabulary: list of terms
+        :param term_index: dict mapping each term in vocabulary to its index
+        :return: NumPy array containing for each token ID the index of its term in vocabulary, or -1 if it isn't in it
+        """
+        if self._feature_map is not None and self._feature_map[0] is vocabulary and \
+                self._feature_map[1] <= len(vocabulary):
+            _, num_terms, feature_map = self._feature_map
+        else:
+            num_terms, feature_map = 0, numpy.empty(0, dtype=numpy.int64)
+        num_tokens = len(feature_map)
+        if num_tokens < len(self.tokens):
+            feature_map = numpy.concatenate([feature_map, numpy.array(
+                [term_index.get(token, -1) for token in self.tokens[num_tokens:]], dtype=numpy.int64
+            )])
+        # Tokens that were already mapped may have been appended to the vocabulary since
+        for index in range(num_terms, len(vocabulary)):
+            token_id = self.token_ids.get(vocabulary[index])
+            if token_id is not None:
+                feature_map[token_id] = index
+        self._feature_map = (vocabulary, len(vocabulary), feature_map)
+        return feature_map
+
+    def get_hashes(self):
+        """
+        :return: NumPy array containing the signed 32-bit MurmurHash3 of each token, indexed by token ID
+        """
+        if len(self._hashes) < len(self.tokens):
+            self._hashes = numpy.concatenate([self._hashes, numpy.array(
+                [murmurhash3_32(token, positive=False) for token in self.tokens[len(self._hashes):]],
+                dtype=numpy.int64
+            )])
+        return self._hashes
+
+
+def is_encoded(processed_article):
+    """
+    :param processed_article: preprocessed article
+    :return: whether the title and text of processed_article are stored as token IDs
+    """
+    return token_ids_fields['text'] in processed_article
+
+
+def get_token_ids(processed_article):
+    """
+    :param processed_article: preprocessed article whose title and text are stored as token IDs
+    :return: list of two NumPy arrays containing the token IDs of the title and of the text,
+        which share their memory with the stored values instead of copying them
+    """
+    return [numpy.frombuffer(processed_article[token_ids_fields[field]], dtype=token_ids_dtype)
+            for field in ('title', 'text')]
@@ -0,0 +1,222 @@
+"""
+Shared connection to the MongoDB database used by all stages of the pipeline.
+Modules refer to the database and its collections through 'get_database' and 'get_collection', which return
+stand-ins that only create the client when they are first used. Importing a module therefore doesn't connect
+or start any threads, and all stages running in one process share a single client and its connection pool.
+
+The connection is configured by the following environment variables, which scripts can override with the
+command line arguments added by 'add_connection_arguments':
+    NEWSCLASSIFICATION_MONGO_URI            MongoDB connection string (default: mongodb://localhost:27017)
+    NEWSCLASSIFICATION_MONGO_DB             name of the database (default: nu)
+    NEWSCLASSIFICATION_MONGO_POOL_SIZE      maximum number of connections in the pool (default: 10)
+    NEWSCLASSIFICATION_MONGO_BATCH_SIZE     number of documents fetched per round trip by cursors (default: 1000)
+    NEWSCLASSIFICATION_MONGO_WRITE_CONCERN  number of members that must acknowledge writes, or 'majority' (default: 1)
+    NEWSCLASSIFICATION_MONGO_JOURNAL        whether writes are only acknowledged once journaled, 0 or 1 (default: 0)
+"""
+import os
+import threading
+
+from pymongo import MongoClient
+
+environment_prefix = 'NEWSCLASSIFICATION_MONGO_'
+default_settings = {
+    'uri': 'mongodb://localhost:27017',
+    'db': 'nu',
+    'pool_size': 10,
+    'batch_size': 1000,
+    'write_concern': '1',
+    'journal': False
+}
+
+_lock = threading.Lock()
+_settings = {}
+_client = None
+
+
+def read_environment(environment=None):
+    """
+    :param environment: dict of environment variables, defaults to os.environ
+    :return: dict of the default settings, overridden by those given by environment
+    """
+    environment = os.environ if environment is None else environment
+    settings = dict(default_settings)
+    for name, default in default_settings.items():
+        value = environment.get(environment_prefix + name.upper())
+        if value is None:
+            continue
+        if isinstance(default, bool):
+            settings[name] = value.lower() in ('1', 'true', 'yes')
+        elif isinstance(default, int):
+            settings[name] = int(value)
+        else:
+            settings[name] = value
+    return settings
+
+
+def configure(**settings):
+    """
+    Overrides connection settings. A client that was already created is closed,
+    so the next use of the database creates one with the new settings.
+    :param settings: settings named as in 'default_settings'; settings that are None are left unchanged
+    """
+    global _client
+    unknown = set(settings).difference(default_settings)
+    if unknown:
+        raise ValueError('Unknown connection settings: %s.' % ', '.join(sorted(unknown)))
+    with _lock:
+        if not _settings:
+            _settings.update(read_environment())
+        _settings.update((name, value) for name, value in settings.items() if value is not None)
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
+
+def get_settings():
+    """
+    :return: dict of the current connection settings
+    """
+    with _lock:
+        if not _settings:
+            _settings.update(read_environment())
+        return dict(_settings)
+
+
+def get_client():
+    """
+    :return: the shared MongoClient, which is created on the first call
+    """
+    global _client
+    settings = get_settings()
+    with _lock:
+        if _client is None:
+            write_concern = settings['write_concern']
+            options = {'maxPoolSize': settings['pool_size'],
+                       'w': int(write_concern) if write_concern.isdigit() else write_concern}
+            if settings['journal']:
+                options['j'] = True
+            # Servers are only contacted by the first operation, not by creating the client
+            _client = MongoClient(settings['uri'], connect=False, **options)
+        return _client
+
+
+def close():
+    """
+    Closes the shared client, if it was created. The next use of the database creates a new one.
+    """
+    global _client
+    with _lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
+
+class LazyDatabase(object):
+    def __init__(self, name=None):
+        """
+        Stands in for a database of the shared client, which is only created when the database is first used.
+        :param name: name of the database, defaults to the configured database
+        """
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name or get_settings()['db']
+
+    def get(self):
+        """
+        :return: pymongo Database this stands in for
+        """
+        return get_client()[self.name]
+
+    def __getitem__(self, collection_name):
+        return self.get()[collection_name]
+
+    def __getattr__(self, attribute):
+        return getattr(self.get(), attribute)
+
+
+class LazyCollection(object):
+    def __init__(self, name, db_name=None):
+        """
+        Stands in for a collection of the shared client, which is only created when the collection is first used.
+        Cursors returned by 'find' fetch the configured batch size of documents per round trip.
+        :param name: name of the collection
+        :param db_name: name of the database containing the collection, defaults to the configured database
+        """
+        self.name = name
+        self.database = LazyDatabase(db_name)
+
+    def get(self):
+        """
+        :return: pymongo Collection this stands in for
+        """
+        return self.database.get()[self.name]
+
+    def find(self, *args, **kwargs):
+        kwargs.setdefault('batch_size', get_settings()['batch_size'])
+        return self.get().find(*args, **kwargs)
+
+    def __getattr__(self, attribute):
+        return getattr(self.get(), attribute)
+
+
+def get_database(name=None):
+    """
+    :param name: name of the database, defaults to the configured database
+    :return: LazyDatabase standing in for the database
+    """
+    return LazyDatabase(name)
+
+
+def get_collection(name, db_name=None):
+    """
+    :param name: name of the collection
+    :param db_name: name of the database containing the collection, defaults to the configured database
+    :return: LazyCollection standing in for the collection
+    """
+    return LazyCollection(name, db_name)
+
+
+def add_connection_arguments(parser, database=True):
+    """
+    Adds the command line arguments used by 'configure_connection' to parser.
+    :param parser: ArgumentParser of a script
+    :param database: whether to add '--mongo-db', for scripts that don't take the name of the database otherwise
+    """
+    parser.add_argument(
+        '--mongo-uri',
+        help='MongoDB connection string (default: $%sURI or %s)' % (environment_prefix, default_settings['uri'])
+    )
+    if database:
+        parser.add_argument(
+            '--mongo-db',
+            help='Name of the database (default: $%sDB or %s)' % (environment_prefix, default_settings['db'])
+        )
+    parser.add_argument(
+        '--mongo-pool-size', type=int,
+        help='Maximum number of connections to MongoDB (default: $%sPOOL_SIZE or %d)' %
+             (environment_prefix, default_settings['pool_size'])
+    )
+    parser.add_argument(
+        '--mongo-batch-size', type=int,
+        help='Number of documents fetched per round trip by cursors (default: $%sBATCH_SIZE or %d)' %
+             (environment_prefix, default_settings['batch_size'])
+    )
+    parser.add_argument(
+        '--mongo-write-concern',
+        help="Number of members that must acknowledge writes, or 'majority'\n"
+             "(default: $%sWRITE_CONCERN or %s)" % (environment_prefix, default_settings['write_concern'])
+    )
+    parser.add_argument(
+        '--mongo-journal', action='store_true', default=None,
+        help='Only acknowledge writes once they are journaled (default: $%sJOURNAL or 0)' % environment_prefix
+    )
+
+
+def configure_connection(args):
+    """
+    :param args: parsed arguments of a parser 'add_connection_arguments' was applied to
+    """
+    configure(uri=args.mongo_uri, db=getattr(args, 'mongo_db', None), pool_size=args.mongo_pool_size,
+              batch_size=args.mongo_batch_size, write_concern=args.mongo_write_concern, journal=args.mongo_journal)
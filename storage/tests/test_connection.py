@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from storage import connection
+
+
+class TestConnection(TestCase):
+    def setUp(self):
+        connection.configure(**connection.default_settings)
+
+    def tearDown(self):
+        connection.close()
+
+    def test_read_environment_overrides_defaults(self):
+        settings = connection.read_environment({'NEWSCLASSIFICATION_MONGO_POOL_SIZE': '50',
+                                                'NEWSCLASSIFICATION_MONGO_WRITE_CONCERN': 'majority',
+                                                'NEWSCLASSIFICATION_MONGO_JOURNAL': '1'})
+        self.assertEqual(50, settings['pool_size'])
+        self.assertEqual('majority', settings['write_concern'])
+        self.assertTrue(settings['journal'])
+        self.assertEqual(connection.default_settings['uri'], settings['uri'])
+
+    def test_importing_stages_does_not_create_client(self):
+        import learning.create_vocabulary_and_vectors
+        import preprocessing.process_articles
+        self.assertEqual('articles_processed', learning.create_vocabulary_and_vectors.processed_collection.name)
+        self.assertEqual('nu', preprocessing.process_articles.collection.database.name)
+        self.assertIsNone(connection._client)
+
+    def test_client_is_shared_and_uses_configured_settings(self):
+        connection.configure(pool_size=5, write_concern='majority', db='test')
+        collection = connection.get_collection('articles')
+        self.assertIs(connection.get_client(), collection.get().database.client)
+        self.assertEqual('test', collection.get().database.name)
+        self.assertEqual(5, connection.get_client().options.pool_options.max_pool_size)
+        self.assertEqual({'w': 'majority'}, collection.get().write_concern.document)
+
+    def test_configure_replaces_client(self):
+        client = connection.get_client()
+        connection.configure(pool_size=20)
+        self.assertIsNot(client, connection.get_client())
+
+    def test_configure_rejects_unknown_settings(self):
+        self.assertRaises(ValueError, connection.configure, host='localhost')